@@ -0,0 +1,118 @@
+"""
+Paginación por cursor (keyset) para historiales ordenados por fecha descendente.
+
+En vez de OFFSET + COUNT(*) (cada página profunda recorre y descarta todas las filas
+anteriores), cada página filtra a partir de la última fila vista con (fecha, id) y
+lee `por_pagina + 1` filas desde el índice correspondiente: el costo no depende de la
+profundidad. El cursor va en `?cursor=` y conserva el resto de los filtros del GET.
+
+El total es opcional y puede ser aproximado: se cuenta hasta LIMITE_CONTEO filas
+(COUNT sobre una subconsulta con LIMIT) y se informa "más de N" si se alcanza.
+"""
+import base64
+import datetime
+
+from django.db.models import Q
+
+LIMITE_CONTEO = 10000
+
+
+def _codificar(direccion, fila, campo):
+    valor = f"{direccion}|{getattr(fila, campo).isoformat()}|{fila.pk}"
+    return base64.urlsafe_b64encode(valor.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decodificar(cursor):
+    """(direccion, fecha, id) o None si el cursor no es válido (se muestra la primera página)."""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        direccion, fecha, pk = base64.urlsafe_b64decode(cursor + relleno).decode('utf-8').split('|')
+        if direccion not in ('s', 'a'):
+            return None
+        return direccion, datetime.datetime.fromisoformat(fecha), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def contar_hasta(queryset, limite=LIMITE_CONTEO):
+    """(total, aproximado): cuenta como máximo `limite` filas."""
+    total = queryset.order_by()[:limite + 1].count()
+    if total > limite:
+        return limite, True
+    return total, False
+
+
+class PaginaKeyset:
+    """Página de resultados con enlaces a la siguiente/anterior (interfaz parecida a Page)."""
+
+    def __init__(self, object_list, request, siguiente=None, anterior=None, total=None, aproximado=False):
+        self.object_list = object_list
+        self._request = request
+        self.cursor_siguiente = siguiente
+        self.cursor_anterior = anterior
+        self.total = total
+        self.total_aproximado = aproximado
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    @property
+    def has_previous(self):
+        return self.cursor_anterior is not None
+
+    def _url(self, cursor):
+        params = self._request.GET.copy()
+        params.pop('cursor', None)
+        params.pop('page', None)
+        if cursor:
+            params['cursor'] = cursor
+        return '?' + params.urlencode()
+
+    @property
+    def url_primera(self):
+        return self._url(None)
+
+    @property
+    def url_siguiente(self):
+        return self._url(self.cursor_siguiente) if self.has_next else None
+
+    @property
+    def url_anterior(self):
+        return self._url(self.cursor_anterior) if self.has_previous else None
+
+
+def paginar_keyset(request, queryset, por_pagina, campo='fecha', contar=False):
+    """Página del queryset ordenado por (-campo, -id) según `?cursor=`.
+
+    Requiere un índice que empiece por `campo` (o por los filtros de igualdad seguidos
+    de `campo`) para que cada página sea un recorrido acotado del índice.
+    """
+    total, aproximado = contar_hasta(queryset) if contar else (None, False)
+    cursor = _decodificar(request.GET.get('cursor') or '')
+    if cursor is None:
+        filas = list(queryset.order_by(f'-{campo}', '-pk')[:por_pagina + 1])
+        hay_mas, hay_menos = len(filas) > por_pagina, False
+        filas = filas[:por_pagina]
+    else:
+        direccion, fecha, pk = cursor
+        if direccion == 's':
+            # Filas más antiguas que el cursor; el rango sobre `campo` aprovecha el índice
+            filtro = Q(**{f'{campo}__lte': fecha}) & (Q(**{f'{campo}__lt': fecha}) | Q(pk__lt=pk))
+            filas = list(queryset.filter(filtro).order_by(f'-{campo}', '-pk')[:por_pagina + 1])
+            hay_mas, hay_menos = len(filas) > por_pagina, True
+            filas = filas[:por_pagina]
+        else:
+            filtro = Q(**{f'{campo}__gte': fecha}) & (Q(**{f'{campo}__gt': fecha}) | Q(pk__gt=pk))
+            filas = list(queryset.filter(filtro).order_by(campo, 'pk')[:por_pagina + 1])
+            hay_mas, hay_menos = True, len(filas) > por_pagina
+            filas = list(reversed(filas[:por_pagina]))
+    siguiente = _codificar('s', filas[-1], campo) if hay_mas and filas else None
+    anterior = _codificar('a', filas[0], campo) if hay_menos and filas else None
+    return PaginaKeyset(filas, request, siguiente, anterior, total, aproximado)
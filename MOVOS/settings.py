@@ -6,6 +6,7 @@ This settings module is environment-driven for easy Docker/production use.
 
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
     'auth_app',
     'django.contrib.humanize',
     'sucursales',
+    'jobs',
 ]
 
 AUTH_USER_MODEL = 'auth_app.User'
@@ -137,5 +139,68 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Umbral global para marcar stock como "bajo"
 LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', '2'))
 
+# Caché en proceso del escaneo de códigos en caja (entradas por worker y segundos de vigencia)
+SCAN_CACHE_SIZE = int(os.environ.get('SCAN_CACHE_SIZE', '1000'))
+SCAN_CACHE_TTL = int(os.environ.get('SCAN_CACHE_TTL', '60'))
+
+# Caché compartida entre workers (reportes). CACHE_BACKEND: locmem | file | redis
+# - file: directorio local compartido por los workers de gunicorn (CACHE_LOCATION, por defecto .cache/)
+# - redis: cualquier servidor compatible con Redis (requiere el paquete redis), p.ej. redis://127.0.0.1:6379/1
+# locmem es por proceso: con WORKERS>1 cada worker tiene su propia copia.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem').lower()
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION', '')
+_CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'movos'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+}
+if CACHE_BACKEND not in _CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"CACHE_BACKEND inválido: {CACHE_BACKEND!r} (usar locmem, file o redis)")
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': CACHE_LOCATION or _CACHE_BACKENDS[CACHE_BACKEND][1],
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', '300')),
+        'KEY_PREFIX': os.environ.get('CACHE_KEY_PREFIX', 'movos'),
+    }
+}
+
+# Sesiones. SESSION_BACKEND: db | cached_db | cache | signed_cookies
+# - cached_db: lecturas desde la caché, escrituras en la base (las sesiones sobreviven a la caché)
+# - cache: solo caché; con locmem las sesiones no se comparten entre workers ni sobreviven reinicios
+# - signed_cookies: la sesión viaja firmada en la cookie (sin almacenamiento en el servidor)
+# Las sesiones expiradas de db/cached_db se eliminan con `manage.py clearsessions` (también lo hace run_jobs).
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'db').lower()
+_SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+if SESSION_BACKEND not in _SESSION_ENGINES:
+    raise ImproperlyConfigured(
+        f"SESSION_BACKEND inválido: {SESSION_BACKEND!r} (usar db, cached_db, cache o signed_cookies)"
+    )
+SESSION_ENGINE = _SESSION_ENGINES[SESSION_BACKEND]
+# Segundos mínimos entre escrituras de `last_activity` en la sesión (AutoLogoutMiddleware)
+SESSION_ACTIVITY_RESOLUTION = int(os.environ.get('SESSION_ACTIVITY_RESOLUTION', '60'))
+
+# Trabajos en segundo plano (app jobs, procesados por `manage.py run_jobs`)
+JOBS_ARTIFACT_ROOT = os.environ.get('JOBS_ARTIFACT_ROOT') or str(BASE_DIR / 'var' / 'jobs')
+# Segundos durante los que un export idéntico (mismos filtros y datos) reutiliza el archivo generado
+JOBS_ARTIFACT_TTL = int(os.environ.get('JOBS_ARTIFACT_TTL', '3600'))
+# Trabajos "en proceso" sin latido (avance) por más de este tiempo se consideran de un worker caído y se reintentan
+JOBS_STALE_AFTER = int(os.environ.get('JOBS_STALE_AFTER', '600'))
+# Trabajos finalizados (y sus archivos) se eliminan tras este tiempo
+JOBS_RETENTION = int(os.environ.get('JOBS_RETENTION', '86400'))
+
+# Libro de stock (products.libro): `run_jobs` toma un corte al cierre de cada día local.
+# Un corte resume el libro hasta este número de segundos atrás, para no dejar fuera
+# movimientos de transacciones que aún no confirman
+STOCK_SNAPSHOT_MARGIN = int(os.environ.get('STOCK_SNAPSHOT_MARGIN', '300'))
+
+# Reportes: leer KPIs diarios desde el resumen materializado (reports.ResumenVentaDiaria)
+REPORTS_USE_ROLLUP = os.environ.get('REPORTS_USE_ROLLUP', 'true').lower() in ('1', 'true', 'yes')
+
 # Auto logout delay
 AUTO_LOGOUT_DELAY = 7200  # 2 horas en segundos
\ No newline at end of file
@@ -19,5 +19,6 @@ urlpatterns = [
     path('', redirect_to_login, name='redirect_to_login'),
     path('login/', views.custom_login, name='login'),
     path('sucursales/', include('sucursales.urls', namespace='sucursales')),
+    path('jobs/', include('jobs.urls', namespace='jobs')),
 
 ]
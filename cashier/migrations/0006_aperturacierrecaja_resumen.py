@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:42
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def resumir_cajas_cerradas(apps, schema_editor):
+    """Persiste transferencias y cantidad de ventas de las cajas ya cerradas (una consulta agrupada)."""
+    AperturaCierreCaja = apps.get_model('cashier', 'AperturaCierreCaja')
+    Venta = apps.get_model('cashier', 'Venta')
+    cajas = {caja.id: caja for caja in AperturaCierreCaja.objects.filter(estado='cerrada')}
+    filas = Venta.objects.filter(caja_id__in=cajas.keys()).values('caja_id').annotate(
+        transferencia=Sum('total', filter=Q(forma_pago='transferencia')), num_ventas=Count('id'),
+    ).order_by()
+    for fila in filas:
+        caja = cajas[fila['caja_id']]
+        caja.total_ventas_transferencia = fila['transferencia'] or 0
+        caja.num_ventas = fila['num_ventas']
+    for caja in cajas.values():
+        if caja.num_ventas is None:
+            caja.num_ventas = 0
+    AperturaCierreCaja.objects.bulk_update(cajas.values(), ['total_ventas_transferencia', 'num_ventas'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0005_unique_open_caja_per_sucursal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aperturacierrecaja',
+            name='num_ventas',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aperturacierrecaja',
+            name='total_ventas_transferencia',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(resumir_cajas_cerradas, migrations.RunPython.noop),
+    ]
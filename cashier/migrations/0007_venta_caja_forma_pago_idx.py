@@ -0,0 +1,20 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0006_aperturacierrecaja_resumen'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['caja', 'forma_pago'], name='cashier_venta_caja_fpago'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0007_venta_caja_forma_pago_idx'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['fecha', 'id'], name='cashier_venta_fecha_id'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['empleado', 'fecha'], name='cashier_venta_emp_fecha'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0008_historial_keyset_idx'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aperturacierrecaja',
+            index=models.Index(fields=['vendedor', 'estado'], name='cashier_caja_vend_estado'),
+        ),
+        migrations.AddIndex(
+            model_name='aperturacierrecaja',
+            index=models.Index(fields=['apertura'], name='cashier_caja_apertura'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['sucursal', 'fecha'], name='cashier_venta_suc_fecha'),
+        ),
+    ]
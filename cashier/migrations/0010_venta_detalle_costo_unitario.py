@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:29
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def costo_historico(apps, schema_editor):
+    """Las líneas ya vendidas toman el precio de compra vigente, la única base disponible (un UPDATE)."""
+    VentaDetalle = apps.get_model('cashier', 'VentaDetalle')
+    Product = apps.get_model('products', 'Product')
+    precio = Product.objects.filter(pk=OuterRef('producto_id')).values('precio_compra')[:1]
+    VentaDetalle.objects.filter(costo_unitario__isnull=True).update(costo_unitario=Subquery(precio))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0009_indices_consultas_frecuentes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ventadetalle',
+            name='costo_unitario',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Costo Unitario'),
+        ),
+        migrations.RunPython(costo_historico, migrations.RunPython.noop),
+    ]
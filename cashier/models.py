@@ -51,12 +51,30 @@ class Venta(models.Model):
     def __str__(self):
         return f"Venta #{self.id} - Total: {self.total}"
 
+    class Meta:
+        indexes = [
+            # Resúmenes por caja (totales por forma de pago e historial de cajas)
+            models.Index(fields=['caja', 'forma_pago'], name='cashier_venta_caja_fpago'),
+            # Historial de ventas paginado por cursor (fecha, id), con y sin filtro de empleado
+            models.Index(fields=['fecha', 'id'], name='cashier_venta_fecha_id'),
+            models.Index(fields=['empleado', 'fecha'], name='cashier_venta_emp_fecha'),
+            # Reportes filtrados por sucursal y rango de fechas
+            models.Index(fields=['sucursal', 'fecha'], name='cashier_venta_suc_fecha'),
+        ]
+
 # Modelo para el detalle de la venta
 class VentaDetalle(models.Model):
     venta = models.ForeignKey(Venta, related_name='detalles', on_delete=models.CASCADE)
     producto = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='ventadetalles')
     cantidad = models.PositiveIntegerField()
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    # Precio de compra al momento de la venta: base única del costo de mercadería en los reportes
+    costo_unitario = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name="Costo Unitario")
+
+    def save(self, *args, **kwargs):
+        if self.costo_unitario is None and self.producto_id:
+            self.costo_unitario = self.producto.precio_compra or 0
+        super().save(*args, **kwargs)
     
     @property
     def subtotal(self):
@@ -79,8 +97,11 @@ class AperturaCierreCaja(models.Model):
     total_ventas_efectivo = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_ventas_credito = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_ventas_debito = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_ventas_transferencia = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     vuelto_entregado = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     efectivo_final = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Cantidad de ventas al cierre; None = sin resumen persistido (caja abierta)
+    num_ventas = models.PositiveIntegerField(null=True, blank=True)
     
     def __str__(self):
         return f"Caja {self.id} - {self.vendedor.username} - {self.estado}"
@@ -94,4 +115,10 @@ class AperturaCierreCaja(models.Model):
                 name='unique_open_caja_per_sucursal'
             )
         ]
+        indexes = [
+            # Caja abierta del vendedor (se consulta en casi cada request del cajero)
+            models.Index(fields=['vendedor', 'estado'], name='cashier_caja_vend_estado'),
+            # Historial de cajas ordenado por apertura
+            models.Index(fields=['apertura'], name='cashier_caja_apertura'),
+        ]
 
@@ -0,0 +1,299 @@
+"""
+Servicios de caja: lógica de negocio reutilizable fuera de las vistas.
+
+El checkout trabaja por conjuntos: todos los productos del carrito se cargan
+en una sola consulta bloqueada (y sus filas de stock en otra), se validan en memoria y el stock se descuenta
+con un único UPDATE (y se asienta con un único INSERT en el libro de stock), de
+modo que la cantidad de queries no depende del tamaño del carrito. El carrito se arma en el navegador y `cotizar_carrito` lo revalida
+(precios y stock) con la misma consulta, sin escribir. El resumen de caja (totales por forma de pago, vuelto y cantidad de
+ventas) sale de una sola consulta con agregación condicional y queda persistido
+al cerrar la caja.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FilteredRelation, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from products import libro
+from products.models import MovimientoStock, Product, StockSucursal
+from products.scan_cache import invalidar_productos
+from reports.rollup import resumen_suspendido, sumar_venta
+from .models import Venta, VentaDetalle
+
+FORMAS_PAGO_CON_TRANSACCION = ("debito", "credito", "transferencia")
+FORMAS_PAGO = ("efectivo",) + FORMAS_PAGO_CON_TRANSACCION
+
+
+def format_currency(value):
+    try:
+        return "{:,.0f}".format(float(value)).replace(",", ".")
+    except Exception:
+        return value
+
+
+class CheckoutError(Exception):
+    """Error de validación del checkout. `status` es el código HTTP sugerido."""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.status = status
+
+
+def _normalizar_carrito(carrito):
+    """Agrupa las líneas del carrito por producto -> {producto_id: cantidad} (respeta el orden)."""
+    cantidades = {}
+    for item in carrito:
+        try:
+            producto_id = int(item.get('producto_id'))
+            cantidad = int(item.get('cantidad', 1))
+        except (TypeError, ValueError, AttributeError):
+            raise CheckoutError("Error en los datos enviados: producto o cantidad inválidos.")
+        if cantidad <= 0:
+            raise CheckoutError("La cantidad de cada producto debe ser mayor a cero.")
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    return cantidades
+
+
+def _cargar_productos(ids, sucursal, bloquear=True):
+    """Carga (y bloquea) los productos del carrito junto a su fila StockSucursal en una sola consulta.
+
+    Cada producto queda anotado con `ss_id` / `ss_cantidad` (None si no hay fila en la sucursal).
+    El bloqueo se aplica sólo sobre Product (lado no nulo del LEFT JOIN): todo checkout que toque
+    el mismo producto queda serializado, y el descuento en sí es un UPDATE atómico con F().
+    """
+    productos = Product.objects.select_for_update(of=('self',)) if bloquear else Product.objects.all()
+    return {
+        p.id: p
+        for p in productos
+        .filter(id__in=ids)
+        .annotate(stock_local=FilteredRelation(
+            'stocks_por_sucursal',
+            condition=Q(stocks_por_sucursal__sucursal_id=sucursal.id),
+        ))
+        .annotate(ss_id=F('stock_local__id'), ss_cantidad=F('stock_local__cantidad'))
+    }
+
+
+def _bloquear_stock(productos):
+    """Bloquea (en orden de id) las filas StockSucursal de los productos y refresca `ss_cantidad`.
+
+    Transferencias, ajustes e importaciones modifican StockSucursal sin tocar Product, así
+    que el valor leído junto al producto puede estar desactualizado: la validación y la
+    variación que se asienta en el libro usan el valor bloqueado.
+    """
+    por_ss = {p.ss_id: p for p in productos if p.ss_id is not None}
+    if not por_ss:
+        return
+    bloqueadas = dict(
+        StockSucursal.objects.select_for_update().filter(id__in=por_ss.keys())
+        .order_by('id').values_list('id', 'cantidad')
+    )
+    for ss_id, producto in por_ss.items():
+        if ss_id in bloqueadas:
+            producto.ss_cantidad = bloqueadas[ss_id]
+        else:
+            # La fila se eliminó entretanto
+            producto.ss_id = producto.ss_cantidad = None
+
+
+def _stock_disponible(producto, sucursal):
+    """Equivalente en memoria de Product.stock_en para un producto anotado por _cargar_productos."""
+    if not producto.sucursal_id:
+        # Producto sin sucursal: usar stock global
+        return producto.stock or 0
+    if producto.ss_id is not None:
+        return producto.ss_cantidad or 0
+    if producto.sucursal_id == sucursal.id:
+        return producto.stock or 0
+    return 0
+
+
+def _error_de_linea(producto, cantidad, caja):
+    """Motivo por el que la línea no se puede vender desde la caja, o None."""
+    # El producto debe pertenecer a la sucursal o ser vendible sin sucursal (permitido)
+    pertenece_o_permitido = (
+        producto.sucursal_id == caja.sucursal_id or
+        (producto.sucursal_id is None and producto.permitir_venta_sin_stock)
+    )
+    if not pertenece_o_permitido:
+        return f"El producto '{producto.nombre}' no pertenece a la sucursal de la caja abierta."
+    disponible = _stock_disponible(producto, caja.sucursal)
+    if not producto.permitir_venta_sin_stock and disponible < cantidad:
+        return f"El producto '{producto.nombre}' no tiene suficiente stock. Disponible: {disponible}."
+    return None
+
+
+def _descuento_por_id(cantidades_por_id):
+    """Expresión CASE id WHEN ... THEN cantidad para descontar varias filas en un único UPDATE."""
+    return Case(
+        *[When(id=pk, then=Value(cantidad)) for pk, cantidad in cantidades_por_id.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def procesar_checkout(caja, empleado, carrito, tipo_venta='boleta', forma_pago='efectivo',
+                      cliente_paga=Decimal('0.00'), numero_transaccion='', banco=''):
+    """Valida el carrito y registra la venta de forma atómica. Retorna la Venta creada.
+
+    Debe llamarse dentro de `transaction.atomic()`. Lanza CheckoutError ante cualquier problema
+    de validación antes de escribir en la base de datos.
+    """
+    if forma_pago in FORMAS_PAGO_CON_TRANSACCION and not numero_transaccion:
+        raise CheckoutError("El número de transacción es obligatorio para pagos con tarjeta y transferencia.")
+    if forma_pago == "transferencia" and not banco:
+        raise CheckoutError("Debe ingresar el nombre del banco para pagos por transferencia.")
+    if not carrito:
+        raise CheckoutError("El carrito está vacío.")
+
+    sucursal = caja.sucursal
+    cantidades = _normalizar_carrito(carrito)
+    productos = _cargar_productos(cantidades.keys(), sucursal)
+    faltantes = [pid for pid in cantidades if pid not in productos]
+    if faltantes:
+        raise CheckoutError(f"Error en los datos enviados o producto no encontrado: {faltantes[0]}")
+    _bloquear_stock(productos.values())
+
+    total = Decimal('0.00')
+    costo = Decimal('0.00')
+    descuentos_ss = {}       # StockSucursal.id -> cantidad
+    descuentos_legado = {}   # Product.id -> cantidad (campo 'stock')
+    movimientos = {}         # (Product.id, Sucursal.id) -> variación efectiva, para el libro de stock
+    for producto_id, cantidad in cantidades.items():
+        producto = productos[producto_id]
+        error = _error_de_linea(producto, cantidad, caja)
+        if error:
+            raise CheckoutError(error)
+        total += Decimal(str(cantidad)) * producto.precio_venta
+        costo += Decimal(str(cantidad)) * (producto.precio_compra or Decimal('0.00'))
+        # Descontar respetando inventario por sucursal; si el producto no tiene sucursal, descontar stock global
+        if producto.sucursal_id and producto.ss_id is not None:
+            descuentos_ss[producto.ss_id] = cantidad
+            movimientos[(producto.id, sucursal.id)] = -min(producto.ss_cantidad or 0, cantidad)
+        elif producto.sucursal_id is None or producto.sucursal_id == sucursal.id:
+            descuentos_legado[producto.id] = cantidad
+
+    if forma_pago == 'efectivo' and cliente_paga < total:
+        raise CheckoutError(
+            f"Pago insuficiente. El total es ${format_currency(total)}, pero el cliente pagó ${format_currency(cliente_paga)}."
+        )
+
+    # El resumen diario se suma abajo de forma incremental (sin recalcular el día completo)
+    with resumen_suspendido():
+        venta = Venta.objects.create(
+            empleado=empleado,
+            tipo_venta=tipo_venta,
+            forma_pago=forma_pago,
+            total=total,
+            cliente_paga=cliente_paga if forma_pago == "efectivo" else Decimal('0.00'),
+            vuelto_entregado=max(Decimal('0.00'), cliente_paga - total) if forma_pago == "efectivo" else Decimal('0.00'),
+            numero_transaccion=numero_transaccion if forma_pago in FORMAS_PAGO_CON_TRANSACCION else "",
+            banco=banco,
+            sucursal=sucursal,
+            caja=caja,
+        )
+    # Un UPDATE por tabla; el stock nunca queda negativo (venta sin stock lo permite)
+    if descuentos_ss:
+        StockSucursal.objects.filter(id__in=descuentos_ss.keys()).update(
+            cantidad=Greatest(F('cantidad') - _descuento_por_id(descuentos_ss), Value(0))
+        )
+    if descuentos_legado:
+        Product.objects.filter(id__in=descuentos_legado.keys()).update(
+            stock=Greatest(F('stock') - _descuento_por_id(descuentos_legado), Value(0))
+        )
+    # Los UPDATE masivos no emiten señales: invalidar la caché de escaneo ahora y al confirmar
+    vendidos = list(cantidades.keys())
+    invalidar_productos(vendidos)
+    transaction.on_commit(lambda: invalidar_productos(vendidos))
+    VentaDetalle.objects.bulk_create([
+        VentaDetalle(
+            venta=venta,
+            producto=productos[producto_id],
+            cantidad=cantidad,
+            precio_unitario=productos[producto_id].precio_venta,
+            costo_unitario=productos[producto_id].precio_compra or Decimal('0.00'),
+        )
+        for producto_id, cantidad in cantidades.items()
+    ])
+    libro.registrar(MovimientoStock.VENTA, movimientos, {clave: venta.id for clave in movimientos})
+    sumar_venta(venta, unidades=sum(cantidades.values()), costo=costo)
+    return venta
+
+
+def cotizar_carrito(caja, carrito):
+    """Precios y stock vigentes de un carrito armado en el navegador, sin escribir ni bloquear.
+
+    Una sola consulta para todo el carrito. Retorna {'items', 'total', 'valido'}; cada ítem
+    trae `error` (None si la línea se puede vender) y las líneas con error no suman al total.
+    Lanza CheckoutError si el carrito está mal formado.
+    """
+    cantidades = _normalizar_carrito(carrito)
+    productos = _cargar_productos(cantidades.keys(), caja.sucursal, bloquear=False)
+    items = []
+    total = Decimal('0.00')
+    for producto_id, cantidad in cantidades.items():
+        producto = productos.get(producto_id)
+        if producto is None:
+            items.append({'producto_id': producto_id, 'cantidad': cantidad, 'error': "Producto no encontrado."})
+            continue
+        error = _error_de_linea(producto, cantidad, caja)
+        subtotal = Decimal(str(cantidad)) * producto.precio_venta
+        items.append({
+            'producto_id': producto.id,
+            'nombre': producto.nombre,
+            'precio': str(producto.precio_venta),
+            'cantidad': cantidad,
+            'subtotal': str(subtotal),
+            'stock': _stock_disponible(producto, caja.sucursal),
+            'permitir_venta_sin_stock': producto.permitir_venta_sin_stock,
+            'error': error,
+        })
+        if not error:
+            total += subtotal
+    return {'items': items, 'total': total, 'valido': all(not item['error'] for item in items)}
+
+
+def agregados_caja():
+    """Agregados del resumen de caja para `aggregate()` (o `values('caja').annotate()` para varias cajas)."""
+    agregados = {forma: Sum('total', filter=Q(forma_pago=forma)) for forma in FORMAS_PAGO}
+    agregados.update(total_ventas=Sum('total'), vuelto=Sum('vuelto_entregado'), num_ventas=Count('id'))
+    return agregados
+
+
+def resumen_caja(caja):
+    """Totales de la caja: total_ventas, uno por forma de pago, vuelto, num_ventas y efectivo_final.
+
+    Una caja cerrada usa el resumen persistido al cierre (sin consultas); una abierta se
+    agrega en una sola consulta. El efectivo final no resta el vuelto: por cada venta en
+    efectivo queda en caja exactamente su total (cliente_paga - vuelto = total).
+    """
+    if caja.estado == 'cerrada' and caja.num_ventas is not None:
+        return {
+            'total_ventas': caja.ventas_totales,
+            'efectivo': caja.total_ventas_efectivo,
+            'debito': caja.total_ventas_debito,
+            'credito': caja.total_ventas_credito,
+            'transferencia': caja.total_ventas_transferencia,
+            'vuelto': caja.vuelto_entregado,
+            'num_ventas': caja.num_ventas,
+            'efectivo_final': caja.efectivo_final,
+        }
+    valores = Venta.objects.filter(caja=caja).aggregate(**agregados_caja())
+    resumen = {clave: valor or Decimal('0.00') for clave, valor in valores.items()}
+    resumen['num_ventas'] = valores['num_ventas'] or 0
+    resumen['efectivo_final'] = (caja.efectivo_inicial or Decimal('0.00')) + resumen['efectivo']
+    return resumen
+
+
+def guardar_resumen(caja, resumen):
+    """Copia el resumen en los campos de la caja (no guarda)."""
+    caja.ventas_totales = resumen['total_ventas']
+    caja.total_ventas_efectivo = resumen['efectivo']
+    caja.total_ventas_debito = resumen['debito']
+    caja.total_ventas_credito = resumen['credito']
+    caja.total_ventas_transferencia = resumen['transferencia']
+    caja.vuelto_entregado = resumen['vuelto']
+    caja.num_ventas = resumen['num_ventas']
+    caja.efectivo_final = resumen['efectivo_final']
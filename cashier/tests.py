@@ -8,7 +8,12 @@ from tests.factories import (
 	open_caja, close_caja, make_sale
 )
 from cashier.models import Venta, AperturaCierreCaja
+from products.models import StockSucursal
+from django.db import connection
 from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import json
 
 User = get_user_model()
 
@@ -37,8 +42,9 @@ class CashierFlowTests(TestCase):
 	def test_ranking_cajeros_basic(self):
 		caja1 = open_caja(self.user_admin, self.sucursal)
 		# Solo una caja abierta por sucursal (constraint); ventas de cajero_user sin caja propia si no se puede abrir otra
-		make_sale(self.user_admin, self.sucursal, [(self.prod_a, 1)], caja=caja1)
-		make_sale(self.user_admin, self.sucursal, [(self.prod_b, 2)], caja=caja1)
+		with self.captureOnCommitCallbacks(execute=True):
+			make_sale(self.user_admin, self.sucursal, [(self.prod_a, 1)], caja=caja1)
+			make_sale(self.user_admin, self.sucursal, [(self.prod_b, 2)], caja=caja1)
 		close_caja(caja1)
 		self.client.force_login(self.user_admin)
 		fi = (timezone.now() - timezone.timedelta(days=2)).strftime('%Y-%m-%d')
@@ -76,3 +82,200 @@ class CashierFlowTests(TestCase):
 		expected_ventas_efectivo = Venta.objects.filter(caja=caja, forma_pago='efectivo').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
 		expected_efectivo_final = (caja.efectivo_inicial or Decimal('0.00')) + expected_ventas_efectivo
 		self.assertEqual(caja.efectivo_final, expected_efectivo_final)
+
+
+class CheckoutServiceTests(TestCase):
+	def setUp(self):
+		self.sucursal = create_sucursal("Sucursal Checkout")
+		self.user_admin = create_user("admin_checkout", is_staff=True)
+		self.caja = open_caja(self.user_admin, self.sucursal)
+		self.productos = []
+		for i in range(6):
+			p = create_product(f"CK{i}", f"Producto {i}", precio_venta=Decimal('1000'), sucursal=self.sucursal, permitir_venta_sin_stock=False)
+			StockSucursal.objects.create(producto=p, sucursal=self.sucursal, cantidad=10)
+			self.productos.append(p)
+		self.client.force_login(self.user_admin)
+		# Primera request: registra la actividad para que las medidas no incluyan esa escritura
+		self.client.get('/healthz')
+
+	def _checkout(self, items, **extra):
+		payload = {
+			'carrito': [{'producto_id': p.id, 'cantidad': c} for p, c in items],
+			'forma_pago': 'efectivo',
+			'cliente_paga': '100000',
+			'caja_id': self.caja.id,
+		}
+		payload.update(extra)
+		return self.client.post('/cashier/', data=json.dumps(payload), content_type='application/json')
+
+	def test_checkout_descuenta_stock_y_crea_detalles(self):
+		resp = self._checkout([(self.productos[0], 2), (self.productos[1], 3)])
+		self.assertEqual(resp.status_code, 200, resp.content)
+		venta = Venta.objects.get()
+		self.assertEqual(venta.total, Decimal('5000'))
+		self.assertEqual(venta.vuelto_entregado, Decimal('95000'))
+		self.assertEqual(venta.detalles.count(), 2)
+		self.assertEqual(StockSucursal.objects.get(producto=self.productos[0]).cantidad, 8)
+		self.assertEqual(StockSucursal.objects.get(producto=self.productos[1]).cantidad, 7)
+
+	def test_checkout_stock_insuficiente_no_escribe(self):
+		resp = self._checkout([(self.productos[0], 1), (self.productos[1], 11)])
+		self.assertEqual(resp.status_code, 400)
+		self.assertFalse(Venta.objects.exists())
+		self.assertEqual(StockSucursal.objects.get(producto=self.productos[0]).cantidad, 10)
+
+	def test_checkout_queries_constantes(self):
+		# La primera venta del día crea la fila del resumen diario; medir desde la segunda
+		self._checkout([(self.productos[0], 1)])
+		with CaptureQueriesContext(connection) as chico:
+			self._checkout([(self.productos[0], 1)])
+		with CaptureQueriesContext(connection) as grande:
+			self._checkout([(p, 1) for p in self.productos])
+		self.assertEqual(len(chico.captured_queries), len(grande.captured_queries))
+
+	def test_checkout_usa_el_stock_bloqueado(self):
+		from unittest import mock
+		from cashier import services
+		from products.models import MovimientoStock
+		original = services._cargar_productos
+
+		def lectura_desactualizada(*args, **kwargs):
+			# Simula una transferencia confirmada entre la lectura del producto y el bloqueo del stock
+			productos = original(*args, **kwargs)
+			StockSucursal.objects.filter(producto__in=self.productos[:2]).update(cantidad=3)
+			return productos
+
+		with mock.patch.object(services, '_cargar_productos', side_effect=lectura_desactualizada):
+			resp = self._checkout([(self.productos[0], 5)])
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('Disponible: 3', resp.json()['error'])
+
+		self.productos[1].permitir_venta_sin_stock = True
+		self.productos[1].save()
+		with mock.patch.object(services, '_cargar_productos', side_effect=lectura_desactualizada):
+			resp = self._checkout([(self.productos[1], 5)])
+		self.assertEqual(resp.status_code, 200, resp.content)
+		# El libro asienta la variación efectiva sobre el valor bloqueado (3 -> 0)
+		self.assertEqual(MovimientoStock.objects.get(tipo=MovimientoStock.VENTA).delta, -3)
+
+	def _cotizar(self, items):
+		payload = {'carrito': [{'producto_id': p.id, 'cantidad': c} for p, c in items], 'caja_id': self.caja.id}
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.post(reverse('cotizar_carrito'), data=json.dumps(payload), content_type='application/json')
+		self.assertEqual(resp.status_code, 200, resp.content)
+		return resp.json(), ctx.captured_queries
+
+	def test_cotizar_en_lote_sin_escrituras(self):
+		_, chico = self._cotizar([(self.productos[0], 1)])
+		data, grande = self._cotizar([(p, 2) for p in self.productos])
+		self.assertTrue(data['valido'])
+		self.assertEqual(Decimal(data['total']), Decimal('12000'))
+		self.assertEqual([i['stock'] for i in data['items']], [10] * 6)
+		self.assertEqual(len(chico), len(grande))
+		# Sólo lectura: tampoco se guarda la sesión (la actividad ya está registrada)
+		escrituras = [q['sql'] for q in grande if q['sql'].split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+		self.assertEqual(escrituras, [])
+
+	def test_cotizar_informa_lineas_sin_stock(self):
+		data, _ = self._cotizar([(self.productos[0], 1), (self.productos[1], 11)])
+		self.assertFalse(data['valido'])
+		self.assertIsNone(data['items'][0]['error'])
+		self.assertIn('Disponible: 10', data['items'][1]['error'])
+		self.assertEqual(Decimal(data['total']), Decimal('1000'))
+
+
+class EscaneoCodigoTests(TestCase):
+	def setUp(self):
+		from products.scan_cache import cache_escaneo
+		cache_escaneo.limpiar()
+		self.sucursal = create_sucursal("Sucursal Escaneo")
+		self.admin = create_user("admin_scan", is_staff=True)
+		self.prod = create_product("SC1", "Producto Escaneo", codigo_barras="7800000000011", sucursal=self.sucursal)
+		StockSucursal.objects.create(producto=self.prod, sucursal=self.sucursal, cantidad=3)
+		self.caja = open_caja(self.admin, self.sucursal)
+		self.client.force_login(self.admin)
+
+	def _escanear(self, codigo):
+		return self.client.post('/cashier/escanear/', data=json.dumps({'codigo': codigo, 'caja_id': self.caja.id}), content_type='application/json')
+
+	def test_escaneo_agrega_al_carrito(self):
+		resp = self._escanear("7800000000011")
+		self.assertEqual(resp.status_code, 200)
+		self._escanear("sc1")
+		carrito = resp.client.session['carrito']
+		self.assertEqual(len(carrito), 1)
+		self.assertEqual(carrito[0]['cantidad'], 2)
+		self.assertEqual(carrito[0]['stock'], 3)
+		self.assertEqual(self._escanear("0000").status_code, 404)
+
+	def test_escaneo_carrito_local_no_escribe_la_sesion(self):
+		resp = self.client.post('/cashier/escanear/', data=json.dumps({
+			'codigo': "7800000000011", 'caja_id': self.caja.id, 'carrito_local': True,
+		}), content_type='application/json')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['producto']['id'], self.prod.id)
+		self.assertNotIn('carrito', self.client.session)
+
+	def test_cache_caliente_sin_consultas_de_producto(self):
+		from products.scan_cache import resolver_codigo
+		self.assertEqual(resolver_codigo("7800000000011", self.sucursal.id)['stock'], 3)
+		with CaptureQueriesContext(connection) as ctx:
+			datos = resolver_codigo("7800000000011", self.sucursal.id)
+		self.assertEqual(len(ctx.captured_queries), 0)
+		self.assertEqual(datos['id'], self.prod.id)
+
+	def test_invalidacion_por_stock_y_checkout(self):
+		from products.scan_cache import resolver_codigo
+		resolver_codigo("7800000000011", self.sucursal.id)
+		ss = StockSucursal.objects.get(producto=self.prod, sucursal=self.sucursal)
+		ss.cantidad = 5
+		ss.save()
+		self.assertEqual(resolver_codigo("7800000000011", self.sucursal.id)['stock'], 5)
+		resp = self.client.post('/cashier/', data=json.dumps({
+			'carrito': [{'producto_id': self.prod.id, 'cantidad': 2}],
+			'forma_pago': 'efectivo', 'cliente_paga': '100000', 'caja_id': self.caja.id,
+		}), content_type='application/json')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resolver_codigo("7800000000011", self.sucursal.id)['stock'], 3)
+
+
+class ResumenCajaTests(TestCase):
+	def setUp(self):
+		self.sucursal = create_sucursal("Sucursal Resumen")
+		self.user_admin = create_user("admin_resumen", is_staff=True)
+		self.prod = create_product("RC1", "Producto Resumen", precio_compra=Decimal('500'), precio_venta=Decimal('1000'))
+		self.caja = open_caja(self.user_admin, self.sucursal, efectivo_inicial=Decimal('2000'))
+		make_sale(self.user_admin, self.sucursal, [(self.prod, 2)], forma_pago='efectivo', caja=self.caja)
+		make_sale(self.user_admin, self.sucursal, [(self.prod, 1)], forma_pago='debito', caja=self.caja)
+		make_sale(self.user_admin, self.sucursal, [(self.prod, 3)], forma_pago='transferencia', caja=self.caja)
+
+	def test_resumen_caja_abierta_en_una_consulta(self):
+		from cashier.services import resumen_caja
+		with CaptureQueriesContext(connection) as ctx:
+			resumen = resumen_caja(self.caja)
+		self.assertEqual(len(ctx.captured_queries), 1)
+		self.assertEqual(resumen['total_ventas'], Decimal('6000'))
+		self.assertEqual(resumen['efectivo'], Decimal('2000'))
+		self.assertEqual(resumen['debito'], Decimal('1000'))
+		self.assertEqual(resumen['credito'], Decimal('0'))
+		self.assertEqual(resumen['transferencia'], Decimal('3000'))
+		self.assertEqual(resumen['num_ventas'], 3)
+		self.assertEqual(resumen['efectivo_final'], Decimal('4000'))
+
+	def test_cierre_persiste_resumen_y_detalle_no_reagrega(self):
+		from cashier.services import resumen_caja
+		self.client.force_login(self.user_admin)
+		resp = self.client.post('/cashier/cerrar_caja/', data='{"caja_id": %d}' % self.caja.id, content_type='application/json')
+		self.assertEqual(resp.status_code, 200)
+		self.caja.refresh_from_db()
+		self.assertEqual(self.caja.num_ventas, 3)
+		self.assertEqual(self.caja.total_ventas_transferencia, Decimal('3000'))
+		self.assertEqual(self.caja.efectivo_final, Decimal('4000'))
+		with CaptureQueriesContext(connection) as ctx:
+			self.assertEqual(resumen_caja(self.caja)['debito'], Decimal('1000'))
+		self.assertEqual(len(ctx.captured_queries), 0)
+		for url in (reverse('detalle_caja', args=[self.caja.id]), reverse('print_caja', args=[self.caja.id])):
+			with CaptureQueriesContext(connection) as ctx:
+				resp = self.client.get(url)
+			self.assertEqual(resp.status_code, 200)
+			self.assertFalse([q for q in ctx.captured_queries if 'cashier_venta' in q['sql']], url)
@@ -9,8 +9,10 @@ urlpatterns = [
     path('cerrar_caja/', views.cerrar_caja, name='cerrar_caja'),
     path('buscar-producto/', views.buscar_producto, name='buscar_producto'),
     path('ajustar-cantidad/', views.ajustar_cantidad, name='ajustar_cantidad'),
+    path('escanear/', views.escanear_producto, name='escanear_producto'),
     path('agregar-al-carrito/', views.agregar_al_carrito, name='agregar_al_carrito'),
     path('listar-carrito/', views.listar_carrito, name='listar_carrito'),
+    path('cotizar/', views.cotizar, name='cotizar_carrito'),
     path('limpiar-carrito/', views.limpiar_carrito, name='limpiar_carrito'),
     path('detalle-caja/<int:caja_id>/', views.detalle_caja, name='detalle_caja'),
     path('reporte/<int:venta_id>/', views.reporte_venta, name='reporte_venta'),
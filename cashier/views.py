@@ -12,8 +12,12 @@ import datetime
 from decimal import Decimal
 
 from .models import Venta, VentaDetalle, AperturaCierreCaja
-from products.models import Product
+from .services import procesar_checkout, cotizar_carrito, CheckoutError, guardar_resumen, resumen_caja
+from products.models import Product, StockSucursal
+from products.scan_cache import resolver_codigo
+from products.search import buscar_productos
 from sucursales.models import Sucursal
+from reports.rollup import eliminar_ventas
 
 def format_currency(value):
     try:
@@ -122,93 +126,26 @@ def cashier_dashboard(request):
             cliente_paga = Decimal(str(data.get('cliente_paga', '0')))
             numero_transaccion = data.get('numero_transaccion', '').strip()
             banco = data.get('banco', '').strip() if forma_pago == "transferencia" else ""
-            if forma_pago in ["debito", "credito", "transferencia"] and not numero_transaccion:
-                return JsonResponse({
-                    "error": "El número de transacción es obligatorio para pagos con tarjeta y transferencia."
-                }, status=400)
-            if forma_pago == "transferencia" and not banco:
-                return JsonResponse({
-                    "error": "Debe ingresar el nombre del banco para pagos por transferencia."
-                }, status=400)
-            if not carrito:
-                return JsonResponse({"error": "El carrito está vacío."}, status=400)
-            total = Decimal('0.00')
-            for item in carrito:
-                producto = get_object_or_404(Product, id=item.get('producto_id'))
-                cantidad = int(item.get('cantidad', 1))
-                # Validar que el producto pertenezca a la sucursal o sea vendible sin sucursal (permitido)
-                pertenece_o_permitido = (
-                    producto.sucursal_id == caja_abierta.sucursal_id or
-                    (producto.sucursal_id is None and producto.permitir_venta_sin_stock)
-                )
-                if not pertenece_o_permitido:
-                    return JsonResponse({
-                        "error": f"El producto '{producto.nombre}' no pertenece a la sucursal de la caja abierta."
-                    }, status=400)
-                total += Decimal(str(cantidad)) * producto.precio_venta
-            if forma_pago == 'efectivo' and cliente_paga < total:
-                return JsonResponse({
-                    "error": f"Pago insuficiente. El total es ${format_currency(total)}, pero el cliente pagó ${format_currency(cliente_paga)}."
-                }, status=400)
+            # Validación y registro por conjuntos (consultas constantes sin importar el tamaño del carrito)
             with transaction.atomic():
-                venta = Venta.objects.create(
-                    empleado=request.user,
+                venta = procesar_checkout(
+                    caja_abierta,
+                    request.user,
+                    carrito,
                     tipo_venta=tipo_venta,
                     forma_pago=forma_pago,
-                    total=Decimal('0.00'),
-                    cliente_paga=cliente_paga if forma_pago == "efectivo" else Decimal('0.00'),
-                    vuelto_entregado=Decimal('0.00'),
-                    numero_transaccion=numero_transaccion if forma_pago in ["debito", "credito", "transferencia"] else "",
+                    cliente_paga=cliente_paga,
+                    numero_transaccion=numero_transaccion,
                     banco=banco,
-                    sucursal=caja_abierta.sucursal,   # Se asigna la sucursal de la caja abierta
-                    caja=caja_abierta
                 )
-                for item in carrito:
-                    producto = get_object_or_404(Product, id=item.get('producto_id'))
-                    cantidad = int(item.get('cantidad', 1))
-                    # Verificar stock por sucursal y pertenencia, permitiendo productos sin sucursal si lo permiten
-                    pertenece_o_permitido = (
-                        producto.sucursal_id == caja_abierta.sucursal_id or
-                        (producto.sucursal_id is None and producto.permitir_venta_sin_stock)
-                    )
-                    if not pertenece_o_permitido:
-                        return JsonResponse({"error": f"El producto '{producto.nombre}' no pertenece a esta sucursal."}, status=400)
-                    # Stock disponible: si tiene sucursal, usar stock_en; si no tiene sucursal, usar stock global
-                    disponible = producto.stock_en(caja_abierta.sucursal) if producto.sucursal_id else (producto.stock or 0)
-                    if not producto.permitir_venta_sin_stock and disponible < cantidad:
-                        return JsonResponse({"error": f"El producto '{producto.nombre}' no tiene suficiente stock. Disponible: {disponible}."}, status=400)
-                for item in carrito:
-                    producto = get_object_or_404(Product, id=item.get('producto_id'))
-                    cantidad = int(item.get('cantidad', 1))
-                    # Descontar respetando inventario por sucursal; si el producto no tiene sucursal, descontar stock global
-                    if producto.sucursal_id:
-                        producto.decrementar_stock_en(caja_abierta.sucursal, cantidad)
-                    else:
-                        # Producto sin sucursal: ajustar stock global (si queda negativo, se fuerza a 0)
-                        try:
-                            nuevo_stock = max(0, (producto.stock or 0) - cantidad)
-                            if nuevo_stock != (producto.stock or 0):
-                                producto.stock = nuevo_stock
-                                producto.save(update_fields=['stock'])
-                        except Exception:
-                            # Si por algún motivo no se puede ajustar, continuar (venta sin stock lo permite)
-                            pass
-                    VentaDetalle.objects.create(
-                        venta=venta,
-                        producto=producto,
-                        cantidad=cantidad,
-                        precio_unitario=producto.precio_venta
-                    )
-                venta.total = total
-                if forma_pago == "efectivo":
-                    venta.vuelto_entregado = max(Decimal('0.00'), cliente_paga - total)
-                venta.save()
             reporte_url = reverse('reporte_venta', args=[venta.id])
             return JsonResponse({
                 "success": True,
                 "mensaje": "Compra confirmada con éxito.",
                 "reporte_url": reporte_url
             })
+        except CheckoutError as e:
+            return JsonResponse({"error": e.mensaje}, status=e.status)
         except (json.JSONDecodeError, KeyError, ValueError, Product.DoesNotExist) as e:
             return JsonResponse({"error": f"Error en los datos enviados o producto no encontrado: {str(e)}"}, status=400)
         except Exception as e:
@@ -243,29 +180,11 @@ def cerrar_caja(request):
                 return JsonResponse({'error': 'No tienes una caja abierta para cerrar.'}, status=400)
         if caja.estado == 'cerrada':
             return JsonResponse({'error': 'La caja ya está cerrada.'}, status=400)
-        # Calcular totales del periodo de la caja
-        fecha_fin = timezone.now()
-        # Usar la relación explícita a la caja para evitar incluir ventas de otros periodos
-        ventas_qs = Venta.objects.filter(caja=caja)
-        total_ventas = ventas_qs.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        ventas_efectivo = ventas_qs.filter(forma_pago='efectivo').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        ventas_debito = ventas_qs.filter(forma_pago='debito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        ventas_credito = ventas_qs.filter(forma_pago='credito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-        vuelto_total = ventas_qs.aggregate(total=Sum('vuelto_entregado'))['total'] or Decimal('0.00')
-        # Nota: el efectivo final no debe restar el vuelto. Para una venta en efectivo,
-        # el neto que queda en caja es exactamente el total de la venta, independientemente
-        # de cuánto se recibió y cuánto vuelto se entregó (cliente_paga - vuelto = total).
-        # Por lo tanto, el efectivo final correcto es:
-        efectivo_final = (caja.efectivo_inicial or Decimal('0.00')) + ventas_efectivo
-        # Persistir estado y métricas básicas
-        caja.cierre = fecha_fin
+        # Totales de las ventas ligadas a la caja en una sola consulta; quedan persistidos
+        # para que el detalle, la impresión y los reportes no vuelvan a agregar
+        guardar_resumen(caja, resumen_caja(caja))
+        caja.cierre = timezone.now()
         caja.estado = 'cerrada'
-        caja.ventas_totales = total_ventas
-        caja.total_ventas_efectivo = ventas_efectivo
-        caja.total_ventas_debito = ventas_debito
-        caja.total_ventas_credito = ventas_credito
-        caja.vuelto_entregado = vuelto_total
-        caja.efectivo_final = efectivo_final
         caja.save()
         # Limpiar carrito al cerrar la caja
         try:
@@ -284,31 +203,24 @@ def detalle_caja(request, caja_id):
     # Si la caja está abierta y el usuario es admin, redirigir a la vista del cajero con esa caja
     if caja.estado == 'abierta' and request.user.is_superuser:
         return redirect(f"{reverse('cashier_dashboard')}?caja_id={caja.id}")
-    # Establecemos el rango de ventas: desde la apertura hasta la fecha de cierre (o ahora si está abierta)
-    # Consultar ventas ligadas a esta caja (más robusto que filtrar por empleado+fechas)
-    ventas_qs = Venta.objects.filter(caja=caja)
-    ventas_total = ventas_qs.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_efectivo = ventas_qs.filter(forma_pago='efectivo').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_debito = ventas_qs.filter(forma_pago='debito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_credito = ventas_qs.filter(forma_pago='credito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_transferencia = ventas_qs.filter(forma_pago='transferencia').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    vuelto_total = ventas_qs.aggregate(total=Sum('vuelto_entregado'))['total'] or Decimal('0.00')
-    # Igual que en el cierre: no restar 'vuelto_total' ya que el total en efectivo
-    # ya representa el neto que queda en caja por cada venta.
-    efectivo_final_calc = (caja.efectivo_inicial or Decimal('0.00')) + ventas_efectivo
-    
-    contexto = {
-        'caja': caja,
+    # Ventas ligadas a esta caja (resumen persistido si ya está cerrada)
+    contexto = {'caja': caja, **_contexto_resumen_caja(caja)}
+    return render(request, 'cashier/detalle_caja.html', contexto)
+
+def _contexto_resumen_caja(caja):
+    """Montos formateados del resumen de caja para detalle_caja.html / print_caja.html."""
+    resumen = resumen_caja(caja)
+    return {
         'formatted_efectivo_inicial': "$" + format_clp(caja.efectivo_inicial or Decimal('0.00')),
-        'formatted_total_debito': "$" + format_clp(ventas_debito),
-        'formatted_total_credito': "$" + format_clp(ventas_credito),
-    'formatted_total_transferencia': "$" + format_clp(ventas_transferencia),
-        'formatted_total_efectivo': "$" + format_clp(ventas_efectivo),
-        'formatted_vuelto_entregado': "$" + format_clp(vuelto_total),
-        'formatted_efectivo_final': "$" + format_clp(efectivo_final_calc),
-        'formatted_total_ventas': "$" + format_clp(ventas_total)
+        'formatted_total_debito': "$" + format_clp(resumen['debito']),
+        'formatted_total_credito': "$" + format_clp(resumen['credito']),
+        'formatted_total_transferencia': "$" + format_clp(resumen['transferencia']),
+        'formatted_total_efectivo': "$" + format_clp(resumen['efectivo']),
+        'formatted_vuelto_entregado': "$" + format_clp(resumen['vuelto']),
+        'formatted_total_ventas': "$" + format_clp(resumen['total_ventas']),
+        'formatted_efectivo_final': "$" + format_clp(resumen['efectivo_final']),
+        'num_ventas': resumen['num_ventas'],
     }
-    return render(request, 'cashier/detalle_caja.html', contexto)
 
 @login_required
 def print_venta(request, venta_id):
@@ -339,28 +251,8 @@ def print_venta(request, venta_id):
 @login_required
 def print_caja(request, caja_id):
     caja = get_object_or_404(AperturaCierreCaja, id=caja_id)
-    # Usar ventas asociadas a la caja para el informe de impresión
-    ventas_qs = Venta.objects.filter(caja=caja)
-    ventas_total = ventas_qs.aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_efectivo = ventas_qs.filter(forma_pago='efectivo').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_debito = ventas_qs.filter(forma_pago='debito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_credito = ventas_qs.filter(forma_pago='credito').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    ventas_transferencia = ventas_qs.filter(forma_pago='transferencia').aggregate(total=Sum('total'))['total'] or Decimal('0.00')
-    vuelto_total = ventas_qs.aggregate(total=Sum('vuelto_entregado'))['total'] or Decimal('0.00')
-    # El efectivo final debe ser efectivo_inicial + ventas_efectivo.
-    # No restamos 'vuelto_total' porque las ventas en efectivo ya representan el neto que queda en caja.
-    efectivo_final_calc = (caja.efectivo_inicial or Decimal('0.00')) + ventas_efectivo
-    ctx = {
-        'caja': caja,
-        'formatted_efectivo_inicial': "$" + format_clp(caja.efectivo_inicial or Decimal('0.00')),
-        'formatted_total_debito': "$" + format_clp(ventas_debito),
-        'formatted_total_credito': "$" + format_clp(ventas_credito),
-        'formatted_total_transferencia': "$" + format_clp(ventas_transferencia),
-        'formatted_total_efectivo': "$" + format_clp(ventas_efectivo),
-        'formatted_vuelto_entregado': "$" + format_clp(vuelto_total),
-        'formatted_total_ventas': "$" + format_clp(ventas_total),
-        'formatted_efectivo_final': "$" + format_clp(efectivo_final_calc),
-    }
+    # Ventas asociadas a la caja (resumen persistido si ya está cerrada)
+    ctx = {'caja': caja, **_contexto_resumen_caja(caja)}
     return render(request, 'cashier/print_caja.html', ctx)
 
 @login_required
@@ -375,16 +267,17 @@ def buscar_producto(request):
         return JsonResponse({'productos': []})
     # Resolver caja de forma consistente
     caja_abierta = get_current_caja(request)
-    # Base query por texto
-    base_qs = Product.objects.filter(
-        Q(nombre__icontains=query) |
-        Q(producto_id__icontains=query) |
-        Q(codigo_barras__icontains=query) |
-        Q(codigo_alternativo__icontains=query)
-    )
-    # Mostrar todos los productos que coincidan; el frontend indicará si se pueden agregar o no
-    productos = base_qs
-    # Calcular stock por sucursal cuando procede
+    # Búsqueda indexada con top-N (atajo exacto para código de barras / Código 1)
+    productos = buscar_productos(query)
+    # Stock de la página en una sola consulta
+    stock_por_producto = {}
+    if caja_abierta and caja_abierta.sucursal_id and productos:
+        stock_por_producto = dict(
+            StockSucursal.objects.filter(
+                sucursal_id=caja_abierta.sucursal_id,
+                producto_id__in=[p.id for p in productos],
+            ).values_list('producto_id', 'cantidad')
+        )
     resultados = []
     for p in productos:
         # Determinar si el producto se puede vender desde la sucursal actual
@@ -394,9 +287,14 @@ def buscar_producto(request):
                 p.sucursal_id == caja_abierta.sucursal_id or
                 (p.sucursal_id is None and p.permitir_venta_sin_stock)
             )
-        # Calcular stock a mostrar
+        # Calcular stock a mostrar (misma regla que Product.stock_en)
         if p.sucursal_id and caja_abierta and caja_abierta.sucursal_id:
-            stock_val = p.stock_en(caja_abierta.sucursal)
+            if p.id in stock_por_producto:
+                stock_val = stock_por_producto[p.id] or 0
+            elif p.sucursal_id == caja_abierta.sucursal_id:
+                stock_val = p.stock or 0
+            else:
+                stock_val = 0
         else:
             stock_val = p.stock or 0
         resultados.append({
@@ -508,7 +406,7 @@ def agregar_al_carrito(request):
         data = json.loads(request.body)
         producto_id = data.get("producto_id")
         cantidad = 1
-        producto = get_object_or_404(Product, id=producto_id)
+        producto = get_object_or_404(Product.objects.con_stock_en(caja_abierta.sucursal_id), id=producto_id)
         # Asegurar que el producto pertenezca a la sucursal de la caja o sea vendible sin sucursal
         pertenece_o_permitido = (
             producto.sucursal_id == caja_abierta.sucursal_id or
@@ -517,35 +415,106 @@ def agregar_al_carrito(request):
         if not pertenece_o_permitido:
             return JsonResponse({"error": "Este producto no pertenece a la sucursal de la caja abierta."}, status=400)
         # Determinar stock disponible
-        disponible = producto.stock_en(caja_abierta.sucursal) if producto.sucursal_id else (producto.stock or 0)
+        disponible = producto.stock_sucursal if producto.sucursal_id else (producto.stock or 0)
         if not producto.permitir_venta_sin_stock and disponible < cantidad:
             return JsonResponse({"error": "Stock insuficiente para este producto."}, status=400)
-        carrito = request.session.get('carrito', [])
-        found = False
-        for item in carrito:
-            if item['producto_id'] == producto.id:
-                # Si ya existe en el carrito, incrementar en 1
-                try:
-                    item['cantidad'] = int(item.get('cantidad', 0)) + 1
-                except Exception:
-                    item['cantidad'] = 1
-                found = True
-                break
-        if not found:
-            carrito.append({
-                'producto_id': producto.id,
-                'nombre': producto.nombre,
-                'precio': str(producto.precio_venta),
-                'cantidad': cantidad,
-                'stock': disponible,
-                'permitir_venta_sin_stock': producto.permitir_venta_sin_stock,
-            })
-        request.session['carrito'] = carrito
-        request.session.modified = True
+        carrito = _sumar_al_carrito(request, {
+            'producto_id': producto.id,
+            'nombre': producto.nombre,
+            'precio': str(producto.precio_venta),
+            'cantidad': cantidad,
+            'stock': disponible,
+            'permitir_venta_sin_stock': producto.permitir_venta_sin_stock,
+        })
         return JsonResponse({'mensaje': 'Producto agregado al carrito', 'carrito': carrito})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def _sumar_al_carrito(request, nuevo_item):
+    """Agrega una unidad del producto al carrito de la sesión (o crea la línea) y retorna el carrito."""
+    carrito = request.session.get('carrito', [])
+    found = False
+    for item in carrito:
+        if item['producto_id'] == nuevo_item['producto_id']:
+            # Si ya existe en el carrito, incrementar en 1
+            try:
+                item['cantidad'] = int(item.get('cantidad', 0)) + 1
+            except Exception:
+                item['cantidad'] = 1
+            found = True
+            break
+    if not found:
+        carrito.append(nuevo_item)
+    request.session['carrito'] = carrito
+    request.session.modified = True
+    return carrito
+
+@login_required
+def escanear_producto(request):
+    """
+    Atajo para el lector de código de barras: resuelve el código exacto (barras, Código 1 o
+    Código 2) y agrega el producto al carrito en la misma petición. La búsqueda del producto y
+    su stock se sirve desde la caché en proceso (sin consultas cuando está caliente).
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    caja_abierta = get_current_caja(request)
+    if not caja_abierta:
+        return JsonResponse({'error': 'No tienes una caja abierta en tu sucursal o no tienes permisos para operar esta caja.'}, status=403)
+    try:
+        data = _parse_body_json(request)
+        codigo = str(data.get('codigo') or '').strip()
+        if not codigo:
+            return JsonResponse({'error': 'Debe indicar un código.'}, status=400)
+        producto = resolver_codigo(codigo, caja_abierta.sucursal_id)
+        if producto is None:
+            return JsonResponse({'error': 'Producto no encontrado.'}, status=404)
+        # Asegurar que el producto pertenezca a la sucursal de la caja o sea vendible sin sucursal
+        pertenece_o_permitido = (
+            producto['sucursal_id'] == caja_abierta.sucursal_id or
+            (producto['sucursal_id'] is None and producto['permitir_venta_sin_stock'])
+        )
+        if not pertenece_o_permitido:
+            return JsonResponse({"error": "Este producto no pertenece a la sucursal de la caja abierta."}, status=400)
+        if not producto['permitir_venta_sin_stock'] and producto['stock'] < 1:
+            return JsonResponse({"error": "Stock insuficiente para este producto."}, status=400)
+        if data.get('carrito_local'):
+            # El carrito vive en el navegador (cashier.js): sólo resolver el código, sin escribir la sesión
+            return JsonResponse({'mensaje': 'Producto agregado al carrito', 'producto': producto})
+        carrito = _sumar_al_carrito(request, {
+            'producto_id': producto['id'],
+            'nombre': producto['nombre'],
+            'precio': producto['precio_venta'],
+            'cantidad': 1,
+            'stock': producto['stock'],
+            'permitir_venta_sin_stock': producto['permitir_venta_sin_stock'],
+        })
+        return JsonResponse({'mensaje': 'Producto agregado al carrito', 'producto': producto, 'carrito': carrito})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@login_required
+def cotizar(request):
+    """
+    Revalida en lote el carrito que el navegador mantiene localmente: precios y stock vigentes
+    de todas las líneas en una consulta, sin escribir. El checkout (POST a cashier_dashboard)
+    es la única escritura de la venta.
+    """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    caja_abierta = get_current_caja(request)
+    if not caja_abierta:
+        return JsonResponse({'error': 'No tienes una caja abierta en tu sucursal o no tienes permisos para operar esta caja.'}, status=403)
+    try:
+        data = _parse_body_json(request)
+        cotizacion = cotizar_carrito(caja_abierta, data.get('carrito') or [])
+        cotizacion['total'] = str(cotizacion['total'])
+        return JsonResponse(cotizacion)
+    except CheckoutError as e:
+        return JsonResponse({"error": e.mensaje}, status=e.status)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @login_required
 def listar_carrito(request):
     carrito = request.session.get('carrito', [])
@@ -560,7 +529,8 @@ def limpiar_carrito(request):
 def delete_all_sales_and_cash_history(request):
     if request.method == 'POST':
         try:
-            Venta.objects.all().delete()
+            # Sin recalcular el resumen diario venta por venta: se vacía completo
+            eliminar_ventas()
             AperturaCierreCaja.objects.all().delete()
             messages.success(request, '¡Éxito! Todo el historial de ventas y caja ha sido eliminado.')
         except Exception as e:
@@ -664,7 +634,7 @@ def advanced_reports(request):
     agg_unidades = VentaDetalle.objects.filter(venta__in=ventas_qs).aggregate(total_unidades=Sum('cantidad'))
     total_unidades = agg_unidades.get('total_unidades') or 0
     agg_cmv = VentaDetalle.objects.filter(venta__in=ventas_qs).aggregate(
-        cmv=Sum(F('cantidad') * F('producto__precio_compra'))
+        cmv=Sum(F('cantidad') * F('costo_unitario'))
     )
     cmv_val = agg_cmv.get('cmv') or 0
     cmv = Decimal(str(cmv_val))
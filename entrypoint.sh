@@ -9,6 +9,17 @@ if [ "$DB_ENGINE" = "postgres" ]; then
   done
 fi
 
+# Auxiliary services (e.g. the job worker) skip setup: the web service migrates and
+# collects static files; they only wait until the schema is up to date
+if [ "${SKIP_SETUP:-false}" = "true" ]; then
+  echo "Waiting for migrations"
+  until python manage.py migrate --check >/dev/null 2>&1; do
+    echo "Migrations pending - sleeping"
+    sleep 2
+  done
+  exec "$@"
+fi
+
 echo "Running migrations"
 python manage.py migrate --noinput
 
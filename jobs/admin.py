@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from .models import Trabajo
+
+
+@admin.register(Trabajo)
+class TrabajoAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'estado', 'usuario', 'creado', 'terminado', 'intentos')
+    list_filter = ('tipo', 'estado')
+    readonly_fields = ('clave', 'creado', 'iniciado', 'latido', 'terminado', 'intentos', 'error')
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.services import procesar_pendientes, purgar, recuperar_colgados
+from products.libro import corte_periodico
+
+
+class Command(BaseCommand):
+    help = "Process queued background jobs (report exports, uploads). Runs until interrupted unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process the pending jobs and exit")
+        parser.add_argument("--intervalo", type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--purgar-cada", type=int, default=300, help="Seconds between purges of old artifacts and expired sessions (also takes due stock snapshots)")
+
+    def handle(self, once=False, intervalo=2.0, purgar_cada=300, **options):
+        ultima_purga = 0.0
+        self.stdout.write("Job worker started")
+        try:
+            while True:
+                close_old_connections()
+                recuperar_colgados()
+                if time.monotonic() - ultima_purga >= purgar_cada:
+                    purgados = purgar()
+                    if purgados:
+                        self.stdout.write(f"Purged {purgados} old job(s)")
+                    # Sesiones expiradas (no hace nada con backends sin almacenamiento propio)
+                    call_command('clearsessions')
+                    # Corte de cierre del libro de stock por cada día terminado
+                    corte = corte_periodico()
+                    if corte:
+                        self.stdout.write(f"Stock snapshot #{corte.pk} with {corte.total_saldos} balance(s)")
+                    ultima_purga = time.monotonic()
+                procesados = procesar_pendientes()
+                if procesados:
+                    self.stdout.write(f"Processed {procesados} job(s)")
+                if once:
+                    break
+                if not procesados:
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write("Job worker stopped")
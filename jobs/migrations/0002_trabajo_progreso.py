@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajo',
+            name='progreso',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:30
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def latido_inicial(apps, schema_editor):
+    """Los trabajos en curso parten con su hora de inicio como último latido."""
+    Trabajo = apps.get_model('jobs', 'Trabajo')
+    Trabajo.objects.filter(latido__isnull=True, iniciado__isnull=False).update(latido=F('iniciado'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0002_trabajo_progreso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajo',
+            name='latido',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(latido_inicial, migrations.RunPython.noop),
+    ]
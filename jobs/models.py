@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+
+def almacenamiento_artefactos():
+    """Directorio privado de los archivos generados (se descargan sólo vía jobs:descargar)."""
+    return FileSystemStorage(location=settings.JOBS_ARTIFACT_ROOT)
+
+
+class Trabajo(models.Model):
+    """
+    Trabajo en segundo plano (cola en base de datos) procesado por `manage.py run_jobs`.
+    `clave` identifica trabajos equivalentes (tipo, parámetros y versión de datos) para
+    reutilizar un artefacto reciente en vez de generarlo de nuevo. Si `parametros`
+    incluye `archivo_entrada` (archivo subido, en el mismo almacenamiento), se elimina
+    junto con el trabajo al purgarlo.
+    """
+    PENDIENTE = 'pendiente'
+    EN_PROCESO = 'en_proceso'
+    TERMINADO = 'terminado'
+    ERROR = 'error'
+    ESTADOS = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_PROCESO, 'En proceso'),
+        (TERMINADO, 'Terminado'),
+        (ERROR, 'Error'),
+    ]
+
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    clave = models.CharField(max_length=40)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=PENDIENTE)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos')
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    # Última señal de vida del worker (al tomarlo y con cada avance); base para detectar colgados
+    latido = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    intentos = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    archivo = models.FileField(storage=almacenamiento_artefactos, upload_to='%Y/%m/%d', blank=True)
+    nombre_archivo = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    # Avance informado por la tarea (p.ej. filas procesadas); también permite reanudarla tras un reintento
+    progreso = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-creado']
+        verbose_name = 'Trabajo'
+        verbose_name_plural = 'Trabajos'
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='jobs_estado_creado'),
+            models.Index(fields=['clave', 'estado'], name='jobs_clave_estado'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.estado})"
+
+    @property
+    def finalizado(self):
+        return self.estado in (self.TERMINADO, self.ERROR)
+
+    def artefacto_disponible(self):
+        return self.estado == self.TERMINADO and bool(self.archivo) and self.archivo.storage.exists(self.archivo.name)
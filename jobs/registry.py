@@ -0,0 +1,25 @@
+"""
+Registro de tipos de trabajo.
+
+Cada app registra sus tareas con `@tarea('tipo')` al cargarse (p.ej. desde su
+AppConfig.ready). Una tarea recibe el dict de parámetros guardado en el Trabajo y
+retorna (nombre_archivo, content_type, contenido_bytes), o None si no genera archivo.
+Con `@tarea('tipo', recibe_trabajo=True)` recibe además el Trabajo, para informar su
+avance en `trabajo.progreso` (ver services.guardar_progreso).
+"""
+_tareas = {}
+
+
+def tarea(tipo, recibe_trabajo=False):
+    def registrar(funcion):
+        funcion.recibe_trabajo = recibe_trabajo
+        _tareas[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def obtener(tipo):
+    try:
+        return _tareas[tipo]
+    except KeyError:
+        raise LookupError(f"Tipo de trabajo desconocido: {tipo}")
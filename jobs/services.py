@@ -0,0 +1,134 @@
+"""
+Cola de trabajos en base de datos.
+
+- `encolar` crea un Trabajo o reutiliza uno equivalente (misma clave) que siga
+  pendiente/en proceso o haya terminado hace menos de JOBS_ARTIFACT_TTL segundos.
+- `tomar_siguiente` reclama el pendiente más antiguo con un UPDATE condicional, así
+  varios workers (o procesos) no toman el mismo trabajo, también en SQLite.
+- `procesar_pendientes` es el ciclo del worker (`manage.py run_jobs`).
+- `guardar_progreso` publica el avance de una tarea larga para el polling de estado y
+  renueva su latido, así `recuperar_colgados` no reencola una tarea larga que sigue viva.
+"""
+import datetime
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import registry
+from .models import Trabajo, almacenamiento_artefactos
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 3
+
+
+def clave_trabajo(tipo, parametros, version=''):
+    raw = json.dumps([tipo, parametros, version], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def encolar(tipo, parametros, usuario=None, version=''):
+    """Trabajo para (tipo, parámetros, versión de datos): uno equivalente reciente o uno nuevo pendiente."""
+    registry.obtener(tipo)  # Falla temprano si el tipo no existe
+    clave = clave_trabajo(tipo, parametros, version)
+    limite = timezone.now() - datetime.timedelta(seconds=settings.JOBS_ARTIFACT_TTL)
+    candidatos = Trabajo.objects.filter(clave=clave).filter(
+        Q(estado__in=[Trabajo.PENDIENTE, Trabajo.EN_PROCESO]) |
+        Q(estado=Trabajo.TERMINADO, terminado__gte=limite)
+    ).order_by('-creado')
+    for trabajo in candidatos[:3]:
+        if trabajo.estado != Trabajo.TERMINADO or trabajo.artefacto_disponible():
+            return trabajo
+    usuario = usuario if usuario is not None and usuario.is_authenticated else None
+    return Trabajo.objects.create(tipo=tipo, parametros=parametros, clave=clave, usuario=usuario)
+
+
+def tomar_siguiente():
+    """Reclama el trabajo pendiente más antiguo y lo marca en proceso. None si no hay."""
+    pendientes = Trabajo.objects.filter(estado=Trabajo.PENDIENTE).order_by('creado').values_list('id', flat=True)
+    for trabajo_id in pendientes[:10]:
+        ahora = timezone.now()
+        reclamado = Trabajo.objects.filter(id=trabajo_id, estado=Trabajo.PENDIENTE).update(
+            estado=Trabajo.EN_PROCESO, iniciado=ahora, latido=ahora, intentos=F('intentos') + 1,
+        )
+        if reclamado:
+            return Trabajo.objects.get(id=trabajo_id)
+    return None
+
+
+def ejecutar(trabajo):
+    """Ejecuta la tarea y guarda su artefacto. Ante error reintenta hasta MAX_INTENTOS."""
+    funcion = registry.obtener(trabajo.tipo)
+    try:
+        if getattr(funcion, 'recibe_trabajo', False):
+            resultado = funcion(trabajo.parametros, trabajo)
+        else:
+            resultado = funcion(trabajo.parametros)
+    except Exception as e:
+        logger.exception("Trabajo %s (%s) falló", trabajo.pk, trabajo.tipo)
+        trabajo.error = str(e)[:2000]
+        trabajo.estado = Trabajo.PENDIENTE if trabajo.intentos < MAX_INTENTOS else Trabajo.ERROR
+        trabajo.terminado = timezone.now() if trabajo.estado == Trabajo.ERROR else None
+        trabajo.save(update_fields=['error', 'estado', 'terminado'])
+        return trabajo
+    if resultado is not None:
+        nombre, content_type, contenido = resultado
+        trabajo.archivo.save(nombre, ContentFile(contenido), save=False)
+        trabajo.nombre_archivo = nombre
+        trabajo.content_type = content_type
+    trabajo.estado = Trabajo.TERMINADO
+    trabajo.terminado = timezone.now()
+    trabajo.error = ''
+    trabajo.save(update_fields=['archivo', 'nombre_archivo', 'content_type', 'estado', 'terminado', 'error'])
+    return trabajo
+
+
+def guardar_progreso(trabajo, progreso):
+    """Guarda el avance y el latido sin tocar el resto del trabajo. Dentro de una transacción se confirma junto con ella."""
+    trabajo.progreso = progreso
+    trabajo.latido = timezone.now()
+    Trabajo.objects.filter(pk=trabajo.pk).update(progreso=progreso, latido=trabajo.latido)
+
+
+def recuperar_colgados():
+    """Devuelve a pendiente los trabajos en proceso sin latido hace más de JOBS_STALE_AFTER segundos (worker caído)."""
+    limite = timezone.now() - datetime.timedelta(seconds=settings.JOBS_STALE_AFTER)
+    colgados = Trabajo.objects.filter(estado=Trabajo.EN_PROCESO, latido__lt=limite)
+    reintentados = colgados.filter(intentos__lt=MAX_INTENTOS).update(estado=Trabajo.PENDIENTE)
+    # Los que quedan en proceso agotaron sus intentos
+    fallidos = colgados.update(estado=Trabajo.ERROR, error='Tiempo de ejecución agotado', terminado=timezone.now())
+    return reintentados + fallidos
+
+
+def purgar(retencion=None):
+    """Elimina trabajos finalizados (y sus archivos) con más de `retencion` segundos (JOBS_RETENTION)."""
+    retencion = settings.JOBS_RETENTION if retencion is None else retencion
+    limite = timezone.now() - datetime.timedelta(seconds=retencion)
+    viejos = Trabajo.objects.filter(estado__in=[Trabajo.TERMINADO, Trabajo.ERROR], terminado__lt=limite)
+    total = 0
+    for trabajo in viejos.iterator():
+        if trabajo.archivo:
+            trabajo.archivo.delete(save=False)
+        entrada = (trabajo.parametros or {}).get('archivo_entrada')
+        if entrada:
+            almacenamiento_artefactos().delete(entrada)
+        trabajo.delete()
+        total += 1
+    return total
+
+
+def procesar_pendientes(max_trabajos=None):
+    """Procesa trabajos pendientes hasta vaciar la cola (o `max_trabajos`). Retorna cuántos ejecutó."""
+    procesados = 0
+    while max_trabajos is None or procesados < max_trabajos:
+        trabajo = tomar_siguiente()
+        if trabajo is None:
+            break
+        ejecutar(trabajo)
+        procesados += 1
+    return procesados
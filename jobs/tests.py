@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from tests.factories import create_user, create_sucursal, create_product, make_sale
+from . import registry
+from .models import Trabajo
+from .services import encolar, ejecutar, guardar_progreso, procesar_pendientes, recuperar_colgados, tomar_siguiente, MAX_INTENTOS
+
+
+@registry.tarea('prueba_falla')
+def _tarea_que_falla(parametros):
+    raise RuntimeError('falla de prueba')
+
+
+class TrabajosExportacionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.override = override_settings(JOBS_ARTIFACT_ROOT=self.dir)
+        self.override.enable()
+        self.user = create_user('jobs_admin', is_staff=True)
+        self.sucursal = create_sucursal('Sucursal Jobs')
+        self.prod = create_product('J1', 'Prod Jobs', precio_compra=Decimal('100'), precio_venta=Decimal('1000'))
+        self.client.force_login(self.user)
+        self.url = reverse('reports:export_advanced_docx')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_exportacion_se_encola_y_se_descarga(self):
+        resp = self.client.get(self.url)
+        trabajo = Trabajo.objects.get()
+        self.assertRedirects(resp, reverse('jobs:estado', args=[trabajo.id]), fetch_redirect_response=False)
+        self.assertEqual(trabajo.estado, Trabajo.PENDIENTE)
+        self.assertEqual(trabajo.usuario, self.user)
+
+        estado = self.client.get(reverse('jobs:estado', args=[trabajo.id]), {'formato': 'json'}).json()
+        self.assertFalse(estado['finalizado'])
+        self.assertIsNone(estado['descarga_url'])
+
+        self.assertEqual(procesar_pendientes(), 1)
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, Trabajo.TERMINADO)
+        self.assertTrue(trabajo.artefacto_disponible())
+
+        descarga = self.client.get(reverse('jobs:descargar', args=[trabajo.id]))
+        self.assertEqual(descarga.status_code, 200)
+        self.assertIn('reporte_avanzado.docx', descarga['Content-Disposition'])
+        self.assertTrue(b''.join(descarga.streaming_content).startswith(b'PK'))
+
+    def test_reutiliza_artefacto_hasta_que_cambian_los_datos(self):
+        self.client.get(self.url)
+        procesar_pendientes()
+        trabajo = Trabajo.objects.get()
+
+        resp = self.client.get(self.url)
+        self.assertRedirects(resp, reverse('jobs:descargar', args=[trabajo.id]), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(self.url, {'formato': 'json'}).status_code, 200)
+        self.assertEqual(Trabajo.objects.count(), 1)
+
+        # Una venta nueva sube la versión de datos del día: el export se genera de nuevo
+        with self.captureOnCommitCallbacks(execute=True):
+            make_sale(self.user, self.sucursal, [(self.prod, 1)])
+        resp = self.client.get(self.url, {'formato': 'json'})
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(Trabajo.objects.count(), 2)
+        self.assertNotEqual(resp.json()['id'], trabajo.id)
+
+    def test_tomar_siguiente_es_exclusivo(self):
+        encolar('reporte_avanzado_docx', {'a': 1})
+        primero = tomar_siguiente()
+        self.assertEqual(primero.estado, Trabajo.EN_PROCESO)
+        self.assertEqual(primero.intentos, 1)
+        self.assertIsNone(tomar_siguiente())
+
+    @override_settings(JOBS_STALE_AFTER=600)
+    def test_tarea_larga_con_avance_no_se_reencola(self):
+        import datetime
+        from django.utils import timezone
+        encolar('reporte_avanzado_docx', {'a': 1})
+        encolar('reporte_avanzado_docx', {'a': 2})
+        viva, caida = tomar_siguiente(), tomar_siguiente()
+        hace_rato = timezone.now() - datetime.timedelta(seconds=3600)
+        Trabajo.objects.update(iniciado=hace_rato, latido=hace_rato)
+        # Sólo la tarea que sigue informando avance renueva su latido
+        guardar_progreso(viva, {'filas': 5000})
+        self.assertEqual(recuperar_colgados(), 1)
+        viva.refresh_from_db()
+        caida.refresh_from_db()
+        self.assertEqual((viva.estado, viva.progreso), (Trabajo.EN_PROCESO, {'filas': 5000}))
+        self.assertEqual(caida.estado, Trabajo.PENDIENTE)
+
+    def test_tarea_fallida_se_reintenta_y_termina_en_error(self):
+        trabajo = encolar('prueba_falla', {})
+        with self.assertLogs('jobs.services', level='ERROR'):
+            for _ in range(MAX_INTENTOS - 1):
+                ejecutar(tomar_siguiente())
+                trabajo.refresh_from_db()
+                self.assertEqual(trabajo.estado, Trabajo.PENDIENTE)
+            ejecutar(tomar_siguiente())
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, Trabajo.ERROR)
+        self.assertIn('falla de prueba', trabajo.error)
+        self.assertIsNone(tomar_siguiente())
+
+    def test_trabajo_ajeno_no_es_visible(self):
+        self.client.get(self.url)
+        trabajo = Trabajo.objects.get()
+        procesar_pendientes()
+        otro = create_user('jobs_otro', is_staff=False)
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(reverse('jobs:estado', args=[trabajo.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('jobs:descargar', args=[trabajo.id])).status_code, 404)
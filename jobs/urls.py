@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'jobs'
+
+urlpatterns = [
+    path('<int:trabajo_id>/', views.estado_trabajo, name='estado'),
+    path('<int:trabajo_id>/descargar/', views.descargar_trabajo, name='descargar'),
+]
@@ -0,0 +1,53 @@
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+
+from .models import Trabajo
+
+
+def _trabajo_de(request, trabajo_id):
+    """El trabajo si pertenece al usuario (o el usuario es admin); 404 en otro caso."""
+    trabajo = get_object_or_404(Trabajo, id=trabajo_id)
+    user = request.user
+    if not (user.is_staff or user.is_superuser or trabajo.usuario_id == user.id):
+        raise Http404("Trabajo no encontrado")
+    return trabajo
+
+
+def datos_trabajo(trabajo):
+    return {
+        'id': trabajo.id,
+        'tipo': trabajo.tipo,
+        'estado': trabajo.estado,
+        'finalizado': trabajo.finalizado,
+        'creado': trabajo.creado.isoformat(),
+        'terminado': trabajo.terminado.isoformat() if trabajo.terminado else None,
+        'error': trabajo.error if trabajo.estado == Trabajo.ERROR else '',
+        'estado_url': reverse('jobs:estado', args=[trabajo.id]),
+        'descarga_url': reverse('jobs:descargar', args=[trabajo.id]) if trabajo.estado == Trabajo.TERMINADO and trabajo.archivo else None,
+        'progreso': trabajo.progreso,
+    }
+
+
+@login_required
+def estado_trabajo(request, trabajo_id):
+    """Estado del trabajo: JSON para el polling (?formato=json) o página que espera y descarga."""
+    trabajo = _trabajo_de(request, trabajo_id)
+    datos = datos_trabajo(trabajo)
+    if request.GET.get('formato') == 'json':
+        return JsonResponse(datos)
+    return render(request, 'jobs/trabajo.html', {'trabajo': trabajo, 'datos': datos})
+
+
+@login_required
+def descargar_trabajo(request, trabajo_id):
+    trabajo = _trabajo_de(request, trabajo_id)
+    if not trabajo.artefacto_disponible():
+        raise Http404("El archivo aún no está disponible")
+    return FileResponse(
+        trabajo.archivo.open('rb'),
+        as_attachment=True,
+        filename=trabajo.nombre_archivo,
+        content_type=trabajo.content_type or 'application/octet-stream',
+    )
@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import Product, StockSucursal, TransferenciaStock, AjusteStock
+from .models import (
+    AjusteStock, CorteStock, ManifiestoTransferencia, MovimientoStock, Product, StockSucursal, TransferenciaStock,
+)
 
 admin.site.register(Product)
 admin.site.register(StockSucursal)
 admin.site.register(TransferenciaStock)
 admin.site.register(AjusteStock)
+admin.site.register(ManifiestoTransferencia)
+admin.site.register(MovimientoStock)
+admin.site.register(CorteStock)
@@ -0,0 +1,340 @@
+"""
+Importación masiva de productos desde planillas (comando import_products y carga web).
+
+Las filas se leen en streaming y se aplican en lotes de `lote` filas:
+- los productos existentes se buscan sólo para los códigos del lote (un SELECT ... IN),
+  nunca se carga el catálogo completo;
+- los productos se crean/actualizan con bulk_create / bulk_update;
+- el stock por sucursal se escribe con un upsert (bulk_create con update_conflicts
+  sobre producto+sucursal), sin una consulta por celda, y la variación de cada fila
+  se asienta en el libro de stock (products.libro).
+Cada lote se confirma en su propia transacción, así la memoria y el costo por lote no
+dependen del tamaño del archivo. El callback `progreso` corre dentro de esa transacción:
+si guarda el resultado (ResultadoImportacion.como_dict), una importación interrumpida
+se reanuda desde la última fila confirmada pasando `resultado=ResultadoImportacion.desde_dict(...)`.
+"""
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from sucursales.models import Sucursal
+from . import libro
+from .models import MovimientoStock, Product, StockSucursal
+from .scan_cache import invalidar_productos
+from .search import reindexar_productos
+
+ENCABEZADOS_MINIMOS = ['NOMBRE', 'CODIGO 1', 'PRECIO DE COMPRA', 'PRECIO DE VENTA']
+CAMPOS_PRODUCTO = [
+    'nombre', 'descripcion', 'codigo_alternativo', 'codigo_barras', 'fecha_ingreso_producto',
+    'precio_compra', 'precio_venta', 'permitir_venta_sin_stock',
+]
+# Columnas opcionales de compatibilidad: sólo se actualizan si vienen en el archivo
+CAMPOS_OPCIONALES = {'CANTIDAD': 'cantidad', 'STOCK': 'stock', 'SUCURSAL': 'sucursal'}
+PREFIJOS_STOCK = ('STOCK@', 'STOCK:', 'STOCK ')
+MAX_MENSAJES = 200
+
+
+class ErrorImportacion(Exception):
+    """El archivo no se puede importar (p.ej. faltan encabezados obligatorios)."""
+
+
+def a_decimal(val):
+    if val is None:
+        return Decimal('0.00')
+    try:
+        texto = str(val).strip().replace(',', '.')
+        return Decimal(texto) if texto else Decimal('0.00')
+    except (ValueError, TypeError, InvalidOperation):
+        return Decimal('0.00')
+
+
+def a_entero(val):
+    try:
+        if val is None:
+            return 0
+        texto = str(val).strip().replace(',', '')
+        return int(float(texto)) if texto else 0
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+
+def a_booleano(val, default=True):
+    if val is None:
+        return default
+    texto = str(val).strip().lower()
+    if texto in ('1', 'true', 'sí', 'si', 'yes', 'y', 'on'):
+        return True
+    if texto in ('0', 'false', 'no', 'off', 'n'):
+        return False
+    return default
+
+
+def a_fecha(val):
+    """date o None. Lanza ValueError si el texto parece fecha pero no es válida."""
+    if not val:
+        return None
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    return parse_date(str(val).split(' ')[0].strip())
+
+
+def _texto(val):
+    return str(val).strip() if val is not None else ''
+
+
+def validar_encabezados(header_map):
+    faltantes = [h for h in ENCABEZADOS_MINIMOS if h not in header_map]
+    if faltantes:
+        raise ErrorImportacion(f'Faltan encabezados obligatorios: {", ".join(faltantes)}')
+
+
+def encabezados(fila):
+    """{encabezado: índice} de la primera fila del archivo."""
+    return {_texto(v): i for i, v in enumerate(fila or []) if _texto(v)}
+
+
+@contextmanager
+def hoja_xlsx(origen):
+    """(encabezados, filas) de la hoja activa de un .xlsx, leída en modo streaming."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(origen, read_only=True, data_only=True)
+    try:
+        filas = workbook.active.iter_rows(values_only=True)
+        yield encabezados(next(filas, None)), filas
+    finally:
+        workbook.close()
+
+
+class ResultadoImportacion:
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.filas = 0
+        self.creados = 0
+        self.actualizados = 0
+        self.stocks = 0
+        self.segundos = 0.0
+        self.ultima_fila = 0  # Última fila del archivo confirmada (para reanudar)
+        self.total_advertencias = 0
+        self.total_errores = 0
+        self.advertencias = []
+        self.errores = []
+
+    def advertir(self, mensaje):
+        self.total_advertencias += 1
+        if len(self.advertencias) < MAX_MENSAJES:
+            self.advertencias.append(mensaje)
+
+    def error(self, mensaje):
+        self.total_errores += 1
+        if len(self.errores) < MAX_MENSAJES:
+            self.errores.append(mensaje)
+
+    @property
+    def filas_por_segundo(self):
+        return self.filas / self.segundos if self.segundos else 0.0
+
+    def como_dict(self):
+        datos = dict(vars(self))
+        datos['filas_por_segundo'] = round(self.filas_por_segundo, 1)
+        return datos
+
+    @classmethod
+    def desde_dict(cls, datos):
+        resultado = cls(datos.get('dry_run', False))
+        for campo in vars(resultado):
+            if campo in datos:
+                setattr(resultado, campo, datos[campo])
+        return resultado
+
+
+class ImportadorProductos:
+    """Aplica las filas de una planilla de productos en lotes (ver docstring del módulo)."""
+
+    def __init__(self, header_map, dry_run=False, lote=500):
+        validar_encabezados(header_map)
+        self.header_map = header_map
+        self.dry_run = dry_run
+        self.lote = max(1, lote)
+        self.campos = CAMPOS_PRODUCTO + [campo for h, campo in CAMPOS_OPCIONALES.items() if h in header_map]
+
+        sucursales = list(Sucursal.objects.all())
+        self._suc_por_nombre = {(s.nombre or '').strip().lower(): s for s in sucursales}
+        self._suc_por_id = {str(s.id): s for s in sucursales}
+        # Columnas de stock por sucursal: "STOCK@Nombre", "STOCK:Nombre" o "STOCK Nombre" (nombre o id)
+        self._columnas_stock = []
+        for h in header_map:
+            if h.upper().startswith(PREFIJOS_STOCK):
+                sucursal = self._sucursal(h[6:])
+                if sucursal:
+                    self._columnas_stock.append((h, sucursal))
+
+    def _sucursal(self, valor):
+        texto = _texto(valor)
+        if not texto:
+            return None
+        return self._suc_por_nombre.get(texto.lower()) or self._suc_por_id.get(texto)
+
+    def importar(self, filas, primera_fila=2, progreso=None, resultado=None):
+        """Procesa un iterable de filas (tuplas de valores).
+
+        `progreso(resultado)` se llama al confirmar cada lote. Con `resultado` (de una
+        ejecución anterior) se saltan las filas hasta `resultado.ultima_fila`.
+        """
+        resultado = resultado or ResultadoImportacion(self.dry_run)
+        self._inicio = time.monotonic() - resultado.segundos
+        vistos = set()
+        pendientes = []
+        for numero, valores in enumerate(filas, start=primera_fila):
+            if numero <= resultado.ultima_fila:
+                # Ya confirmada: sólo se recuerda el código para detectar duplicados
+                vistos.add(self._codigo(valores))
+                continue
+            item = self._leer_fila(numero, valores, vistos, resultado)
+            if item is None:
+                continue
+            pendientes.append(item)
+            if len(pendientes) >= self.lote:
+                self._aplicar(pendientes, resultado, progreso)
+                pendientes = []
+        if pendientes:
+            self._aplicar(pendientes, resultado, progreso)
+        resultado.segundos = time.monotonic() - self._inicio
+        return resultado
+
+    def _valor(self, valores, encabezado):
+        idx = self.header_map.get(encabezado)
+        return valores[idx] if idx is not None and idx < len(valores) else None
+
+    def _codigo(self, valores):
+        return _texto(self._valor(valores, 'CODIGO 1'))
+
+    def _leer_fila(self, numero, valores, vistos, resultado):
+        """(fila, código, campos, {sucursal_id: cantidad}) de una fila, o None si se salta."""
+        if not any(_texto(v) for v in valores):
+            return None
+
+        def valor(encabezado):
+            return self._valor(valores, encabezado)
+
+        codigo = self._codigo(valores)
+        if not codigo:
+            resultado.advertir(f'Fila {numero}: CODIGO 1 vacío. Saltada.')
+            return None
+        if codigo in vistos:
+            resultado.advertir(f'Fila {numero}: Código duplicado en archivo ({codigo}). Se usa primera aparición.')
+            return None
+        vistos.add(codigo)
+        resultado.filas += 1
+
+        try:
+            fecha_raw = valor('FECHA DE INGRESO')
+            try:
+                fecha = a_fecha(fecha_raw)
+            except ValueError:
+                fecha = None
+            if fecha_raw and fecha is None:
+                resultado.advertir(f'Fila {numero}: Fecha inválida "{fecha_raw}" -> se asigna nulo.')
+            campos = {
+                'nombre': _texto(valor('NOMBRE')),
+                'descripcion': _texto(valor('DESCRIPCION')) or None,
+                # Migración: CODIGO 2 del archivo se interpreta como código de barras si no hay CODIGO DE BARRAS
+                'codigo_barras': _texto(valor('CODIGO DE BARRAS')) or _texto(valor('CODIGO 2')) or None,
+                'codigo_alternativo': None,  # deprecado como entrada de import
+                'fecha_ingreso_producto': fecha,
+                'precio_compra': a_decimal(valor('PRECIO DE COMPRA')),
+                'precio_venta': a_decimal(valor('PRECIO DE VENTA')),
+                'permitir_venta_sin_stock': a_booleano(valor('PERMITIR VENTA SIN STOCK'), default=True),
+            }
+            # Cantidades globales y sucursal por fila (opcionales): celdas vacías no pisan el valor actual
+            cantidad = a_entero(valor('CANTIDAD'))
+            stock = a_entero(valor('STOCK'))
+            sucursal = self._sucursal(valor('SUCURSAL'))
+            if cantidad:
+                campos['cantidad'] = cantidad
+            if stock:
+                campos['stock'] = stock
+            if sucursal:
+                campos['sucursal'] = sucursal
+
+            stocks = {}
+            if stock and sucursal:
+                stocks[sucursal.id] = stock
+            for encabezado, suc in self._columnas_stock:
+                cantidad_suc = a_entero(valor(encabezado))
+                if cantidad_suc:
+                    stocks[suc.id] = cantidad_suc
+        except Exception as e:
+            resultado.error(f'Fila {numero}: Error inesperado -> {e}')
+            return None
+        return numero, codigo, campos, stocks
+
+    def _avanzar(self, items, resultado, progreso):
+        resultado.ultima_fila = items[-1][0]
+        resultado.segundos = time.monotonic() - self._inicio
+        if progreso:
+            progreso(resultado)
+
+    def _aplicar(self, items, resultado, progreso=None):
+        existentes = {p.producto_id: p for p in Product.objects.filter(producto_id__in=[c for _, c, _, _ in items])}
+        crear, actualizar = [], []
+        for _, codigo, campos, _ in items:
+            prod = existentes.get(codigo)
+            if prod is None:
+                crear.append(Product(producto_id=codigo, **campos))
+            elif any(getattr(prod, k) != v for k, v in campos.items()):
+                for k, v in campos.items():
+                    setattr(prod, k, v)
+                actualizar.append(prod)
+        resultado.creados += len(crear)
+        resultado.actualizados += len(actualizar)
+        stocks = [(codigo, suc_id, cantidad) for _, codigo, _, por_suc in items for suc_id, cantidad in por_suc.items()]
+        resultado.stocks += len(stocks)
+        if self.dry_run:
+            self._avanzar(items, resultado, progreso)
+            return
+
+        with transaction.atomic():
+            if crear:
+                Product.objects.bulk_create(crear, batch_size=self.lote)
+            if actualizar:
+                Product.objects.bulk_update(actualizar, self.campos, batch_size=self.lote)
+            ids = {p.producto_id: p.pk for p in existentes.values()}
+            ids.update((p.producto_id, p.pk) for p in crear)
+            if crear and any(pk is None for pk in ids.values()):
+                # Backends que no devuelven las pk del bulk_create
+                ids = dict(Product.objects.filter(producto_id__in=list(ids)).values_list('producto_id', 'id'))
+            # bulk_* no dispara señales: índice de búsqueda y caché de escaneo se actualizan aquí
+            tocados = [ids[p.producto_id] for p in crear + actualizar]
+            if tocados:
+                reindexar_productos(tocados)
+            if stocks:
+                nuevas = {(ids[codigo], suc_id): max(0, cantidad) for codigo, suc_id, cantidad in stocks}
+                # Valores previos (bloqueados) para asentar en el libro la variación de cada fila
+                anteriores = {
+                    (pid, suc_id): cantidad
+                    for pid, suc_id, cantidad in StockSucursal.objects.select_for_update()
+                    .filter(producto_id__in={pid for pid, _ in nuevas}, sucursal_id__in={s for _, s in nuevas})
+                    .order_by('id').values_list('producto_id', 'sucursal_id', 'cantidad')
+                }
+                StockSucursal.objects.bulk_create(
+                    [StockSucursal(producto_id=pid, sucursal_id=suc_id, cantidad=cantidad)
+                     for (pid, suc_id), cantidad in nuevas.items()],
+                    batch_size=self.lote,
+                    update_conflicts=True,
+                    unique_fields=['producto', 'sucursal'],
+                    update_fields=['cantidad'],
+                )
+                libro.registrar(
+                    MovimientoStock.IMPORTACION,
+                    {clave: cantidad - anteriores.get(clave, 0) for clave, cantidad in nuevas.items()},
+                )
+            afectados = set(tocados) | {ids[codigo] for codigo, _, _ in stocks}
+            transaction.on_commit(lambda: invalidar_productos(afectados))
+            # En la misma transacción que el lote: al reanudar no se repite ni se salta ninguna fila
+            self._avanzar(items, resultado, progreso)
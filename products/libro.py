@@ -0,0 +1,216 @@
+"""
+Libro de movimientos de stock (MovimientoStock) y cortes periódicos (CorteStock).
+
+StockSucursal sigue siendo el valor vigente que leen caja, listados y reportes; cada
+operación que lo modifica (venta, transferencia, ajuste, importación) asienta además la
+variación efectiva en el libro, en la misma transacción y con un INSERT masivo que no
+compite por filas con otras operaciones.
+
+El stock a una fecha es el último corte anterior más los deltas asentados después:
+- un corte guarda los saldos distintos de cero por (producto, sucursal);
+- el primer corte toma StockSucursal como saldo inicial del libro;
+- los siguientes se calculan del corte anterior más los deltas, sin recorrer la historia;
+- cada saldo guarda el precio de compra vigente, para valorizar el inventario a la fecha
+  del corte (reports.valorizacion);
+- los cortes automáticos (`corte_periodico`) cierran cada día local en su último segundo,
+  la misma fecha con la que la valorización busca el corte de un día.
+
+`conciliar` compara StockSucursal con el libro y, si se pide, corrige StockSucursal.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import CorteStock, MovimientoStock, Product, SaldoCorte, StockSucursal
+from .scan_cache import invalidar_productos
+
+LOTE = 2000
+
+
+class LibroError(Exception):
+    """El libro no puede responder la consulta (p.ej. no hay un corte anterior a la fecha)."""
+
+
+def registrar(tipo, deltas, referencias=None):
+    """Asienta {(producto_id, sucursal_id): delta} en el libro con un INSERT masivo (omite los deltas nulos)."""
+    referencias = referencias or {}
+    movimientos = [
+        MovimientoStock(
+            producto_id=producto_id, sucursal_id=sucursal_id, delta=delta, tipo=tipo,
+            referencia=referencias.get((producto_id, sucursal_id)),
+        )
+        for (producto_id, sucursal_id), delta in deltas.items()
+        if delta
+    ]
+    if movimientos:
+        MovimientoStock.objects.bulk_create(movimientos, batch_size=LOTE)
+    return movimientos
+
+
+def registrar_aperturas(saldos):
+    """Asienta el saldo inicial de filas StockSucursal recién creadas (una segunda apertura de la misma fila se ignora)."""
+    MovimientoStock.objects.bulk_create(
+        [
+            MovimientoStock(producto_id=producto_id, sucursal_id=sucursal_id, delta=cantidad, tipo=MovimientoStock.APERTURA)
+            for (producto_id, sucursal_id), cantidad in saldos.items()
+            if cantidad
+        ],
+        batch_size=LOTE,
+        ignore_conflicts=True,
+    )
+
+
+def fin_del_dia(dia):
+    """Último segundo (aware) del día local `dia`: fecha de los cortes de cierre diario."""
+    return timezone.make_aware(datetime.combine(dia, time(23, 59, 59)))
+
+
+def ultimo_corte(fecha=None):
+    """Último corte con fecha <= `fecha` (el más reciente si `fecha` es None), o None."""
+    cortes = CorteStock.objects.order_by('-fecha', '-id')
+    if fecha is not None:
+        cortes = cortes.filter(fecha__lte=fecha)
+    return cortes.first()
+
+
+def stock_al(fecha=None, sucursal_id=None, producto_ids=None):
+    """{(producto_id, sucursal_id): cantidad} según el libro a `fecha` (None: incluye todo lo asentado).
+
+    Dos consultas: los saldos del corte y la suma de los deltas posteriores agrupada por
+    producto y sucursal. Los pares sin saldo ni movimientos no aparecen (cantidad 0).
+    Lanza LibroError si no hay un corte anterior a la fecha.
+    """
+    corte = ultimo_corte(fecha)
+    if corte is None:
+        raise LibroError("No hay un corte de stock anterior a la fecha; ejecute snapshot_stock.")
+    saldos_qs = SaldoCorte.objects.filter(corte=corte)
+    movimientos = MovimientoStock.objects.filter(fecha__gt=corte.fecha)
+    if fecha is not None:
+        movimientos = movimientos.filter(fecha__lte=fecha)
+    if sucursal_id is not None:
+        saldos_qs = saldos_qs.filter(sucursal_id=sucursal_id)
+        movimientos = movimientos.filter(sucursal_id=sucursal_id)
+    if producto_ids is not None:
+        saldos_qs = saldos_qs.filter(producto_id__in=producto_ids)
+        movimientos = movimientos.filter(producto_id__in=producto_ids)
+
+    saldos = {
+        (producto_id, suc_id): cantidad
+        for producto_id, suc_id, cantidad in saldos_qs.values_list('producto_id', 'sucursal_id', 'cantidad').iterator(LOTE)
+    }
+    deltas = (
+        movimientos.values('producto_id', 'sucursal_id')
+        .annotate(total=Sum('delta'))
+        .order_by()
+        .values_list('producto_id', 'sucursal_id', 'total')
+    )
+    for producto_id, suc_id, total in deltas:
+        saldos[(producto_id, suc_id)] = saldos.get((producto_id, suc_id), 0) + total
+    return saldos
+
+
+@transaction.atomic
+def tomar_corte(fecha=None):
+    """Crea y retorna un corte a `fecha` (por defecto, ahora menos STOCK_SNAPSHOT_MARGIN segundos).
+
+    El primer corte abre el libro: guarda los valores actuales de StockSucursal (a la hora
+    actual, ignorando `fecha`). Los siguientes parten del corte anterior a `fecha` más los
+    deltas posteriores. El margen deja fuera los movimientos de transacciones que aún no
+    confirman, que de otro modo quedarían antes del corte sin estar en él.
+    """
+    if not CorteStock.objects.exists():
+        fecha = timezone.now()
+        saldos = {
+            (producto_id, sucursal_id): cantidad
+            for producto_id, sucursal_id, cantidad in StockSucursal.objects.exclude(cantidad=0)
+            .values_list('producto_id', 'sucursal_id', 'cantidad').iterator(LOTE)
+        }
+    else:
+        if fecha is None:
+            fecha = timezone.now() - timedelta(seconds=settings.STOCK_SNAPSHOT_MARGIN)
+        saldos = {clave: cantidad for clave, cantidad in stock_al(fecha).items() if cantidad}
+    corte = CorteStock.objects.create(fecha=fecha, total_saldos=len(saldos))
+    # Precio de compra sólo de los productos con saldo, por lotes de ids (no se recorre el catálogo)
+    con_saldo = list({producto_id for producto_id, _ in saldos})
+    costos = {}
+    for i in range(0, len(con_saldo), LOTE):
+        costos.update(Product.objects.filter(id__in=con_saldo[i:i + LOTE]).values_list('id', 'precio_compra'))
+    SaldoCorte.objects.bulk_create(
+        [
+            SaldoCorte(
+                corte=corte, producto_id=producto_id, sucursal_id=sucursal_id, cantidad=cantidad,
+                costo_unitario=costos.get(producto_id) or 0,
+            )
+            for (producto_id, sucursal_id), cantidad in saldos.items()
+        ],
+        batch_size=LOTE,
+    )
+    return corte
+
+
+def corte_periodico():
+    """Toma el corte de cierre de cada día local terminado que aún no lo tenga. Retorna el último tomado, o None.
+
+    Normalmente es sólo el de ayer; tras una caída del worker se completan los días
+    faltantes en orden. Un día se cierra STOCK_SNAPSHOT_MARGIN segundos después de
+    medianoche, para incluir las transacciones que aún confirmaban. Sin cortes previos
+    toma el de apertura del libro.
+    """
+    ultimo = ultimo_corte()
+    if ultimo is None:
+        return tomar_corte()
+    cerrado = timezone.localdate(timezone.now() - timedelta(seconds=settings.STOCK_SNAPSHOT_MARGIN)) - timedelta(days=1)
+    dia = timezone.localdate(ultimo.fecha)
+    if ultimo.fecha >= fin_del_dia(dia):
+        dia += timedelta(days=1)
+    corte = None
+    while dia <= cerrado:
+        corte = tomar_corte(fin_del_dia(dia))
+        dia += timedelta(days=1)
+    return corte
+
+
+@transaction.atomic
+def conciliar(reparar=False, sucursal_id=None):
+    """Diferencias entre StockSucursal y el libro: [(producto_id, sucursal_id, actual, segun_libro)].
+
+    Con `reparar` las filas se bloquean (en orden de id) antes de leer el libro y se dejan
+    con el valor del libro; las que faltan se crean. Un saldo negativo en el libro deja la
+    fila en 0 y asienta un movimiento de conciliación que lleva el libro también a 0.
+    """
+    filas = StockSucursal.objects.all()
+    if sucursal_id is not None:
+        filas = filas.filter(sucursal_id=sucursal_id)
+    if reparar:
+        filas = filas.select_for_update().order_by('id')
+    actuales = {
+        (producto_id, suc_id): cantidad
+        for producto_id, suc_id, cantidad in filas.values_list('producto_id', 'sucursal_id', 'cantidad').iterator(LOTE)
+    }
+    libro = stock_al(sucursal_id=sucursal_id)
+    diferencias = [
+        (producto_id, suc_id, actuales.get((producto_id, suc_id), 0), libro.get((producto_id, suc_id), 0))
+        for producto_id, suc_id in sorted(actuales.keys() | libro.keys())
+        if actuales.get((producto_id, suc_id), 0) != libro.get((producto_id, suc_id), 0)
+    ]
+    if reparar and diferencias:
+        StockSucursal.objects.bulk_create(
+            [
+                StockSucursal(producto_id=producto_id, sucursal_id=suc_id, cantidad=max(esperado, 0))
+                for producto_id, suc_id, _, esperado in diferencias
+            ],
+            batch_size=LOTE,
+            update_conflicts=True,
+            unique_fields=['producto', 'sucursal'],
+            update_fields=['cantidad'],
+        )
+        registrar(MovimientoStock.CONCILIACION, {
+            (producto_id, suc_id): -esperado for producto_id, suc_id, _, esperado in diferencias if esperado < 0
+        })
+        # bulk_create no emite señales: invalidar la caché de escaneo al confirmar
+        reparados = {producto_id for producto_id, _, _, _ in diferencias}
+        transaction.on_commit(lambda: invalidar_productos(reparados))
+    return diferencias
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.search import reindexar_productos
+
+
+class Command(BaseCommand):
+    help = "Rebuild the normalized product search index (tokens and trigrams) used by the cashier search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=2000, help="Batch size for bulk inserts")
+
+    def handle(self, batch=2000, **options):
+        total = reindexar_productos(batch_size=batch)
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt. tokens={total}"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.libro import LibroError, conciliar
+
+
+class Command(BaseCommand):
+    help = "Compare branch stock (StockSucursal) with the stock ledger and optionally repair it from the ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Set mismatched branch stock to the ledger value")
+        parser.add_argument("--sucursal", type=int, default=None, help="Only reconcile this branch id")
+        parser.add_argument("--mostrar", type=int, default=20, help="Differences to print (default: 20)")
+
+    def handle(self, fix=False, sucursal=None, mostrar=20, **options):
+        try:
+            diferencias = conciliar(reparar=fix, sucursal_id=sucursal)
+        except LibroError as e:
+            raise CommandError(str(e))
+        for producto_id, sucursal_id, actual, esperado in diferencias[:mostrar]:
+            self.stdout.write(f"  product={producto_id} branch={sucursal_id} stock={actual} ledger={esperado}")
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS("Branch stock matches the ledger."))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {len(diferencias)} row(s) from the ledger."))
+        else:
+            raise CommandError(f"{len(diferencias)} row(s) differ from the ledger. Run with --fix to repair them.")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from products.libro import LibroError, fin_del_dia, tomar_corte
+
+
+class Command(BaseCommand):
+    help = (
+        "Take a stock ledger snapshot (per-branch balances valued at the current purchase price) so "
+        "point-in-time stock and inventory valuation only read the movements after it. The first "
+        "snapshot opens the ledger from the current branch stock. run_jobs closes every finished "
+        "local day automatically; use this command for extra snapshots or without the worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fecha", default=None,
+            help="Snapshot date/time (ISO format). Default: now minus STOCK_SNAPSHOT_MARGIN seconds",
+        )
+        parser.add_argument(
+            "--dia", default=None,
+            help="Snapshot at the end of this local day (YYYY-MM-DD), e.g. a month-end close",
+        )
+
+    def handle(self, fecha=None, dia=None, **options):
+        if fecha is not None and dia is not None:
+            raise CommandError("Use either --fecha or --dia, not both.")
+        if fecha is not None:
+            valor = parse_datetime(fecha)
+            if valor is None:
+                raise CommandError("--fecha must be an ISO date/time, e.g. 2024-01-31T23:59:59")
+            fecha = timezone.make_aware(valor) if timezone.is_naive(valor) else valor
+        if dia is not None:
+            valor = parse_date(dia)
+            if valor is None:
+                raise CommandError("--dia must be a date, e.g. 2024-01-31")
+            fecha = fin_del_dia(valor)
+        try:
+            corte = tomar_corte(fecha)
+        except LibroError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot #{corte.pk} at {timezone.localtime(corte.fecha):%Y-%m-%d %H:%M:%S} "
+            f"with {corte.total_saldos} balance(s)"
+        ))
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:20
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copia congelada de la tokenización de products.search al crear el índice: la migración
+# no depende del código vivo, que puede cambiar después.
+CAMPOS_CODIGO = ('producto_id', 'codigo_barras', 'codigo_alternativo')
+CAMPOS_TEXTO = ('nombre',) + CAMPOS_CODIGO
+SEPARADORES = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar(texto):
+    if texto is None:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return texto.lower().strip()
+
+
+def tokens_de_producto(valores):
+    tokens = set()
+    for campo in CAMPOS_CODIGO:
+        codigo = normalizar(valores.get(campo))
+        if codigo:
+            tokens.add(('c', codigo[:255]))
+    for campo in CAMPOS_TEXTO:
+        for palabra in SEPARADORES.split(normalizar(valores.get(campo))):
+            palabra = palabra[:255]
+            if not palabra:
+                continue
+            tokens.add(('w', palabra))
+            tokens.update(('t', palabra[i:i + 3]) for i in range(len(palabra) - 2))
+    return tokens
+
+
+def construir_indice(apps, schema_editor):
+    """Indexa el catálogo existente."""
+    Product = apps.get_model('products', 'Product')
+    ProductoBusqueda = apps.get_model('products', 'ProductoBusqueda')
+    nuevos = []
+    for valores in Product.objects.values('id', *CAMPOS_TEXTO).iterator(chunk_size=2000):
+        for tipo, token in tokens_de_producto(valores):
+            nuevos.append(ProductoBusqueda(producto_id=valores['id'], tipo=tipo, token=token))
+        if len(nuevos) >= 2000:
+            ProductoBusqueda.objects.bulk_create(nuevos)
+            nuevos = []
+    if nuevos:
+        ProductoBusqueda.objects.bulk_create(nuevos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_merge_0011_and_0015'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=1)),
+                ('token', models.CharField(max_length=255)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens_busqueda', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Token de Búsqueda',
+                'verbose_name_plural': 'Tokens de Búsqueda',
+                'indexes': [models.Index(fields=['tipo', 'token', 'producto'], name='products_busq_tipo_token')],
+            },
+        ),
+        migrations.RunPython(construir_indice, migrations.RunPython.noop),
+    ]
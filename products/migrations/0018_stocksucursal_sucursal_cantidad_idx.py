@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_productobusqueda'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocksucursal',
+            index=models.Index(fields=['sucursal', 'cantidad'], name='products_stock_suc_cant'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_stocksucursal_sucursal_cantidad_idx'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ajustestock',
+            index=models.Index(fields=['fecha'], name='products_ajuste_fecha'),
+        ),
+        migrations.AddIndex(
+            model_name='transferenciastock',
+            index=models.Index(fields=['fecha'], name='products_transf_fecha'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_historial_keyset_idx'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['nombre'], name='products_prod_nombre'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('codigo_barras__isnull', False)), fields=['codigo_barras'], name='products_prod_barras'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('codigo_alternativo__isnull', False)), fields=['codigo_alternativo'], name='products_prod_cod_alt'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_indices_consultas_frecuentes'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManifiestoTransferencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('nota', models.CharField(blank=True, max_length=255, null=True)),
+                ('total_lineas', models.PositiveIntegerField(default=0)),
+                ('total_unidades', models.PositiveIntegerField(default=0)),
+                ('destino', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='manifiestos_entrantes', to='sucursales.sucursal')),
+                ('origen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='manifiestos_salientes', to='sucursales.sucursal')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Manifiesto de Transferencia',
+                'verbose_name_plural': 'Manifiestos de Transferencia',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.AddField(
+            model_name='transferenciastock',
+            name='manifiesto',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transferencias', to='products.manifiestotransferencia'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_manifiesto_transferencia'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorteStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(db_index=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('total_saldos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Corte de Stock',
+                'verbose_name_plural': 'Cortes de Stock',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoCorte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField()),
+                ('corte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='products.cortestock')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_corte', to='products.product')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_corte', to='sucursales.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Saldo de Corte',
+                'verbose_name_plural': 'Saldos de Corte',
+            },
+        ),
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('tipo', models.CharField(choices=[('apertura', 'Saldo inicial'), ('venta', 'Venta'), ('devolucion', 'Devolución'), ('transferencia', 'Transferencia'), ('ajuste', 'Ajuste'), ('importacion', 'Importación'), ('conciliacion', 'Conciliación')], max_length=20)),
+                ('referencia', models.PositiveIntegerField(blank=True, null=True)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_stock', to='products.product')),
+                ('sucursal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_stock', to='sucursales.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Movimiento de Stock',
+                'verbose_name_plural': 'Movimientos de Stock',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['fecha'], name='products_mov_fecha'), models.Index(fields=['producto', 'sucursal', 'fecha'], name='products_mov_prod_suc_fecha')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='movimientostock',
+            constraint=models.UniqueConstraint(condition=models.Q(('tipo', 'apertura')), fields=('producto', 'sucursal'), name='products_mov_apertura_unica'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='saldocorte',
+            unique_together={('corte', 'producto', 'sucursal')},
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:06
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_libro_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='saldocorte',
+            name='costo_unitario',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+    ]
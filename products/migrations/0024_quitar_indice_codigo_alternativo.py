@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 05:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_saldo_corte_costo'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='products_prod_cod_alt',
+        ),
+    ]
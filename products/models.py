@@ -1,7 +1,10 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from decimal import Decimal, ROUND_HALF_UP
 from django.core.validators import MinValueValidator
+from django.db.models import Case, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from sucursales.models import Sucursal
 
 class StockSucursal(models.Model):
@@ -17,10 +20,32 @@ class StockSucursal(models.Model):
         verbose_name = "Stock por Sucursal"
         verbose_name_plural = "Stocks por Sucursal"
         unique_together = ('producto', 'sucursal')
+        indexes = [
+            # Filtros de stock bajo/agotado por sucursal (ProductQuerySet.con_stock_entre)
+            models.Index(fields=['sucursal', 'cantidad'], name='products_stock_suc_cant'),
+        ]
 
     def __str__(self):
         return f"{self.producto} @ {self.sucursal} = {self.cantidad}"
 
+class ManifiestoTransferencia(models.Model):
+    """Documento de transferencia: varias líneas (TransferenciaStock) entre dos sucursales aplicadas juntas."""
+    origen = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='manifiestos_salientes')
+    destino = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='manifiestos_entrantes')
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha = models.DateTimeField(auto_now_add=True)
+    nota = models.CharField(max_length=255, blank=True, null=True)
+    total_lineas = models.PositiveIntegerField(default=0)
+    total_unidades = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-fecha']
+        verbose_name = 'Manifiesto de Transferencia'
+        verbose_name_plural = 'Manifiestos de Transferencia'
+
+    def __str__(self):
+        return f"Manifiesto #{self.pk}: {self.origen} -> {self.destino} ({self.total_lineas} líneas)"
+
 class TransferenciaStock(models.Model):
     """Historial de transferencias de stock entre sucursales."""
     producto = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='transferencias')
@@ -29,11 +54,17 @@ class TransferenciaStock(models.Model):
     cantidad = models.IntegerField(validators=[MinValueValidator(1)])
     fecha = models.DateTimeField(auto_now_add=True)
     usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    manifiesto = models.ForeignKey(
+        ManifiestoTransferencia, on_delete=models.SET_NULL, null=True, blank=True, related_name='transferencias',
+    )
 
     class Meta:
         ordering = ['-fecha']
         verbose_name = 'Transferencia de Stock'
         verbose_name_plural = 'Transferencias de Stock'
+        indexes = [
+            models.Index(fields=['fecha'], name='products_transf_fecha'),
+        ]
 
     def __str__(self):
         return f"{self.cantidad} x {self.producto} {self.origen} -> {self.destino} ({self.fecha:%Y-%m-%d %H:%M})"
@@ -51,11 +82,170 @@ class AjusteStock(models.Model):
         ordering = ['-fecha']
         verbose_name = 'Ajuste de Stock'
         verbose_name_plural = 'Ajustes de Stock'
+        indexes = [
+            models.Index(fields=['fecha'], name='products_ajuste_fecha'),
+        ]
 
     def __str__(self):
         signo = '+' if (self.cantidad_delta or 0) >= 0 else ''
         return f"{self.producto} @ {self.sucursal}: {signo}{self.cantidad_delta} ({self.fecha:%Y-%m-%d %H:%M})"
 
+class MovimientoStock(models.Model):
+    """
+    Libro de movimientos de stock por sucursal (sólo se insertan filas, nunca se modifican).
+    `delta` es la variación efectiva aplicada a StockSucursal; `referencia` es el id del
+    documento de origen (Venta, TransferenciaStock, AjusteStock) según `tipo`.
+    """
+    APERTURA = 'apertura'
+    VENTA = 'venta'
+    DEVOLUCION = 'devolucion'
+    TRANSFERENCIA = 'transferencia'
+    AJUSTE = 'ajuste'
+    IMPORTACION = 'importacion'
+    CONCILIACION = 'conciliacion'
+    TIPOS = [
+        (APERTURA, 'Saldo inicial'),
+        (VENTA, 'Venta'),
+        (DEVOLUCION, 'Devolución'),
+        (TRANSFERENCIA, 'Transferencia'),
+        (AJUSTE, 'Ajuste'),
+        (IMPORTACION, 'Importación'),
+        (CONCILIACION, 'Conciliación'),
+    ]
+
+    producto = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='movimientos_stock')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='movimientos_stock')
+    delta = models.IntegerField()
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    referencia = models.PositiveIntegerField(null=True, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Movimiento de Stock'
+        verbose_name_plural = 'Movimientos de Stock'
+        indexes = [
+            # Deltas posteriores a un corte (stock a una fecha)
+            models.Index(fields=['fecha'], name='products_mov_fecha'),
+            models.Index(fields=['producto', 'sucursal', 'fecha'], name='products_mov_prod_suc_fecha'),
+        ]
+        constraints = [
+            # El saldo inicial de una fila se asienta una sola vez aunque dos movimientos la creen a la vez
+            models.UniqueConstraint(
+                fields=['producto', 'sucursal'], condition=Q(tipo='apertura'), name='products_mov_apertura_unica',
+            ),
+        ]
+
+    def __str__(self):
+        signo = '+' if self.delta >= 0 else ''
+        return f"{self.get_tipo_display()} {self.producto_id} @ {self.sucursal_id}: {signo}{self.delta}"
+
+class CorteStock(models.Model):
+    """Foto del stock por sucursal a una fecha: saldos (SaldoCorte) que resumen el libro hasta `fecha`."""
+    fecha = models.DateTimeField(db_index=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    total_saldos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-fecha']
+        verbose_name = 'Corte de Stock'
+        verbose_name_plural = 'Cortes de Stock'
+
+    def __str__(self):
+        return f"Corte #{self.pk} al {self.fecha:%Y-%m-%d %H:%M} ({self.total_saldos} saldos)"
+
+class SaldoCorte(models.Model):
+    """Cantidad de un producto en una sucursal al momento del corte (sólo saldos distintos de cero).
+
+    `costo_unitario` es el precio de compra vigente al tomar el corte: valoriza el inventario
+    a esa fecha sin depender de cambios de precio posteriores.
+    """
+    corte = models.ForeignKey(CorteStock, on_delete=models.CASCADE, related_name='saldos')
+    producto = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='saldos_corte')
+    sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='saldos_corte')
+    cantidad = models.IntegerField()
+    costo_unitario = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        unique_together = ('corte', 'producto', 'sucursal')
+        verbose_name = 'Saldo de Corte'
+        verbose_name_plural = 'Saldos de Corte'
+
+    def __str__(self):
+        return f"{self.producto_id} @ {self.sucursal_id} = {self.cantidad} (corte #{self.corte_id})"
+
+class ProductoBusqueda(models.Model):
+    """
+    Índice de búsqueda de productos: tokens normalizados (minúsculas, sin acentos).
+    tipo 'c' = código completo (Código 1, Código 2, Código de Barras), 'w' = palabra, 't' = trigrama.
+    Se mantiene sincronizado con señales sobre Product y tras las importaciones masivas.
+    """
+    TIPO_CODIGO = 'c'
+    TIPO_PALABRA = 'w'
+    TIPO_TRIGRAMA = 't'
+
+    producto = models.ForeignKey('Product', on_delete=models.CASCADE, related_name='tokens_busqueda')
+    tipo = models.CharField(max_length=1)
+    token = models.CharField(max_length=255)
+
+    class Meta:
+        verbose_name = "Token de Búsqueda"
+        verbose_name_plural = "Tokens de Búsqueda"
+        indexes = [
+            models.Index(fields=['tipo', 'token', 'producto'], name='products_busq_tipo_token'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}:{self.token} -> {self.producto_id}"
+
+class ProductQuerySet(models.QuerySet):
+    def con_stock_en(self, sucursal, nombre='stock_sucursal'):
+        """Anota el stock en la sucursal (misma regla que Product.stock_en) como expresión SQL.
+
+        Usa la fila de StockSucursal si existe; si no, el campo legado 'stock' sólo cuando el
+        producto pertenece a esa sucursal; en otro caso 0. Permite filtrar y ordenar por stock
+        sin una consulta por producto.
+        """
+        sucursal_id = getattr(sucursal, 'pk', sucursal)
+        if not sucursal_id:
+            return self.annotate(**{nombre: Value(0, output_field=IntegerField())})
+        stock_local = StockSucursal.objects.filter(
+            producto_id=OuterRef('pk'), sucursal_id=sucursal_id,
+        ).values('cantidad')[:1]
+        return self.annotate(**{nombre: Coalesce(
+            Subquery(stock_local, output_field=IntegerField()),
+            Case(When(sucursal_id=sucursal_id, then=Coalesce('stock', Value(0))), default=Value(0)),
+            output_field=IntegerField(),
+        )})
+
+    def de_sucursal(self, sucursal):
+        """Productos asociados a la sucursal por FK o con stock registrado en ella (sin UNION ni DISTINCT)."""
+        sucursal_id = getattr(sucursal, 'pk', sucursal)
+        return self.filter(
+            Q(sucursal_id=sucursal_id) |
+            Q(id__in=StockSucursal.objects.filter(sucursal_id=sucursal_id).values('producto_id'))
+        )
+
+    def con_stock_entre(self, sucursal, minimo=None, maximo=None):
+        """Filtra por stock en la sucursal (misma regla que stock_en) dentro de [minimo, maximo].
+
+        Sólo devuelve productos de la sucursal. Las filas de StockSucursal se filtran por el índice
+        (sucursal, cantidad); el stock legado sólo cuenta si el producto no tiene fila en la sucursal.
+        """
+        sucursal_id = getattr(sucursal, 'pk', sucursal)
+        rango_fila, rango_legado = Q(), Q()
+        if minimo is not None:
+            rango_fila &= Q(cantidad__gte=minimo)
+            rango_legado &= Q(stock__gte=minimo)
+        if maximo is not None:
+            rango_fila &= Q(cantidad__lte=maximo)
+            rango_legado &= Q(stock__lte=maximo)
+        filas = StockSucursal.objects.filter(sucursal_id=sucursal_id)
+        return self.filter(
+            Q(id__in=filas.filter(rango_fila).values('producto_id')) |
+            (Q(sucursal_id=sucursal_id) & rango_legado & ~Q(id__in=filas.values('producto_id')))
+        )
+
 class Product(models.Model):
     """
     Modelo simplificado para un producto.
@@ -84,6 +274,8 @@ class Product(models.Model):
     permitir_venta_sin_stock = models.BooleanField(default=True, verbose_name="Permitir Venta sin Stock")
     sucursal = models.ForeignKey(Sucursal, on_delete=models.CASCADE, related_name='productos', blank=True, null=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.nombre if self.nombre else self.producto_id or f"Producto sin nombre ({self.pk})"
 
@@ -175,10 +367,20 @@ class Product(models.Model):
     class Meta:
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
+        indexes = [
+            # Listados ordenados por nombre
+            models.Index(fields=['nombre'], name='products_prod_nombre'),
+            # Búsqueda exacta por código de barras (stock.resolver_lineas); parcial: la mayoría no lo tiene.
+            # Código 2 no tiene índice propio: sólo se busca por ProductoBusqueda o con icontains
+            models.Index(fields=['codigo_barras'], name='products_prod_barras', condition=Q(codigo_barras__isnull=False)),
+        ]
 
     # ===== Helpers de stock por sucursal (con fallback al campo 'stock') =====
     def stock_en(self, sucursal: Sucursal) -> int:
-        """Cantidad disponible en una sucursal. Prefiere StockSucursal, si no existe, usa el campo 'stock' solo si el producto pertenece a esa sucursal."""
+        """Cantidad disponible en una sucursal. Prefiere StockSucursal, si no existe, usa el campo 'stock' solo si el producto pertenece a esa sucursal.
+
+        Hace una consulta por llamada; para listados usar Product.objects.con_stock_en(sucursal).
+        """
         if not sucursal:
             return 0
         ss = self.stocks_por_sucursal.filter(sucursal=sucursal).first()
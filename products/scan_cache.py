@@ -0,0 +1,138 @@
+"""
+Caché en proceso para el escaneo de códigos en caja.
+
+Cada worker mantiene un LRU acotado (SCAN_CACHE_SIZE entradas) con expiración
+(SCAN_CACHE_TTL segundos) que resuelve (código, sucursal) -> datos del producto y
+stock disponible en esa sucursal. Las señales de Product/StockSucursal invalidan
+las entradas del producto afectado; el checkout, que descuenta stock con UPDATE
+masivo (sin señales), invalida explícitamente. El TTL acota la desactualización
+entre workers distintos.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F, FilteredRelation, Q
+
+from .models import Product, ProductoBusqueda
+from .search import normalizar
+
+
+class CacheEscaneo:
+    """LRU con TTL, seguro entre hilos, con índice inverso por producto para invalidar."""
+
+    def __init__(self, max_entradas=1000, ttl=60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()   # clave -> (expira, valor)
+        self._por_producto = {}          # producto_id -> {claves}
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._por_producto.setdefault(valor['id'], set()).add(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def invalidar_producto(self, producto_id):
+        with self._lock:
+            for clave in self._por_producto.pop(producto_id, ()):
+                self._entradas.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._por_producto.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def _quitar(self, clave):
+        _, valor = self._entradas.pop(clave)
+        claves = self._por_producto.get(valor['id'])
+        if claves is not None:
+            claves.discard(clave)
+            if not claves:
+                del self._por_producto[valor['id']]
+
+
+cache_escaneo = CacheEscaneo(
+    max_entradas=getattr(settings, 'SCAN_CACHE_SIZE', 1000),
+    ttl=getattr(settings, 'SCAN_CACHE_TTL', 60),
+)
+
+
+def invalidar_productos(producto_ids):
+    for producto_id in producto_ids:
+        cache_escaneo.invalidar_producto(producto_id)
+
+
+def _cargar_por_codigo(codigo, sucursal_id):
+    """Resuelve un código exacto (barras, Código 1 o Código 2) con su stock en la sucursal en una consulta.
+
+    Si varios productos comparten el código, se prefiere el de la sucursal indicada.
+    """
+    qs = Product.objects.filter(
+        id__in=ProductoBusqueda.objects.filter(
+            tipo=ProductoBusqueda.TIPO_CODIGO, token=codigo
+        ).values('producto_id')
+    )
+    if sucursal_id:
+        qs = qs.annotate(stock_local=FilteredRelation(
+            'stocks_por_sucursal',
+            condition=Q(stocks_por_sucursal__sucursal_id=sucursal_id),
+        )).annotate(ss_id=F('stock_local__id'), ss_cantidad=F('stock_local__cantidad'))
+    candidatos = sorted(qs, key=lambda p: (p.sucursal_id != sucursal_id, p.id))
+    if not candidatos:
+        return None
+    p = candidatos[0]
+    # Misma regla que Product.stock_en
+    if p.sucursal_id and sucursal_id:
+        if p.ss_id is not None:
+            stock = p.ss_cantidad or 0
+        elif p.sucursal_id == sucursal_id:
+            stock = p.stock or 0
+        else:
+            stock = 0
+    else:
+        stock = p.stock or 0
+    return {
+        'id': p.id,
+        'nombre': p.nombre,
+        'precio_venta': str(p.precio_venta),
+        'sucursal_id': p.sucursal_id,
+        'permitir_venta_sin_stock': p.permitir_venta_sin_stock,
+        'stock': stock,
+    }
+
+
+def resolver_codigo(codigo, sucursal_id=None):
+    """Datos del producto para un código escaneado (dict) o None. Sin consultas si la entrada está en caché."""
+    codigo = normalizar(codigo)[:255]
+    if not codigo:
+        return None
+    clave = (codigo, sucursal_id)
+    datos = cache_escaneo.get(clave)
+    if datos is None:
+        datos = _cargar_por_codigo(codigo, sucursal_id)
+        if datos is not None:
+            cache_escaneo.set(clave, datos)
+    return datos
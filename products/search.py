@@ -0,0 +1,178 @@
+"""
+Búsqueda indexada de productos para la caja.
+
+Cada producto se descompone en tokens normalizados (ver ProductoBusqueda):
+- códigos completos para los atajos exactos (escáner / Código 1),
+- palabras para coincidencias por prefijo en términos cortos,
+- trigramas para coincidencias por subcadena en términos de 3+ caracteres.
+
+Los términos de 1-2 caracteres sólo usan el índice como prefijo de palabra ("kg" no
+encuentra "1KG", "11" no encuentra "7800000000011"). Si así no hay resultados, se
+recurre a un `icontains` acotado a `limite` filas (ver `_buscar_subcadena`).
+
+La búsqueda siempre devuelve un top-N ordenado, nunca el catálogo completo.
+"""
+import re
+
+from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Value
+from django.db.models.functions import Cast
+
+from .models import Product, ProductoBusqueda
+from .utils import normalize_query
+
+LIMITE_RESULTADOS = 25
+CAMPOS_CODIGO = ('producto_id', 'codigo_barras', 'codigo_alternativo')
+CAMPOS_TEXTO = ('nombre',) + CAMPOS_CODIGO
+_SEPARADORES = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar(texto) -> str:
+    """Minúsculas y sin acentos."""
+    if texto is None:
+        return ''
+    return normalize_query(str(texto)).lower().strip()
+
+
+def terminos(texto) -> list:
+    """Palabras normalizadas (alfanuméricas) de un texto."""
+    return [t for t in _SEPARADORES.split(normalizar(texto)) if t]
+
+
+def trigramas(palabra: str) -> set:
+    if len(palabra) < 3:
+        return set()
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+def tokens_de_producto(valores: dict) -> set:
+    """Conjunto de (tipo, token) para un producto dado como dict de CAMPOS_TEXTO."""
+    tokens = set()
+    for campo in CAMPOS_CODIGO:
+        codigo = normalizar(valores.get(campo))
+        if codigo:
+            tokens.add((ProductoBusqueda.TIPO_CODIGO, codigo[:255]))
+    for campo in CAMPOS_TEXTO:
+        for palabra in terminos(valores.get(campo)):
+            palabra = palabra[:255]
+            tokens.add((ProductoBusqueda.TIPO_PALABRA, palabra))
+            tokens.update((ProductoBusqueda.TIPO_TRIGRAMA, g) for g in trigramas(palabra))
+    return tokens
+
+
+def reindexar_productos(producto_ids=None, batch_size=2000):
+    """Reconstruye los tokens de los productos indicados (o de todo el catálogo si es None)."""
+    productos = Product.objects.all()
+    tokens_qs = ProductoBusqueda.objects.all()
+    if producto_ids is not None:
+        producto_ids = list(producto_ids)
+        if not producto_ids:
+            return 0
+        productos = productos.filter(id__in=producto_ids)
+        tokens_qs = tokens_qs.filter(producto_id__in=producto_ids)
+    tokens_qs.delete()
+    nuevos = []
+    total = 0
+    for valores in productos.values('id', *CAMPOS_TEXTO).iterator(chunk_size=batch_size):
+        for tipo, token in tokens_de_producto(valores):
+            nuevos.append(ProductoBusqueda(producto_id=valores['id'], tipo=tipo, token=token))
+        if len(nuevos) >= batch_size:
+            ProductoBusqueda.objects.bulk_create(nuevos, batch_size=batch_size)
+            total += len(nuevos)
+            nuevos = []
+    if nuevos:
+        ProductoBusqueda.objects.bulk_create(nuevos, batch_size=batch_size)
+        total += len(nuevos)
+    return total
+
+
+def _prefijo(termino):
+    """Filtro de tokens que empiezan con `termino` como rango [termino, termino + U+FFFF).
+
+    A diferencia de `startswith` (LIKE) usa el índice (tipo, token, producto) en cualquier
+    motor y collation; los tokens sólo tienen [0-9a-z], así que el rango es exacto.
+    """
+    return {'token__gte': termino, 'token__lt': termino + '\uffff'}
+
+
+def _ids_por_termino(termino):
+    """Subconsulta de ids de producto que contienen el término (prefijo de palabra o subcadena)."""
+    gramas = trigramas(termino)
+    if not gramas:
+        return ProductoBusqueda.objects.filter(
+            tipo=ProductoBusqueda.TIPO_PALABRA, **_prefijo(termino)
+        ).values('producto_id')
+    return (
+        ProductoBusqueda.objects.filter(tipo=ProductoBusqueda.TIPO_TRIGRAMA, token__in=gramas)
+        .values('producto_id')
+        .annotate(n=Count('token', distinct=True))
+        .filter(n=len(gramas))
+        .values('producto_id')
+    )
+
+
+def _contiene_terminos(producto, lista_terminos):
+    """Descarta falsos positivos de trigramas verificando la subcadena sobre los campos normalizados."""
+    texto = ' '.join(normalizar(getattr(producto, campo)) for campo in CAMPOS_TEXTO)
+    return all(t in texto for t in lista_terminos)
+
+
+def _buscar_subcadena(lista_terminos, limite):
+    """Respaldo para términos cortos: subcadena en los campos de texto, sin índice de tokens.
+
+    Recorre por clave primaria y se detiene al juntar `limite` productos.
+    """
+    qs = Product.objects.all()
+    for termino in lista_terminos:
+        filtro = Q()
+        for campo in CAMPOS_TEXTO:
+            filtro |= Q(**{f'{campo}__icontains': termino})
+        qs = qs.filter(filtro)
+    return list(qs.order_by('pk')[:limite])
+
+
+def buscar_productos(query, limite=LIMITE_RESULTADOS):
+    """Retorna una lista (máximo `limite`) de productos que coinciden con la consulta, ordenados por relevancia.
+
+    Si la consulta coincide exactamente con un código (barras, Código 1 o Código 2) sólo se devuelven esos productos.
+    Si no hay resultados y algún término es corto (sin trigramas), se busca por subcadena sin índice.
+    """
+    codigo = normalizar(query)
+    if not codigo:
+        return []
+    exactos = list(
+        Product.objects.filter(
+            id__in=ProductoBusqueda.objects.filter(
+                tipo=ProductoBusqueda.TIPO_CODIGO, token=codigo[:255]
+            ).values('producto_id')
+        ).order_by('nombre', 'id')[:limite]
+    )
+    if exactos:
+        return exactos
+
+    lista_terminos = terminos(query)
+    if not lista_terminos:
+        return []
+    qs = Product.objects.all()
+    for termino in lista_terminos:
+        qs = qs.filter(id__in=_ids_por_termino(termino))
+    # Relevancia: cantidad de términos que coinciden como prefijo de una palabra completa
+    puntaje = Value(0, output_field=IntegerField())
+    for termino in lista_terminos:
+        puntaje = puntaje + Cast(Exists(ProductoBusqueda.objects.filter(
+            producto_id=OuterRef('pk'), tipo=ProductoBusqueda.TIPO_PALABRA, **_prefijo(termino)
+        )), IntegerField())
+    ordenados = qs.annotate(puntaje=puntaje).order_by('-puntaje', 'nombre', 'id')
+    # Los falsos positivos de trigramas se descartan antes de cortar: se leen páginas de
+    # candidatos hasta juntar `limite` coincidencias reales o agotar los candidatos
+    lote = limite * 2
+    resultados = []
+    desde = 0
+    while len(resultados) < limite:
+        candidatos = list(ordenados[desde:desde + lote])
+        resultados += [p for p in candidatos if _contiene_terminos(p, lista_terminos)]
+        if len(candidatos) < lote:
+            break
+        desde += lote
+    if not resultados and any(not trigramas(t) for t in lista_terminos):
+        return _buscar_subcadena(lista_terminos, limite)
+    return resultados[:limite]
@@ -0,0 +1,30 @@
+# products/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, StockSucursal
+from .scan_cache import cache_escaneo
+from .search import CAMPOS_TEXTO, reindexar_productos
+
+
+@receiver(post_save, sender=Product)
+def actualizar_indice_busqueda(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Mantiene el índice de búsqueda al día al guardar un producto (el borrado se propaga por CASCADE)."""
+    if raw:
+        return
+    # Guardados parciales que no tocan campos indexados (p.ej. sólo stock) no requieren reindexar
+    if update_fields is not None and not set(update_fields) & set(CAMPOS_TEXTO):
+        return
+    reindexar_productos([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidar_cache_escaneo_producto(sender, instance, **kwargs):
+    cache_escaneo.invalidar_producto(instance.pk)
+
+
+@receiver(post_save, sender=StockSucursal)
+@receiver(post_delete, sender=StockSucursal)
+def invalidar_cache_escaneo_stock(sender, instance, **kwargs):
+    cache_escaneo.invalidar_producto(instance.producto_id)
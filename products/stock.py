@@ -0,0 +1,263 @@
+"""
+Movimientos de stock por sucursal: transferencias y ajustes.
+
+Todo movimiento corre en una transacción y modifica las cantidades con UPDATE atómicos
+(`cantidad = MAX(cantidad + delta, 0)`), un UPDATE por sucursal con un CASE por producto,
+así dos ajustes concurrentes no se pisan y el costo no depende de la cantidad de productos:
+- las filas StockSucursal que faltan se crean antes con un upsert que no toca las existentes
+  (sembradas con el stock legado si el producto pertenece a esa sucursal, la misma regla
+  que Product.stock_en);
+- las filas involucradas se bloquean en orden de id antes de validar, así dos
+  transferencias cruzadas no se bloquean mutuamente;
+- la variación efectiva de cada fila (calculada sobre el valor bloqueado) se asienta en
+  el libro de movimientos (products.libro).
+
+Un manifiesto (ManifiestoTransferencia) agrupa las líneas de una transferencia de varios
+productos; sus líneas pueden venir de un CSV o de texto pegado ("código;cantidad") y se
+resuelven contra el catálogo en una sola consulta.
+"""
+import csv
+import io
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from . import libro
+from .models import AjusteStock, ManifiestoTransferencia, MovimientoStock, Product, StockSucursal, TransferenciaStock
+from .scan_cache import invalidar_productos
+
+LOTE_UPDATE = 500
+
+
+class StockError(Exception):
+    """Movimiento de stock inválido. `status` es el código HTTP sugerido."""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.status = status
+
+
+def normalizar_cantidades(items, permitir_negativos=False):
+    """[(producto_id, cantidad)] -> {producto_id: cantidad} sumando repetidos (respeta el orden)."""
+    cantidades = {}
+    for producto_id, cantidad in items:
+        try:
+            producto_id, cantidad = int(producto_id), int(cantidad)
+        except (TypeError, ValueError):
+            raise StockError("Datos inválidos: producto o cantidad no numéricos.")
+        if permitir_negativos and cantidad == 0:
+            raise StockError("La variación de stock no puede ser cero.")
+        if cantidad <= 0 and not permitir_negativos:
+            raise StockError("La cantidad debe ser mayor a cero.")
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    return cantidades
+
+
+def _lineas_de_filas(filas, encabezado=False):
+    """[(numero, codigo, cantidad)] de filas [codigo, cantidad]; salta vacías y, con `encabezado`, la primera no numérica."""
+    lineas = []
+    for numero, fila in enumerate(filas, start=1):
+        partes = [str(p).strip() for p in fila if p is not None and str(p).strip()]
+        if not partes:
+            continue
+        if len(partes) != 2:
+            raise StockError(f'Línea {numero} inválida: use "código;cantidad".')
+        if encabezado and numero == 1 and not partes[1].lstrip('-').isdigit():
+            continue  # Encabezado (p.ej. "codigo,cantidad")
+        lineas.append((numero, partes[0], partes[1]))
+    return lineas
+
+
+def lineas_desde_texto(texto):
+    """Líneas "código;cantidad" (también con coma o tabulación) de un texto pegado."""
+    filas = [linea.replace(';', ',').replace('\t', ',').split(',') for linea in (texto or '').splitlines()]
+    return _lineas_de_filas(filas)
+
+
+def lineas_desde_csv(archivo):
+    """Líneas de un CSV subido (bytes o texto) con columnas código y cantidad; detecta ',' o ';'."""
+    contenido = archivo.read()
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode('utf-8-sig')
+    try:
+        dialecto = csv.Sniffer().sniff(contenido[:2048], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    return _lineas_de_filas(csv.reader(io.StringIO(contenido), dialecto), encabezado=True)
+
+
+def resolver_lineas(lineas):
+    """[(producto_id, cantidad)] de [(numero, codigo, cantidad)], por Código 1 o código de barras en una consulta."""
+    if not lineas:
+        return []
+    codigos = {codigo for _, codigo, _ in lineas}
+    por_codigo = {}
+    for pid, codigo, barras in (
+        Product.objects.filter(Q(producto_id__in=codigos) | Q(codigo_barras__in=codigos))
+        .order_by('id').values_list('id', 'producto_id', 'codigo_barras')
+    ):
+        por_codigo.setdefault(codigo, pid)
+        if barras:
+            por_codigo.setdefault(barras, pid)
+    items = []
+    for numero, codigo, cantidad in lineas:
+        if codigo not in por_codigo:
+            raise StockError(f'Línea {numero}: producto "{codigo}" no encontrado.', status=404)
+        items.append((por_codigo[codigo], cantidad))
+    return items
+
+
+def _cargar_productos(ids):
+    productos = {
+        p.id: p for p in Product.objects.filter(id__in=ids).only('id', 'nombre', 'permitir_venta_sin_stock', 'sucursal_id', 'stock')
+    }
+    faltantes = [pid for pid in ids if pid not in productos]
+    if faltantes:
+        raise StockError(f"Producto no encontrado: {faltantes[0]}", status=404)
+    return productos
+
+
+def _bloquear(producto_ids, sucursal_ids):
+    """{(producto_id, sucursal_id): cantidad} de las filas involucradas, bloqueadas en orden de id."""
+    filas = (
+        StockSucursal.objects.select_for_update()
+        .filter(producto_id__in=producto_ids, sucursal_id__in=sucursal_ids)
+        .order_by('id')
+        .values_list('producto_id', 'sucursal_id', 'cantidad')
+    )
+    return {(producto_id, sucursal_id): cantidad for producto_id, sucursal_id, cantidad in filas}
+
+
+def _bloquear_filas(productos, sucursal_ids):
+    """Bloquea las filas StockSucursal de los productos en las sucursales, creando las que falten.
+
+    Las filas nuevas no modifican las existentes (upsert que ignora conflictos) y su saldo
+    inicial se asienta en el libro como apertura.
+    """
+    stock = _bloquear(list(productos), sucursal_ids)
+    nuevas = {
+        (p.id, sucursal_id): max(0, p.stock or 0) if p.sucursal_id == sucursal_id else 0
+        for p in productos.values()
+        for sucursal_id in sucursal_ids
+        if (p.id, sucursal_id) not in stock
+    }
+    if nuevas:
+        StockSucursal.objects.bulk_create(
+            [StockSucursal(producto_id=pid, sucursal_id=sid, cantidad=cantidad) for (pid, sid), cantidad in nuevas.items()],
+            batch_size=LOTE_UPDATE,
+            ignore_conflicts=True,
+        )
+        libro.registrar_aperturas(nuevas)
+        stock.update(_bloquear(list({pid for pid, _ in nuevas}), list({sid for _, sid in nuevas})))
+    return stock
+
+
+def _aplicar_deltas(sucursal_id, deltas):
+    """Suma {producto_id: delta} a las filas de la sucursal (nunca bajo cero), por lotes de UPDATE."""
+    ids = list(deltas)
+    for i in range(0, len(ids), LOTE_UPDATE):
+        lote = ids[i:i + LOTE_UPDATE]
+        StockSucursal.objects.filter(sucursal_id=sucursal_id, producto_id__in=lote).update(
+            cantidad=Greatest(
+                F('cantidad') + Case(
+                    *[When(producto_id=pid, then=Value(deltas[pid])) for pid in lote],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ),
+                Value(0),
+            )
+        )
+
+
+def _invalidar_cache(producto_ids):
+    # Los UPDATE masivos no emiten señales: invalidar la caché de escaneo ahora y al confirmar
+    producto_ids = list(producto_ids)
+    invalidar_productos(producto_ids)
+    transaction.on_commit(lambda: invalidar_productos(producto_ids))
+
+
+@transaction.atomic
+def transferir(origen, destino, cantidades, usuario=None, manifiesto=None):
+    """Mueve {producto_id: cantidad} de `origen` a `destino`. Retorna las TransferenciaStock creadas.
+
+    Valida el stock de todos los productos antes de escribir: si uno no alcanza (y no
+    permite venta sin stock) no se mueve ninguno.
+    """
+    if origen.pk == destino.pk:
+        raise StockError("La sucursal de origen y destino no pueden ser la misma.")
+    if not cantidades:
+        raise StockError("No se indicaron productos a transferir.")
+    productos = _cargar_productos(list(cantidades))
+    stock = _bloquear_filas(productos, [origen.pk, destino.pk])
+    for producto_id, cantidad in cantidades.items():
+        producto = productos[producto_id]
+        disponible = stock.get((producto_id, origen.pk), 0)
+        if disponible < cantidad and not producto.permitir_venta_sin_stock:
+            raise StockError(f'Stock insuficiente de "{producto.nombre}" en sucursal origen. Disponible: {disponible}.')
+
+    _aplicar_deltas(origen.pk, {pid: -cantidad for pid, cantidad in cantidades.items()})
+    _aplicar_deltas(destino.pk, cantidades)
+    usuario = usuario if usuario is not None and usuario.is_authenticated else None
+    transferencias = TransferenciaStock.objects.bulk_create([
+        TransferenciaStock(
+            producto=productos[pid], origen=origen, destino=destino, cantidad=cantidad, usuario=usuario, manifiesto=manifiesto,
+        )
+        for pid, cantidad in cantidades.items()
+    ], batch_size=LOTE_UPDATE)
+    deltas, referencias = {}, {}
+    for transferencia in transferencias:
+        pid, cantidad = transferencia.producto_id, transferencia.cantidad
+        anterior = stock.get((pid, origen.pk), 0)
+        deltas[(pid, origen.pk)] = max(anterior - cantidad, 0) - anterior
+        deltas[(pid, destino.pk)] = cantidad
+        referencias[(pid, origen.pk)] = referencias[(pid, destino.pk)] = transferencia.pk
+    libro.registrar(MovimientoStock.TRANSFERENCIA, deltas, referencias)
+    _invalidar_cache(cantidades)
+    return transferencias
+
+
+@transaction.atomic
+def crear_manifiesto(origen, destino, cantidades, usuario=None, nota=None):
+    """Registra un manifiesto y aplica todas sus líneas con `transferir` en la misma transacción."""
+    if origen.pk == destino.pk:
+        raise StockError("La sucursal de origen y destino no pueden ser la misma.")
+    if not cantidades:
+        raise StockError("No se indicaron productos a transferir.")
+    manifiesto = ManifiestoTransferencia.objects.create(
+        origen=origen,
+        destino=destino,
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+        nota=nota or None,
+        total_lineas=len(cantidades),
+        total_unidades=sum(cantidades.values()),
+    )
+    transferir(origen, destino, cantidades, usuario=usuario, manifiesto=manifiesto)
+    return manifiesto
+
+
+@transaction.atomic
+def ajustar(sucursal, deltas, usuario=None, motivo=None):
+    """Aplica {producto_id: delta} al stock de la sucursal y registra los ajustes.
+
+    Retorna {producto_id: nueva_cantidad}, calculado sobre las filas bloqueadas (igual que el UPDATE).
+    """
+    if not deltas:
+        raise StockError("No se indicaron productos a ajustar.")
+    productos = _cargar_productos(list(deltas))
+    stock = _bloquear_filas(productos, [sucursal.pk])
+    _aplicar_deltas(sucursal.pk, deltas)
+    usuario = usuario if usuario is not None and usuario.is_authenticated else None
+    ajustes = AjusteStock.objects.bulk_create([
+        AjusteStock(producto=productos[pid], sucursal=sucursal, cantidad_delta=delta, motivo=motivo or None, usuario=usuario)
+        for pid, delta in deltas.items()
+    ])
+    nuevas = {pid: max(stock.get((pid, sucursal.pk), 0) + delta, 0) for pid, delta in deltas.items()}
+    libro.registrar(
+        MovimientoStock.AJUSTE,
+        {(pid, sucursal.pk): nuevas[pid] - stock.get((pid, sucursal.pk), 0) for pid in deltas},
+        {(ajuste.producto_id, sucursal.pk): ajuste.pk for ajuste in ajustes},
+    )
+    _invalidar_cache(deltas)
+    return nuevas
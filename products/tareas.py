@@ -0,0 +1,29 @@
+"""
+Tareas en segundo plano de productos (app jobs): importación de planillas subidas desde la web.
+
+La vista sólo guarda el archivo y encola el trabajo; `manage.py run_jobs` lo procesa con
+el mismo importador que el comando import_products. El avance se guarda en
+`Trabajo.progreso` junto con cada lote confirmado, así la página puede mostrarlo y un
+reintento (worker caído) continúa desde la última fila confirmada.
+"""
+from jobs.models import almacenamiento_artefactos
+from jobs.registry import tarea
+from jobs.services import guardar_progreso
+from .importacion import ImportadorProductos, ResultadoImportacion, hoja_xlsx
+
+
+@tarea('importar_productos', recibe_trabajo=True)
+def importar_productos(parametros, trabajo):
+    almacenamiento = almacenamiento_artefactos()
+    previo = ResultadoImportacion.desde_dict(trabajo.progreso) if trabajo.progreso else None
+    with almacenamiento.open(parametros['archivo_entrada'], 'rb') as archivo:
+        with hoja_xlsx(archivo) as (header_map, filas):
+            importador = ImportadorProductos(header_map, dry_run=parametros.get('dry_run', False))
+            resultado = importador.importar(
+                filas,
+                progreso=lambda r: guardar_progreso(trabajo, r.como_dict()),
+                resultado=previo,
+            )
+    guardar_progreso(trabajo, resultado.como_dict())
+    almacenamiento.delete(parametros['archivo_entrada'])
+    return None
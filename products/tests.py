@@ -116,3 +116,577 @@ class ProductStockFlowsTests(TestCase):
                 # No afirmar demasiado: sólo que responde algo procesable
                 self.assertIn(post_resp.status_code, (200, 302))
                 break
+
+
+class ProductSearchIndexTests(TestCase):
+    def setUp(self):
+        self.suc = create_sucursal("Sucursal Búsqueda")
+        self.cafe = create_product("CAF1", "Café Molido Premium", codigo_barras="7801234567890", sucursal=self.suc)
+        self.cola = create_product("COL1", "Bebida Cocacola 1.5L", sucursal=self.suc)
+        self.otro = create_product("7801234567890X", "Otro producto")
+
+    def test_busqueda_sin_acentos_y_subcadena(self):
+        from products.search import buscar_productos
+        self.assertEqual([p.id for p in buscar_productos("cafe mol")], [self.cafe.id])
+        self.assertEqual([p.id for p in buscar_productos("cola")], [self.cola.id])
+        self.assertEqual(buscar_productos("inexistente"), [])
+
+    def test_atajo_codigo_exacto(self):
+        from products.search import buscar_productos
+        self.assertEqual([p.id for p in buscar_productos("7801234567890")], [self.cafe.id])
+        self.assertEqual([p.id for p in buscar_productos("col1")], [self.cola.id])
+
+    def test_prefijo_usa_rango_de_tokens(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from products.search import buscar_productos
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual([p.id for p in buscar_productos("mo")], [self.cafe.id])
+        self.assertFalse(any(' LIKE ' in q['sql'].upper() for q in ctx.captured_queries))
+
+    def test_terminos_cortos_recurren_a_subcadena(self):
+        from products.search import buscar_productos
+        bolsa = create_product("BOL1", "Bolsa Arroz 1KG", codigo_barras="7800000000011")
+        self.assertEqual([p.id for p in buscar_productos("kg")], [bolsa.id])
+        self.assertEqual([p.id for p in buscar_productos("11")], [bolsa.id])
+        self.assertEqual([p.id for p in buscar_productos("arroz kg")], [bolsa.id])
+        self.assertEqual(buscar_productos("zq"), [])
+
+    def test_falsos_positivos_no_desplazan_coincidencias_reales(self):
+        from products.search import buscar_productos
+        # Tienen los trigramas de "abcd" pero no la subcadena, y ordenan antes por nombre
+        for i in range(6):
+            create_product(f"FP{i}", f"A{i} abc bcd")
+        reales = [create_product(f"RE{i}", f"Z{i} xabcdx") for i in range(2)]
+        self.assertEqual([p.id for p in buscar_productos("abcd", limite=2)], [p.id for p in reales])
+
+    def test_indice_se_actualiza_al_guardar(self):
+        from products.search import buscar_productos
+        self.cafe.nombre = "Té Verde"
+        self.cafe.save()
+        self.assertEqual(buscar_productos("molido"), [])
+        self.assertEqual([p.id for p in buscar_productos("te verde")], [self.cafe.id])
+
+    def test_endpoint_buscar_producto(self):
+        admin = create_user("admin_busqueda", is_staff=True)
+        StockSucursal.objects.create(producto=self.cafe, sucursal=self.suc, cantidad=7)
+        from tests.factories import open_caja
+        caja = open_caja(admin, self.suc)
+        self.client.force_login(admin)
+        resp = self.client.get('/cashier/buscar-producto/', {'q': 'café', 'caja_id': caja.id})
+        self.assertEqual(resp.status_code, 200)
+        productos = resp.json()['productos']
+        self.assertEqual(len(productos), 1)
+        self.assertEqual(productos[0]['stock'], 7)
+
+
+class ProductStockAnnotationTests(TestCase):
+    def setUp(self):
+        self.suc_a = create_sucursal("Stock A")
+        self.suc_b = create_sucursal("Stock B")
+        # Con fila StockSucursal, sólo legado en su sucursal, legado de otra sucursal y sin sucursal
+        self.con_fila = create_product("SA1", "Con fila", sucursal=self.suc_b, stock=50)
+        StockSucursal.objects.create(producto=self.con_fila, sucursal=self.suc_a, cantidad=4)
+        self.legado = create_product("SA2", "Legado", sucursal=self.suc_a, stock=9)
+        self.ajeno = create_product("SA3", "Ajeno", sucursal=self.suc_b, stock=3)
+        self.global_ = create_product("SA4", "Global", stock=8)
+
+    def test_coincide_con_stock_en(self):
+        for suc in (self.suc_a, self.suc_b):
+            anotados = {p.id: p.stock_sucursal for p in Product.objects.con_stock_en(suc)}
+            for p in Product.objects.all():
+                self.assertEqual(anotados[p.id], p.stock_en(suc), (p, suc))
+
+    def test_filtra_y_ordena_en_sql(self):
+        with self.assertNumQueries(1):
+            ids = list(
+                Product.objects.con_stock_en(self.suc_a)
+                .filter(stock_sucursal__gt=0)
+                .order_by('-stock_sucursal')
+                .values_list('id', flat=True)
+            )
+        self.assertEqual(ids, [self.legado.id, self.con_fila.id])
+
+    def test_filtro_stock_bajo_y_agotado_en_sql(self):
+        agotado = create_product("SA5", "Agotado", sucursal=self.suc_a, stock=0)
+        fila_cero = create_product("SA6", "Fila cero", sucursal=self.suc_a, stock=7)
+        StockSucursal.objects.create(producto=fila_cero, sucursal=self.suc_a, cantidad=0)
+        bajo = create_product("SA7", "Bajo", sucursal=self.suc_b, stock=0)
+        StockSucursal.objects.create(producto=bajo, sucursal=self.suc_a, cantidad=2)
+        self.suc_a.low_stock_threshold = 4
+        self.suc_a.save()
+        de_a = Product.objects.de_sucursal(self.suc_a)
+        esperado_out = {p.id for p in de_a if p.stock_en(self.suc_a) <= 0}
+        esperado_low = {p.id for p in de_a if 0 < p.stock_en(self.suc_a) <= 4}
+        self.assertEqual(esperado_out, {agotado.id, fila_cero.id})
+        self.assertEqual(esperado_low, {self.con_fila.id, bajo.id})
+        self.assertEqual(set(de_a.con_stock_entre(self.suc_a, maximo=0).values_list('id', flat=True)), esperado_out)
+        self.assertEqual(set(de_a.con_stock_entre(self.suc_a, minimo=1, maximo=4).values_list('id', flat=True)), esperado_low)
+
+        admin = create_user("admin_stock_bajo", is_staff=True)
+        self.client.force_login(admin)
+        url = reverse('sucursales:sucursal_products', args=[self.suc_a.id])
+        resp = self.client.get(url, {'stock': 'low'})
+        self.assertEqual({p.id for p in resp.context['page_obj']}, esperado_low)
+        self.assertEqual(resp.context['low_stock_threshold'], 4)
+        resp = self.client.get(url, {'stock': 'out'})
+        self.assertEqual({p.id for p in resp.context['page_obj']}, esperado_out)
+
+    def test_listado_sucursal_consultas_constantes(self):
+        admin = create_user("admin_stock_anot", is_staff=True)
+        self.client.force_login(admin)
+        url = reverse('sucursales:sucursal_products', args=[self.suc_a.id])
+        create_product("SX-1", "Extra inicial", sucursal=self.suc_a, stock=1)
+        self._consultas(url)
+        pocas = self._consultas(url)
+        for i in range(15):
+            create_product(f"SX{i}", f"Extra {i}", sucursal=self.suc_a, stock=1)
+        self.assertEqual(self._consultas(url), pocas)
+
+    def _consultas(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url, {'stock': 'low', 'per_page': 50})
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries)
+
+
+class HistorialStockKeysetTests(TestCase):
+    def setUp(self):
+        self.admin = create_user("admin_hist_stock", is_staff=True)
+        self.suc_a = create_sucursal("Hist A")
+        self.suc_b = create_sucursal("Hist B")
+        self.prod = create_product("HS1", "Prod Hist", sucursal=self.suc_a)
+        AjusteStock.objects.bulk_create([
+            AjusteStock(producto=self.prod, sucursal=self.suc_a, cantidad_delta=i + 1) for i in range(55)
+        ])
+        TransferenciaStock.objects.bulk_create([
+            TransferenciaStock(producto=self.prod, origen=self.suc_a, destino=self.suc_b, cantidad=i + 1) for i in range(12)
+        ])
+        self.client.force_login(self.admin)
+
+    def test_ajustes_paginados_sin_perder_filas(self):
+        resp = self.client.get(reverse('adjust_history'), {'sucursal': self.suc_a.id})
+        pagina = resp.context['ajustes']
+        self.assertEqual(len(pagina), 50)
+        self.assertTrue(pagina.has_next)
+        resp = self.client.get(reverse('adjust_history') + pagina.url_siguiente)
+        siguiente = resp.context['ajustes']
+        self.assertEqual(len(siguiente), 5)
+        self.assertFalse(siguiente.has_next)
+        ids = [a.id for a in pagina] + [a.id for a in siguiente]
+        self.assertEqual(sorted(ids), sorted(AjusteStock.objects.values_list('id', flat=True)))
+
+    def test_transferencias_paginadas_con_total(self):
+        resp = self.client.get(reverse('transfer_history'), {'per_page': 10})
+        pagina = resp.context['page_obj']
+        self.assertEqual((len(pagina), pagina.total), (10, 12))
+        resp = self.client.get(reverse('transfer_history') + pagina.url_siguiente)
+        self.assertEqual(len(resp.context['page_obj']), 2)
+        self.assertContains(resp, '12 registros')
+
+
+class ImportacionProductosTests(TestCase):
+    ENCABEZADOS = ['CODIGO 1', 'NOMBRE', 'PRECIO DE COMPRA', 'PRECIO DE VENTA', 'STOCK@Import A', 'STOCK@Import B']
+
+    def setUp(self):
+        import tempfile
+        self.suc_a = create_sucursal("Import A")
+        self.suc_b = create_sucursal("Import B")
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _csv(self, filas, nombre='productos.csv'):
+        import csv
+        import os
+        path = os.path.join(self.dir, nombre)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.ENCABEZADOS)
+            writer.writerows(filas)
+        return path
+
+    def _importar(self, filas, **opciones):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        out = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('import_products', self._csv(filas), stdout=out, **opciones)
+        return out.getvalue(), len(ctx.captured_queries)
+
+    def test_crea_actualiza_y_hace_upsert_de_stock(self):
+        salida, _ = self._importar([
+            ['IMP1', 'Tornillo', '100', '250', '5', ''],
+            ['IMP2', 'Tuerca', '50', '120', '', '7'],
+            ['IMP1', 'Duplicado', '1', '1', '1', '1'],
+        ])
+        self.assertIn('created=2, updated=0', salida)
+        self.assertIn('rows/s', salida)
+        tornillo = Product.objects.get(producto_id='IMP1')
+        self.assertEqual(tornillo.nombre, 'Tornillo')
+        self.assertEqual(StockSucursal.objects.get(producto=tornillo, sucursal=self.suc_a).cantidad, 5)
+
+        salida, _ = self._importar([
+            ['IMP1', 'Tornillo', '100', '300', '9', '2'],
+            ['IMP2', 'Tuerca', '50', '120', '', '7'],
+        ])
+        self.assertIn('created=0, updated=1', salida)
+        self.assertEqual(Product.objects.get(producto_id='IMP1').precio_venta, Decimal('300'))
+        stocks = dict(StockSucursal.objects.filter(producto=tornillo).values_list('sucursal_id', 'cantidad'))
+        self.assertEqual(stocks, {self.suc_a.id: 9, self.suc_b.id: 2})
+        self.assertEqual(StockSucursal.objects.count(), 3)
+
+    def test_consultas_por_lote_y_no_por_fila(self):
+        _, consultas = self._importar([[f'MUC{i}', f'Prod {i}', '10', '20', '1', '1'] for i in range(60)], batch=100)
+        # Un lote: lectura de existentes, bulk_create, reindexado y un upsert de stock (antes: varias por celda)
+        self.assertLess(consultas, 20)
+        self.assertEqual(StockSucursal.objects.count(), 120)
+
+    def test_dry_run_no_escribe(self):
+        salida, _ = self._importar([['DRY1', 'Seco', '10', '20', '3', '']], dry_run=True)
+        self.assertIn('created=1', salida)
+        self.assertFalse(Product.objects.filter(producto_id='DRY1').exists())
+
+    def _xlsx(self, filas):
+        from io import BytesIO
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(self.ENCABEZADOS)
+        for fila in filas:
+            sheet.append(fila)
+        contenido = BytesIO()
+        workbook.save(contenido)
+        return SimpleUploadedFile('productos.xlsx', contenido.getvalue())
+
+    def test_carga_web_se_importa_en_segundo_plano(self):
+        from django.test import override_settings
+        from jobs.models import Trabajo
+        from jobs.services import procesar_pendientes
+        self.client.force_login(create_user("admin_import", is_staff=True))
+        with override_settings(JOBS_ARTIFACT_ROOT=self.dir):
+            archivo = self._xlsx([['WEB1', 'Producto Web', 100, 200, 4, None], [None, 'Sin código', 1, 1, None, None]])
+            resp = self.client.post(reverse('upload_products'), {'file': archivo})
+            trabajo = Trabajo.objects.get(tipo='importar_productos')
+            self.assertRedirects(resp, f"{reverse('upload_products')}?trabajo={trabajo.id}", fetch_redirect_response=False)
+            # La request sólo guarda el archivo: nada se importa hasta que corre el worker
+            self.assertFalse(Product.objects.filter(producto_id='WEB1').exists())
+            self.assertEqual(procesar_pendientes(), 1)
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, Trabajo.TERMINADO)
+        producto = Product.objects.get(producto_id='WEB1')
+        self.assertEqual(StockSucursal.objects.get(producto=producto).cantidad, 4)
+        estado = self.client.get(reverse('jobs:estado', args=[trabajo.id]), {'formato': 'json'}).json()
+        self.assertEqual((estado['progreso']['creados'], estado['progreso']['total_advertencias']), (1, 1))
+        self.assertIsNone(estado['descarga_url'])
+        self.assertContains(self.client.get(reverse('upload_products'), {'trabajo': trabajo.id}), 'productos.xlsx')
+
+    def test_carga_web_rechaza_encabezados_faltantes(self):
+        from jobs.models import Trabajo
+        self.client.force_login(create_user("admin_import", is_staff=True))
+        self.ENCABEZADOS = ['CODIGO 1', 'NOMBRE']
+        resp = self.client.post(reverse('upload_products'), {'file': self._xlsx([['X1', 'Sin precios']])})
+        self.assertRedirects(resp, reverse('upload_products'), fetch_redirect_response=False)
+        self.assertFalse(Trabajo.objects.exists())
+
+    def test_importacion_se_reanuda_desde_el_ultimo_lote_confirmado(self):
+        from products.importacion import ImportadorProductos, ResultadoImportacion, encabezados
+        filas = [[f'REA{i}', f'Prod {i}', '10', '20', '1', ''] for i in range(5)]
+        filas.append(['REA0', 'Duplicado', '1', '1', '1', ''])
+        avances = []
+        importador = ImportadorProductos(encabezados(self.ENCABEZADOS), lote=2)
+        importador.importar(filas[:3], progreso=lambda r: avances.append(r.como_dict()))
+        # Primer lote (filas 2 y 3) confirmado; el worker cae antes de confirmar el resto
+        previo = ResultadoImportacion.desde_dict(avances[0])
+        Product.objects.filter(producto_id='REA2').delete()
+        resultado = ImportadorProductos(encabezados(self.ENCABEZADOS), lote=2).importar(filas, resultado=previo)
+        self.assertEqual(resultado.creados, 5)
+        self.assertEqual(resultado.total_advertencias, 1)
+        self.assertEqual(resultado.ultima_fila, 6)
+        self.assertEqual(Product.objects.filter(producto_id__startswith='REA').count(), 5)
+
+
+class ExportacionProductosTests(TestCase):
+    def setUp(self):
+        self.suc_a = create_sucursal("Export A")
+        self.suc_b = create_sucursal("Export B")
+        for i in range(3):
+            prod = create_product(f"EXP{i}", f"Producto {i}", precio_compra=Decimal('1190'), precio_venta=Decimal('2380'))
+            StockSucursal.objects.create(producto=prod, sucursal=self.suc_a, cantidad=i + 1)
+        self.client.force_login(create_user("admin_export", is_staff=True))
+
+    def _exportar(self, **params):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        resp = self.client.get(reverse('export_products_to_excel'), params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('export_productos.xlsx', resp['Content-Disposition'])
+        sheet = load_workbook(BytesIO(b''.join(resp.streaming_content)), read_only=True).active
+        return list(sheet.iter_rows(values_only=True))
+
+    def test_exporta_con_calculos_del_modelo(self):
+        filas = self._exportar()
+        self.assertEqual(len(filas), 4)
+        self.assertEqual(filas[0][2], 'CODIGO 1')
+        self.assertEqual(filas[1][2:3] + filas[1][5:10], ('EXP0', '1.190', '2.380', '1.000', '2.000', '1.000'))
+
+    def test_stock_por_sucursal_en_la_misma_consulta(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            filas = self._exportar(stock_sucursales=1)
+        self.assertEqual(filas[0][-2:], ('STOCK@Export A', 'STOCK@Export B'))
+        self.assertEqual([f[-2:] for f in filas[1:]], [(1, 0), (2, 0), (3, 0)])
+        consultas = [q['sql'] for q in ctx.captured_queries if 'products_stocksucursal' in q['sql']]
+        self.assertEqual(len(consultas), 1)
+
+
+class MovimientosStockTests(TestCase):
+    def setUp(self):
+        self.suc_a = create_sucursal("Mov A")
+        self.suc_b = create_sucursal("Mov B")
+        self.productos = []
+        for i in range(10):
+            prod = create_product(f"MOV{i}", f"Producto Mov {i}", permitir_venta_sin_stock=False)
+            StockSucursal.objects.create(producto=prod, sucursal=self.suc_a, cantidad=10)
+            self.productos.append(prod)
+        self.client.force_login(create_user("admin_mov", is_staff=True))
+        self.client.get('/healthz')
+
+    def _transferir(self, filas, lineas=''):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        data = {
+            'sucursal_origen': self.suc_a.id,
+            'sucursal_destino': self.suc_b.id,
+            'producto_id': [p.id for p, _ in filas],
+            'cantidad': [c for _, c in filas],
+            'lineas': lineas,
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('transfer_stock'), data)
+        return resp, len(ctx.captured_queries)
+
+    def _stock(self, prod, sucursal):
+        return StockSucursal.objects.get(producto=prod, sucursal=sucursal).cantidad
+
+    def test_transferencia_de_varios_productos_en_consultas_constantes(self):
+        from products.models import ManifiestoTransferencia
+        resp, pocas = self._transferir([(self.productos[0], 2)], lineas='MOV1;3')
+        primero = ManifiestoTransferencia.objects.get()
+        self.assertRedirects(resp, reverse('transfer_manifest_detail', args=[primero.id]), fetch_redirect_response=False)
+        resp, muchas = self._transferir([(p, 1) for p in self.productos[2:]], lineas='MOV0;1\nMOV1;1')
+        self.assertEqual(pocas, muchas)
+        self.assertEqual(ManifiestoTransferencia.objects.count(), 2)
+        self.assertEqual((self._stock(self.productos[0], self.suc_a), self._stock(self.productos[0], self.suc_b)), (7, 3))
+        self.assertEqual(self._stock(self.productos[9], self.suc_b), 1)
+        self.assertEqual(TransferenciaStock.objects.count(), 12)
+
+    def test_formulario_de_transferencia(self):
+        resp = self.client.get(reverse('transfer_stock'), {'producto': self.productos[0].id, 'sucursal_origen': self.suc_a.id})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTemplateUsed(resp, 'products/transfer_stock.html')
+
+    def test_stock_insuficiente_no_mueve_ningun_producto(self):
+        resp, _ = self._transferir([(self.productos[0], 2), (self.productos[1], 11)])
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Disponible: 10')
+        self.assertEqual(self._stock(self.productos[0], self.suc_a), 10)
+        self.assertFalse(StockSucursal.objects.filter(sucursal=self.suc_b, cantidad__gt=0).exists())
+        self.assertFalse(TransferenciaStock.objects.exists())
+
+    def test_transferencia_usa_stock_legado_de_la_sucursal(self):
+        legado = create_product("MOVL", "Producto Legado", sucursal=self.suc_a, stock=5, permitir_venta_sin_stock=False)
+        self._transferir([(legado, 3)])
+        self.assertEqual((self._stock(legado, self.suc_a), self._stock(legado, self.suc_b)), (2, 3))
+
+    def test_ajustes_se_acumulan_sobre_el_valor_en_base(self):
+        from products.stock import ajustar
+        prod = self.productos[0]
+        url = reverse('ajustar_stock')
+        resp = self.client.post(url, {'producto_id': prod.id, 'sucursal_id': self.suc_a.id, 'delta': 5, 'motivo': 'Conteo'})
+        self.assertEqual(resp.json(), {'success': True, 'nueva_cantidad': 15})
+        # Un ajuste aplicado por otra vía entre medio no se pierde: el UPDATE suma sobre la fila actual
+        ajustar(self.suc_a, {prod.id: -4})
+        resp = self.client.post(url, {'producto_id': prod.id, 'sucursal_id': self.suc_a.id, 'delta': -20})
+        self.assertEqual(resp.json()['nueva_cantidad'], 0)
+        self.assertEqual(AjusteStock.objects.filter(producto=prod).count(), 3)
+        resp = self.client.post(url, {'producto_id': 999999, 'sucursal_id': self.suc_a.id, 'delta': 1})
+        self.assertEqual(resp.status_code, 404)
+
+
+class ManifiestoTransferenciaTests(TestCase):
+    def setUp(self):
+        self.suc_a = create_sucursal("Man A")
+        self.suc_b = create_sucursal("Man B")
+        self.productos = []
+        for i in range(200):
+            self.productos.append(Product(
+                producto_id=f"MAN{i}", nombre=f"Producto Man {i}", codigo_barras=f"780{i:010d}", permitir_venta_sin_stock=False,
+            ))
+        Product.objects.bulk_create(self.productos)
+        StockSucursal.objects.bulk_create([StockSucursal(producto=p, sucursal=self.suc_a, cantidad=5) for p in self.productos])
+        self.client.force_login(create_user("admin_man", is_staff=True))
+        self.client.get('/healthz')
+
+    def _post_json(self, data):
+        import json
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('transfer_manifest'), json.dumps(data), content_type='application/json')
+        return resp, len(ctx.captured_queries)
+
+    def test_manifiesto_json_de_cientos_de_lineas_en_pocas_consultas(self):
+        lineas = [{'producto_id': p.id, 'cantidad': 2} for p in self.productos[:150]]
+        lineas += [{'codigo': p.codigo_barras, 'cantidad': 1} for p in self.productos[150:]]
+        resp, consultas = self._post_json({'sucursal_origen': self.suc_a.id, 'sucursal_destino': self.suc_b.id, 'lineas': lineas})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual((resp.json()['lineas'], resp.json()['unidades']), (200, 350))
+        # Incluye el INSERT masivo del libro de stock (SQLite lo parte en lotes por límite de parámetros)
+        self.assertLess(consultas, 22)
+        self.assertEqual(TransferenciaStock.objects.filter(manifiesto_id=resp.json()['id']).count(), 200)
+        self.assertEqual(StockSucursal.objects.get(producto=self.productos[0], sucursal=self.suc_b).cantidad, 2)
+        self.assertEqual(StockSucursal.objects.get(producto=self.productos[199], sucursal=self.suc_a).cantidad, 4)
+        self.assertContains(self.client.get(resp.json()['url']), 'MAN199')
+
+    def test_manifiesto_con_linea_invalida_no_aplica_nada(self):
+        lineas = [{'producto_id': self.productos[0].id, 'cantidad': 1}, {'codigo': 'NO-EXISTE', 'cantidad': 1}]
+        resp, _ = self._post_json({'sucursal_origen': self.suc_a.id, 'sucursal_destino': self.suc_b.id, 'lineas': lineas})
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn('NO-EXISTE', resp.json()['error'])
+        self.assertFalse(TransferenciaStock.objects.exists())
+
+    def test_manifiesto_desde_csv(self):
+        from products.models import ManifiestoTransferencia
+        contenido = "codigo;cantidad\nMAN0;3\n7800000000001;2\n\n".encode('utf-8')
+        resp = self.client.post(reverse('transfer_stock'), {
+            'sucursal_origen': self.suc_a.id,
+            'sucursal_destino': self.suc_b.id,
+            'archivo': SimpleUploadedFile('manifiesto.csv', contenido, content_type='text/csv'),
+            'nota': 'Reposición',
+        })
+        manifiesto = ManifiestoTransferencia.objects.get()
+        self.assertRedirects(resp, reverse('transfer_manifest_detail', args=[manifiesto.id]), fetch_redirect_response=False)
+        self.assertEqual((manifiesto.total_lineas, manifiesto.total_unidades, manifiesto.nota), (2, 5, 'Reposición'))
+        self.assertEqual(StockSucursal.objects.get(producto=self.productos[1], sucursal=self.suc_b).cantidad, 2)
+
+
+class LibroStockTests(TestCase):
+    def setUp(self):
+        from products.libro import tomar_corte
+        self.suc_a = create_sucursal("Libro A")
+        self.suc_b = create_sucursal("Libro B")
+        self.vendedor = create_user("vendedor_libro", is_staff=False)
+        self.p1 = create_product("LIB1", "Producto Libro 1", sucursal=self.suc_a, permitir_venta_sin_stock=False)
+        self.p2 = create_product("LIB2", "Producto Libro 2", sucursal=self.suc_a, permitir_venta_sin_stock=False)
+        for prod in (self.p1, self.p2):
+            StockSucursal.objects.create(producto=prod, sucursal=self.suc_a, cantidad=10)
+        self.corte = tomar_corte()
+
+    def _stock(self, prod, sucursal):
+        return StockSucursal.objects.get(producto=prod, sucursal=sucursal).cantidad
+
+    def _vender(self, prod, cantidad):
+        from django.db import transaction
+        from cashier.services import procesar_checkout
+        from tests.factories import open_caja
+        caja = open_caja(self.vendedor, self.suc_a)
+        with transaction.atomic():
+            return procesar_checkout(caja, self.vendedor, [{'producto_id': prod.id, 'cantidad': cantidad}],
+                                     cliente_paga=Decimal('100000'))
+
+    def test_operaciones_asientan_la_variacion_efectiva(self):
+        from products.libro import conciliar, stock_al
+        from products.models import MovimientoStock
+        from products.stock import ajustar, transferir
+        legado = create_product("LIBL", "Producto Libro Legado", sucursal=self.suc_a, stock=4, permitir_venta_sin_stock=False)
+        transferir(self.suc_a, self.suc_b, {self.p1.id: 3, legado.id: 1})
+        ajustar(self.suc_a, {self.p2.id: -15})
+        venta = self._vender(self.p1, 2)
+
+        self.assertEqual(conciliar(), [])
+        libro = stock_al()
+        self.assertEqual(libro[(self.p1.id, self.suc_a.id)], 5)
+        self.assertEqual(libro[(self.p1.id, self.suc_b.id)], 3)
+        self.assertEqual(libro[(legado.id, self.suc_a.id)], 3)
+        self.assertEqual(libro[(self.p2.id, self.suc_a.id)], 0)
+        self.assertEqual(MovimientoStock.objects.get(tipo='ajuste').delta, -10)
+        self.assertEqual(MovimientoStock.objects.get(tipo='apertura').delta, 4)
+        self.assertEqual(MovimientoStock.objects.get(tipo='venta').referencia, venta.id)
+
+    def test_stock_a_una_fecha_y_cortes_sucesivos(self):
+        import datetime
+        from products.libro import stock_al, tomar_corte
+        from products.models import MovimientoStock
+        from products.stock import ajustar
+        ajustar(self.suc_a, {self.p1.id: 5})
+        MovimientoStock.objects.update(fecha=self.corte.fecha + datetime.timedelta(hours=1))
+        intermedio = self.corte.fecha + datetime.timedelta(hours=2)
+        ajustar(self.suc_a, {self.p1.id: -7})
+        MovimientoStock.objects.filter(delta=-7).update(fecha=self.corte.fecha + datetime.timedelta(hours=3))
+
+        self.assertEqual(stock_al(intermedio, producto_ids=[self.p1.id]), {(self.p1.id, self.suc_a.id): 15})
+        self.assertEqual(stock_al(self.corte.fecha)[(self.p1.id, self.suc_a.id)], 10)
+        corte = tomar_corte(intermedio)
+        self.assertEqual(corte.saldos.get(producto=self.p1).cantidad, 15)
+        # Desde el corte nuevo sólo se suman los deltas posteriores
+        with self.assertNumQueries(3):
+            self.assertEqual(stock_al(sucursal_id=self.suc_a.id)[(self.p1.id, self.suc_a.id)], 8)
+
+    def test_corte_periodico_cierra_cada_dia_terminado(self):
+        import datetime
+        from products.libro import corte_periodico, fin_del_dia
+        from products.models import CorteStock, MovimientoStock
+        from products.stock import ajustar
+        hoy = timezone.localdate()
+        # Apertura del libro hace tres días a media tarde y un ajuste al día siguiente
+        apertura = timezone.make_aware(datetime.datetime.combine(hoy - datetime.timedelta(days=3), datetime.time(15)))
+        CorteStock.objects.filter(pk=self.corte.pk).update(fecha=apertura)
+        ajustar(self.suc_a, {self.p1.id: 4})
+        MovimientoStock.objects.filter(tipo='ajuste').update(fecha=apertura + datetime.timedelta(days=1))
+        with self.settings(STOCK_SNAPSHOT_MARGIN=0):
+            corte = corte_periodico()
+            self.assertIsNone(corte_periodico())
+        # Un corte al último segundo de cada día terminado, sin derivar con la hora del worker
+        cierres = [fin_del_dia(hoy - datetime.timedelta(days=d)) for d in (3, 2, 1)]
+        self.assertEqual(list(CorteStock.objects.exclude(pk=self.corte.pk).order_by('fecha').values_list('fecha', flat=True)), cierres)
+        self.assertEqual(corte.fecha, cierres[-1])
+        self.assertEqual(corte.saldos.get(producto=self.p1).cantidad, 14)
+
+    def test_corte_lee_solo_precios_de_productos_con_saldo(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from products.libro import tomar_corte
+        create_product("LIBSIN", "Producto Libro Sin Stock")
+        with CaptureQueriesContext(connection) as ctx:
+            corte = tomar_corte(timezone.now())
+        consultas = [q['sql'] for q in ctx.captured_queries if 'FROM "products_product"' in q['sql']]
+        self.assertEqual(len(consultas), 1)
+        self.assertIn(' IN (', consultas[0])
+        self.assertEqual(
+            sorted(corte.saldos.values_list('producto_id', 'costo_unitario')),
+            [(self.p1.id, Decimal('1000.00')), (self.p2.id, Decimal('1000.00'))],
+        )
+
+    def test_reconcile_stock_detecta_y_repara(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from products.libro import conciliar
+        StockSucursal.objects.filter(producto=self.p1).update(cantidad=99)
+        StockSucursal.objects.filter(producto=self.p2).delete()
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stock', stdout=StringIO())
+        out = StringIO()
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertIn('Repaired 2 row(s)', out.getvalue())
+        self.assertEqual((self._stock(self.p1, self.suc_a), self._stock(self.p2, self.suc_a)), (10, 10))
+        self.assertEqual(conciliar(), [])
@@ -14,6 +14,8 @@ urlpatterns = [
     path('bulk-assign/', views.bulk_assign_products, name='bulk_assign_products'),
     path('transfer/', views.transfer_stock, name='transfer_stock'),
     path('transfer/history/', views.transfer_history, name='transfer_history'),
+    path('transfer/manifest/', views.transfer_manifest, name='transfer_manifest'),
+    path('transfer/manifest/<int:manifiesto_id>/', views.transfer_manifest_detail, name='transfer_manifest_detail'),
     path('stock/adjust/', views.ajustar_stock, name='ajustar_stock'),
     path('stock/adjust/history/', views.adjust_history, name='adjust_history'),
 ]
@@ -1,18 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger 
-from django.db.models import Q 
-from .models import Product, StockSucursal, TransferenciaStock, AjusteStock
+from django.db.models import Q, Sum
+from .models import Product, StockSucursal, TransferenciaStock, AjusteStock, ManifiestoTransferencia
 from .utils import build_product_search_q
+from .importacion import ErrorImportacion, hoja_xlsx, validar_encabezados
+from .stock import (
+    StockError, ajustar, crear_manifiesto, lineas_desde_csv, lineas_desde_texto, normalizar_cantidades,
+    resolver_lineas, transferir,
+)
 from .forms import ProductForm
 from django.contrib import messages
 from django.http import HttpResponse
-from django.http import JsonResponse
-from openpyxl import Workbook, load_workbook
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-from datetime import datetime, date
-from django.utils.dateparse import parse_date 
+from django.http import FileResponse, JsonResponse
+from openpyxl import Workbook
+from decimal import Decimal, ROUND_HALF_UP
 from sucursales.models import Sucursal
 from django.conf import settings
+from MOVOS.paginacion import paginar_keyset
+from django.urls import reverse
+from jobs.models import Trabajo, almacenamiento_artefactos
+from jobs.services import encolar
+from jobs.views import datos_trabajo
+import json
+import tempfile
+import uuid
 
 def product_management(request):
     """
@@ -157,6 +168,9 @@ def download_template(request):
 def upload_products(request):
     """
     Vista para subir productos desde un archivo Excel.
+
+    El archivo se guarda y se importa en segundo plano (`manage.py run_jobs`); la página
+    consulta el avance del trabajo (?trabajo=<id>) hasta que termina.
     """
     if request.method == 'POST':
         dry_run = 'dry_run' in request.POST  # Permite previsualización sin escribir
@@ -170,169 +184,38 @@ def upload_products(request):
             return redirect('upload_products')
 
         try:
-            # Use read_only streaming mode to reduce memory usage on low-RAM instances
-            workbook = load_workbook(file, read_only=True, data_only=True)
-            sheet = workbook.active
-
-            # In read_only mode, avoid random access like sheet[1]; iterate the first row instead
-            first_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None)
-            header_row_values = [str(v).strip() for v in (first_row or [])]
-            header_map = {header: idx for idx, header in enumerate(header_row_values) if header}
-            minimal_headers = ['NOMBRE', 'CODIGO 1', 'PRECIO DE COMPRA', 'PRECIO DE VENTA']
-            missing = [h for h in minimal_headers if h not in header_map]
-            if missing:
-                messages.error(request, f'Faltan encabezados obligatorios: {", ".join(missing)}')
-                return redirect('upload_products')
-
-            # Pre-cargar productos existentes para minimizar queries repetidas
-            existing_map = {p.producto_id: p for p in Product.objects.filter(producto_id__isnull=False)}
-
-            # Acumuladores
-            warnings = []
-            errors = []
-            to_create = []
-            to_update = []
-            processed_codes = set()
-
-            def safe_decimal(val):
-                if val is None or (isinstance(val, str) and str(val).strip() == ''):
-                    return Decimal('0.00')
-                try:
-                    return Decimal(str(val).strip().replace(',', '.'))
-                except (ValueError, TypeError, InvalidOperation):
-                    return Decimal('0.00')
-
-            for row_idx, row_values in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-                # Salta filas completamente vacías
-                if not any(v for v in row_values if v is not None and str(v).strip() != ''):
-                    continue
-
-                def get_val(header_name):
-                    idx = header_map.get(header_name)
-                    if idx is not None and idx < len(row_values):
-                        return row_values[idx]
-                    return None
-
-                try:
-                    producto_id_excel = get_val('CODIGO 1')
-                    if producto_id_excel is None or str(producto_id_excel).strip() == '':
-                        warnings.append(f'Fila {row_idx}: CODIGO 1 vacío. Saltada.')
-                        continue
-                    producto_id_excel = str(producto_id_excel).strip()
-
-                    if producto_id_excel in processed_codes:
-                        warnings.append(f'Fila {row_idx}: Código duplicado en archivo ({producto_id_excel}). Se usa primera aparición.')
-                        continue
-                    processed_codes.add(producto_id_excel)
-
-                    nombre = str(get_val('NOMBRE')).strip() if get_val('NOMBRE') is not None else ''
-                    descripcion = str(get_val('DESCRIPCION')).strip() if get_val('DESCRIPCION') is not None else ''
-                    # Migración: tratar CODIGO 2 del archivo como código de barras principal cuando esté presente
-                    codigo_barras_excel = None
-                    if 'CODIGO DE BARRAS' in header_map:
-                        codigo_barras_excel = str(get_val('CODIGO DE BARRAS')).strip() if get_val('CODIGO DE BARRAS') is not None else ''
-                    # Compatibilidad hacia atrás: si sólo existe CODIGO 2, úsalo como código de barras
-                    if not codigo_barras_excel and 'CODIGO 2' in header_map:
-                        val_alt = get_val('CODIGO 2')
-                        codigo_barras_excel = str(val_alt).strip() if val_alt is not None else ''
-                    codigo_alternativo = None  # deprecado como entrada de import
-
-                    fecha_ingreso_producto = None
-                    fecha_raw = get_val('FECHA DE INGRESO')
-                    if fecha_raw:
-                        if isinstance(fecha_raw, (datetime, date)):
-                            fecha_ingreso_producto = fecha_raw.date() if isinstance(fecha_raw, datetime) else fecha_raw
-                        else:
-                            try:
-                                fecha_ingreso_producto = parse_date(str(fecha_raw).split(' ')[0].strip())
-                            except Exception:
-                                warnings.append(f'Fila {row_idx}: Fecha inválida "{fecha_raw}" -> se asigna nulo.')
-
-                    precio_compra = safe_decimal(get_val('PRECIO DE COMPRA'))
-                    precio_venta = safe_decimal(get_val('PRECIO DE VENTA'))
-
-                    defaults = {
-                        'nombre': nombre,
-                        'descripcion': descripcion or None,
-                        'codigo_alternativo': None,
-                        'codigo_barras': (codigo_barras_excel or None),
-                        'fecha_ingreso_producto': fecha_ingreso_producto,
-                        'precio_compra': precio_compra,
-                        'precio_venta': precio_venta,
-                        'permitir_venta_sin_stock': True,
-                    }
-
-                    if producto_id_excel in existing_map:
-                        # Solo registrar si hay cambios significativos para reducir writes
-                        prod = existing_map[producto_id_excel]
-                        has_change = any(getattr(prod, k) != v for k, v in defaults.items())
-                        if has_change:
-                            to_update.append((prod, defaults))
-                    else:
-                        to_create.append(Product(producto_id=producto_id_excel, **defaults))
-                except Exception as e:
-                    errors.append(f'Fila {row_idx}: Error inesperado -> {e}')
-
-            created_count = 0
-            updated_count = 0
-            if not dry_run:
-                from django.db import transaction
-                try:
-                    with transaction.atomic():
-                        if to_create:
-                            Product.objects.bulk_create(to_create, batch_size=500)
-                            created_count = len(to_create)
-                        for prod, defaults in to_update:
-                            for k, v in defaults.items():
-                                setattr(prod, k, v)
-                        if to_update:
-                            Product.objects.bulk_update([p for p, _ in to_update], [
-                                'nombre','descripcion','codigo_alternativo','codigo_barras','fecha_ingreso_producto','precio_compra','precio_venta','permitir_venta_sin_stock'
-                            ], batch_size=500)
-                            updated_count = len(to_update)
-                except Exception as e:
-                    messages.error(request, f'Error de transacción: {e}')
-                    return redirect('upload_products')
-            else:
-                created_count = len(to_create)
-                updated_count = len(to_update)
-
-            # Close workbook explicitly to free resources early
-            try:
-                workbook.close()
-            except Exception:
-                pass
-
-            total_processed = created_count + updated_count
-            if dry_run:
-                messages.info(request, f'Dry-run: {total_processed} filas procesables (Nuevos: {created_count}, Modificados: {updated_count}).')
-            else:
-                messages.success(request, f'Productos creados: {created_count}, actualizados: {updated_count}. Total: {total_processed}.')
-
-            # Compactar warnings y errores para no saturar UI
-            if warnings:
-                messages.warning(request, f'{len(warnings)} advertencias. Ejemplo: {warnings[0]}')
-            if errors:
-                messages.error(request, f'{len(errors)} errores. Ejemplo: {errors[0]}')
-
-            # Guardar detalle en sesión para descarga opcional futura
-            request.session['upload_products_report'] = {
-                'warnings': warnings[:200],  # Limitar
-                'errors': errors[:200],
-                'created': created_count,
-                'updated': updated_count,
-                'dry_run': dry_run,
-            }
-
-            # Redirigir a gestión si se ejecutó realmente
-            if not dry_run:
-                return redirect('product_management')
+            # Validar encabezados antes de encolar (sólo se lee la primera fila)
+            with hoja_xlsx(file) as (header_map, _filas):
+                validar_encabezados(header_map)
+        except ErrorImportacion as e:
+            messages.error(request, str(e))
             return redirect('upload_products')
         except Exception as e:
             messages.error(request, f'Error general procesando el archivo: {e}')
             return redirect('upload_products')
 
-    return render(request, 'products/upload_products.html')
+        file.seek(0)
+        archivo_entrada = almacenamiento_artefactos().save(f'importaciones/{uuid.uuid4().hex}.xlsx', file)
+        trabajo = encolar(
+            'importar_productos',
+            {'archivo_entrada': archivo_entrada, 'nombre_original': file.name, 'dry_run': dry_run},
+            usuario=request.user,
+            version=archivo_entrada,
+        )
+        messages.info(request, 'Archivo recibido. La importación se procesa en segundo plano.')
+        return redirect(f"{reverse('upload_products')}?trabajo={trabajo.id}")
+
+    trabajo = None
+    trabajo_id = request.GET.get('trabajo')
+    if trabajo_id and trabajo_id.isdigit():
+        trabajo = Trabajo.objects.filter(id=trabajo_id, tipo='importar_productos').first()
+        user = request.user
+        if trabajo and not (user.is_staff or user.is_superuser or trabajo.usuario_id == user.id):
+            trabajo = None
+    return render(request, 'products/upload_products.html', {
+        'trabajo': trabajo,
+        'datos_trabajo': datos_trabajo(trabajo) if trabajo else None,
+    })
 
 def delete_all_products(request):
     """
@@ -348,47 +231,76 @@ def delete_all_products(request):
             return redirect('product_management')
     return render(request, 'products/delete_all_products_confirm.html')
 
+ENCABEZADOS_EXPORTACION = [
+    'NOMBRE', 'DESCRIPCION', 'CODIGO 1', 'CODIGO DE BARRAS',
+    'FECHA DE INGRESO', 'PRECIO DE COMPRA', 'PRECIO DE VENTA',
+    'PRECIO COMPRA SIN IVA', 'PRECIO VENTA SIN IVA',
+    'GANANCIA NETA', 'PORCENTAJE DE GANANCIA'
+]
+
+
+def _filas_exportacion(sucursales=()):
+    """Filas del export de productos, leídas por bloques con values_list.
+
+    Con `sucursales`, agrega una columna de stock por sucursal calculada en la misma
+    consulta (suma condicional sobre StockSucursal agrupada por producto).
+    """
+    qs = Product.objects.order_by('nombre', 'id').values_list(
+        'nombre', 'descripcion', 'producto_id', 'codigo_barras', 'fecha_ingreso_producto',
+        'precio_compra', 'precio_venta',
+    )
+    if sucursales:
+        qs = qs.annotate(**{
+            f'stock_{s.id}': Sum('stocks_por_sucursal__cantidad', filter=Q(stocks_por_sucursal__sucursal_id=s.id))
+            for s in sucursales
+        })
+    # Instancia sin guardar para reutilizar los cálculos de IVA y ganancia del modelo
+    calculo = Product()
+    for nombre, descripcion, codigo, barras, fecha, precio_compra, precio_venta, *stocks in qs.iterator(chunk_size=2000):
+        calculo.precio_compra = precio_compra
+        calculo.precio_venta = precio_venta
+        yield [
+            nombre,
+            descripcion,
+            codigo,
+            barras,
+            fecha,
+            calculo.formatted_precio_compra,
+            calculo.formatted_precio_venta,
+            calculo.formatted_precio_compra_sin_iva,
+            calculo.formatted_precio_venta_sin_iva,
+            calculo.formatted_ganancia_neta,
+            calculo.porcentaje_ganancia,
+        ] + [cantidad or 0 for cantidad in stocks]
+
+
 def export_products_to_excel(request):
     """
     Vista para exportar todos los productos a un archivo Excel.
     Se utiliza el formateo definido en el modelo, incluyendo los nuevos cálculos.
-    """
-    from openpyxl import Workbook
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="export_productos.xlsx"'
 
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = 'Productos'
-
-    # Encabezados actualizados
-    headers = [
-        'NOMBRE', 'DESCRIPCION', 'CODIGO 1', 'CODIGO DE BARRAS',
-        'FECHA DE INGRESO', 'PRECIO DE COMPRA', 'PRECIO DE VENTA',
-        'PRECIO COMPRA SIN IVA', 'PRECIO VENTA SIN IVA',
-        'GANANCIA NETA', 'PORCENTAJE DE GANANCIA'
-    ]
-    sheet.append(headers)
-
-    products = Product.objects.all().order_by('nombre')
-    for product in products:
-        row_data = [
-            product.nombre,
-            product.descripcion,
-            product.producto_id,
-            product.codigo_barras,
-            product.fecha_ingreso_producto,
-            product.formatted_precio_compra,
-            product.formatted_precio_venta,
-            product.formatted_precio_compra_sin_iva,
-            product.formatted_precio_venta_sin_iva,
-            product.formatted_ganancia_neta,
-            product.porcentaje_ganancia  # O, si se tiene formateado: product.formatted_porcentaje_ganancia
-        ]
-        sheet.append(row_data)
-
-    workbook.save(response)
-    return response
+    El libro se escribe en modo write-only (las filas no quedan en memoria) sobre un
+    archivo temporal que se envía por bloques. Con ?stock_sucursales=1 agrega columnas
+    "STOCK@<sucursal>" (el mismo formato que acepta la carga de productos).
+    """
+    sucursales = list(Sucursal.objects.order_by('nombre')) if request.GET.get('stock_sucursales') else []
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Productos')
+    sheet.append(ENCABEZADOS_EXPORTACION + [f'STOCK@{s.nombre}' for s in sucursales])
+    for fila in _filas_exportacion(sucursales):
+        sheet.append(fila)
+
+    archivo = tempfile.TemporaryFile()
+    workbook.save(archivo)
+    archivo.seek(0)
+    # FileResponse cierra (y así elimina) el archivo temporal al terminar de enviarlo
+    return FileResponse(
+        archivo,
+        as_attachment=True,
+        filename='export_productos.xlsx',
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
 
 @property
 def precio_compra_sin_iva(self):
@@ -491,8 +403,21 @@ def bulk_assign_products(request):
     }
     return render(request, 'products/bulk_assign_products.html', context)
 
+def _items_de_transferencia(request):
+    """[(producto_id, cantidad)] del formulario: filas producto/cantidad, líneas pegadas "código;cantidad" y CSV."""
+    items = [
+        (producto_id, cantidad)
+        for producto_id, cantidad in zip(request.POST.getlist('producto_id'), request.POST.getlist('cantidad'))
+        if producto_id
+    ]
+    lineas = lineas_desde_texto(request.POST.get('lineas'))
+    if request.FILES.get('archivo'):
+        lineas += lineas_desde_csv(request.FILES['archivo'])
+    return items + resolver_lineas(lineas)
+
+
 def transfer_stock(request):
-    """Transferir cantidad de un producto desde una sucursal origen a una sucursal destino."""
+    """Transferir stock de uno o varios productos desde una sucursal origen a una sucursal destino."""
     productos = Product.objects.all().order_by('nombre')
     sucursales = Sucursal.objects.all().order_by('nombre')
     # Pre-selección desde query params
@@ -501,47 +426,88 @@ def transfer_stock(request):
     context = { 'productos': productos, 'sucursales': sucursales, 'pre_producto': pre_producto, 'pre_origen': pre_origen }
     if request.method == 'POST':
         try:
-            producto_id = int(request.POST.get('producto_id'))
             origen_id = int(request.POST.get('sucursal_origen'))
             destino_id = int(request.POST.get('sucursal_destino'))
-            cantidad = int(request.POST.get('cantidad'))
         except (TypeError, ValueError):
             messages.error(request, 'Datos inválidos en el formulario.')
             return render(request, 'products/transfer_stock.html', context)
-        if origen_id == destino_id:
-            messages.error(request, 'La sucursal de origen y destino no pueden ser la misma.')
-            return render(request, 'products/transfer_stock.html', context)
-        if cantidad <= 0:
-            messages.error(request, 'La cantidad debe ser mayor a cero.')
-            return render(request, 'products/transfer_stock.html', context)
-        producto = get_object_or_404(Product, id=producto_id)
         suc_origen = get_object_or_404(Sucursal, id=origen_id)
         suc_destino = get_object_or_404(Sucursal, id=destino_id)
-        # Validar stock disponible en origen
-        disp = producto.stock_en(suc_origen)
-        if disp < cantidad and not producto.permitir_venta_sin_stock:
-            messages.error(request, f'Stock insuficiente en sucursal origen. Disponible: {disp}.')
+        try:
+            cantidades = normalizar_cantidades(_items_de_transferencia(request))
+            if len(cantidades) > 1:
+                # Varios productos: se registran como un manifiesto
+                manifiesto = crear_manifiesto(suc_origen, suc_destino, cantidades, usuario=request.user, nota=request.POST.get('nota'))
+            else:
+                transferencias = transferir(suc_origen, suc_destino, cantidades, usuario=request.user)
+        except StockError as e:
+            messages.error(request, e.mensaje)
             return render(request, 'products/transfer_stock.html', context)
-        # Descontar en origen
-        ss_origen, _ = StockSucursal.objects.get_or_create(producto=producto, sucursal=suc_origen, defaults={'cantidad': 0})
-        ss_origen.cantidad = max(0, (ss_origen.cantidad or 0) - cantidad)
-        ss_origen.save()
-        # Aumentar en destino
-        ss_destino, _ = StockSucursal.objects.get_or_create(producto=producto, sucursal=suc_destino, defaults={'cantidad': 0})
-        ss_destino.cantidad = (ss_destino.cantidad or 0) + cantidad
-        ss_destino.save()
-        # Registrar historial
-        TransferenciaStock.objects.create(
-            producto=producto,
-            origen=suc_origen,
-            destino=suc_destino,
-            cantidad=cantidad,
-            usuario=request.user if request.user.is_authenticated else None
-        )
-        messages.success(request, f'Transferencia realizada: {cantidad} unidades de "{producto.nombre}" de {suc_origen.nombre} a {suc_destino.nombre}.')
-        return redirect('transfer_stock')
+        if len(cantidades) == 1:
+            t = transferencias[0]
+            messages.success(request, f'Transferencia realizada: {t.cantidad} unidades de "{t.producto.nombre}" de {suc_origen.nombre} a {suc_destino.nombre}.')
+            return redirect('transfer_stock')
+        messages.success(request, f'Manifiesto #{manifiesto.id} aplicado: {manifiesto.total_lineas} productos ({manifiesto.total_unidades} unidades) de {suc_origen.nombre} a {suc_destino.nombre}.')
+        return redirect('transfer_manifest_detail', manifiesto.id)
     return render(request, 'products/transfer_stock.html', context)
 
+
+def _datos_manifiesto(manifiesto):
+    return {
+        'id': manifiesto.id,
+        'origen': manifiesto.origen_id,
+        'destino': manifiesto.destino_id,
+        'lineas': manifiesto.total_lineas,
+        'unidades': manifiesto.total_unidades,
+        'url': reverse('transfer_manifest_detail', args=[manifiesto.id]),
+    }
+
+
+def transfer_manifest(request):
+    """Endpoint de manifiestos: POST JSON con cientos de líneas, aplicado en una transacción.
+
+    Cuerpo: {"sucursal_origen": id, "sucursal_destino": id, "nota": "...",
+             "lineas": [{"producto_id": id | "codigo": "...", "cantidad": n}, ...]}
+    Los formularios (filas, texto pegado o CSV) usan transfer_stock.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    try:
+        data = json.loads(request.body or b'{}')
+        origen_id = int(data.get('sucursal_origen'))
+        destino_id = int(data.get('sucursal_destino'))
+        lineas = data.get('lineas') or []
+        if not isinstance(lineas, list):
+            raise ValueError
+    except (TypeError, ValueError, AttributeError):
+        return JsonResponse({'error': 'Datos inválidos: se espera JSON con sucursales y lineas.'}, status=400)
+    sucursales = Sucursal.objects.in_bulk([origen_id, destino_id])
+    if origen_id not in sucursales or destino_id not in sucursales:
+        return JsonResponse({'error': 'Sucursal no encontrada.'}, status=404)
+    try:
+        items, por_codigo = [], []
+        for numero, linea in enumerate(lineas, start=1):
+            if not isinstance(linea, dict):
+                raise StockError(f'Línea {numero} inválida.')
+            if linea.get('producto_id') is not None:
+                items.append((linea.get('producto_id'), linea.get('cantidad')))
+            else:
+                por_codigo.append((numero, str(linea.get('codigo') or '').strip(), linea.get('cantidad')))
+        cantidades = normalizar_cantidades(items + resolver_lineas(por_codigo))
+        manifiesto = crear_manifiesto(
+            sucursales[origen_id], sucursales[destino_id], cantidades, usuario=request.user, nota=data.get('nota'),
+        )
+    except StockError as e:
+        return JsonResponse({'error': e.mensaje}, status=e.status)
+    return JsonResponse(_datos_manifiesto(manifiesto), status=201)
+
+
+def transfer_manifest_detail(request, manifiesto_id):
+    """Detalle de un manifiesto con sus líneas."""
+    manifiesto = get_object_or_404(ManifiestoTransferencia.objects.select_related('origen', 'destino', 'usuario'), id=manifiesto_id)
+    lineas = manifiesto.transferencias.select_related('producto').order_by('id')
+    return render(request, 'products/transfer_manifest.html', {'manifiesto': manifiesto, 'lineas': lineas})
+
 def transfer_history(request):
     """Historial simple de transferencias con filtros básicos."""
     productos = Product.objects.all().order_by('nombre')
@@ -561,12 +527,8 @@ def transfer_history(request):
         qs = qs.filter(producto_id=prod)
     if suc:
         qs = qs.filter(Q(origen_id=suc) | Q(destino_id=suc))
-    # Ordenar descendente por fecha (más recientes primero)
-    qs = qs.order_by('-fecha')
-    # Construir paginador
-    paginator = Paginator(qs, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Más recientes primero, paginado por cursor (fecha, id)
+    page_obj = paginar_keyset(request, qs, per_page, contar=True)
     return render(request, 'products/transfer_history.html', {
         'page_obj': page_obj,
         'per_page': per_page,
@@ -585,22 +547,17 @@ def ajustar_stock(request):
         producto_id = int(request.POST.get('producto_id'))
         sucursal_id = int(request.POST.get('sucursal_id'))
         delta = int(request.POST.get('delta'))
-        motivo = (request.POST.get('motivo') or '').strip()
-        producto = get_object_or_404(Product, id=producto_id)
-        sucursal = get_object_or_404(Sucursal, id=sucursal_id)
-        ss, _ = StockSucursal.objects.get_or_create(producto=producto, sucursal=sucursal, defaults={'cantidad': 0})
-        ss.cantidad = max(0, (ss.cantidad or 0) + delta)
-        ss.save()
-        AjusteStock.objects.create(
-            producto=producto,
-            sucursal=sucursal,
-            cantidad_delta=delta,
-            motivo=motivo or None,
-            usuario=request.user if request.user.is_authenticated else None
-        )
-        return JsonResponse({'success': True, 'nueva_cantidad': ss.cantidad})
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Datos inválidos: producto, sucursal o variación no numéricos.'}, status=400)
+    motivo = (request.POST.get('motivo') or '').strip()
+    sucursal = Sucursal.objects.filter(id=sucursal_id).first()
+    if sucursal is None:
+        return JsonResponse({'error': 'Sucursal no encontrada.'}, status=404)
+    try:
+        nuevas = ajustar(sucursal, normalizar_cantidades([(producto_id, delta)], permitir_negativos=True), usuario=request.user, motivo=motivo)
+    except StockError as e:
+        return JsonResponse({'error': e.mensaje}, status=e.status)
+    return JsonResponse({'success': True, 'nueva_cantidad': nuevas[producto_id]})
 
 def adjust_history(request):
     """Historial de ajustes de stock con filtros por producto y sucursal."""
@@ -620,10 +577,9 @@ def adjust_history(request):
             Q(producto__producto_id__icontains=q_text) |
             Q(producto__codigo_alternativo__icontains=q_text)
         )
-    # Ordenar por fecha descendente para mostrar primero los ajustes más recientes
-    qs = qs.order_by('-fecha')
+    # Más recientes primero, paginado por cursor (fecha, id)
     return render(request, 'products/adjust_history.html', {
-        'ajustes': qs[:200],
+        'ajustes': paginar_keyset(request, qs, 50),
         'productos': productos,
         'sucursales': sucursales,
         'producto_sel': prod,
@@ -644,43 +600,22 @@ def sucursal_products(request, sucursal_id):
         per_page = 10
     if per_page not in [10, 20, 30, 50]:
         per_page = 10
+    # Umbral: el de la sucursal si > 0; en caso contrario, el global
+    threshold = sucursal.umbral_stock_bajo
     # Incluir productos asociados por FK y/o que tengan stock registrado en esta sucursal
-    productos_fk = Product.objects.filter(sucursal_id=sucursal_id)
-    productos_stock = Product.objects.filter(stocks_por_sucursal__sucursal_id=sucursal_id)
-    productos_qs = (productos_fk | productos_stock).distinct().prefetch_related('stocks_por_sucursal')
+    productos_qs = Product.objects.de_sucursal(sucursal).con_stock_en(sucursal)
     if search_query:
         productos_qs = productos_qs.filter(build_product_search_q(search_query))
-    # Determinar umbral ahora para posible filtrado por stock
-    threshold = None  # será resuelto abajo usando sucursal o settings
-    # Filtrado por estado de stock si corresponde (antes de paginar)
-    if stock_filter in ('low', 'out'):
-        # Resolver threshold preliminar (si sucursal tiene 0, luego usaremos el global)
-        threshold = sucursal.low_stock_threshold if getattr(sucursal, 'low_stock_threshold', 0) and sucursal.low_stock_threshold > 0 else getattr(settings, 'LOW_STOCK_THRESHOLD', 2)
-        ids_keep = []
-        for p in productos_qs:
-            s_val = 0
-            try:
-                s_val = p.stock_en(sucursal)
-            except Exception:
-                s_val = p.stock or 0
-            if stock_filter == 'out' and s_val <= 0:
-                ids_keep.append(p.id)
-            elif stock_filter == 'low' and s_val > 0 and s_val <= threshold:
-                ids_keep.append(p.id)
-        productos_qs = productos_qs.filter(id__in=ids_keep)
+    # Filtrado por estado de stock en SQL (antes de paginar)
+    if stock_filter == 'out':
+        productos_qs = productos_qs.con_stock_entre(sucursal, maximo=0)
+    elif stock_filter == 'low':
+        productos_qs = productos_qs.con_stock_entre(sucursal, minimo=1, maximo=threshold)
     productos_qs = productos_qs.order_by('nombre')
     paginator = Paginator(productos_qs, per_page)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-    # Adjuntar stock por sucursal a cada producto de la página
-    for p in page_obj.object_list:
-        try:
-            p.stock_sucursal = p.stock_en(sucursal)
-        except Exception:
-            p.stock_sucursal = p.stock
-    # Determinar umbral: usar el de la sucursal si > 0; en caso contrario, el global
-    if threshold is None:
-        threshold = sucursal.low_stock_threshold if getattr(sucursal, 'low_stock_threshold', 0) and sucursal.low_stock_threshold > 0 else getattr(settings, 'LOW_STOCK_THRESHOLD', 2)
+    # El stock por sucursal viene anotado en 'stock_sucursal' (con_stock_en)
     return render(request, 'sucursales/sucursal_products.html', {
         'sucursal': sucursal,
         'page_obj': page_obj,
@@ -1,9 +1,15 @@
 from decimal import Decimal, ROUND_HALF_UP
 import datetime
+import time
+from django.conf import settings
+from django.db import connection
 from django.utils import timezone
 from django.db.models import Sum, F, Count
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncDate, TruncMonth
 from django.core.cache import cache
 from cashier.models import Venta, VentaDetalle
+from .models import ResumenVentaDiaria
+from . import cache_versiones
 import hashlib
 
 def _safe_cache_key(prefix: str, *parts) -> str:
@@ -17,49 +23,362 @@ from sucursales.models import Sucursal
 
 # Nota: Mantener lógica alineada con reports/views.py advanced_reports.
 
-def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_filter='todos', limit_rentabilidad=50):
-    """Computa todos los datasets y KPIs usados en advanced_reports.
-    Retorna diccionario con claves idénticas a las usadas en el contexto.
-    """
-    ventas_qs = Venta.objects.filter(fecha__gte=fecha_inicio, fecha__lte=fecha_fin)
+_VACIO = {'ingreso': Decimal('0.00'), 'costo': Decimal('0.00')}
+
+def _sin_iva(valor):
+    return (valor / Decimal('1.19')).quantize(Decimal('0.01')) if valor else Decimal('0.00')
+
+def _ganancia_neta(valores):
+    return _sin_iva(valores['ingreso']) - _sin_iva(valores['costo'])
+
+def _costo_detalles():
+    """Costo de mercadería (precio de compra registrado al vender) de un queryset de VentaDetalle."""
+    return Sum(F('cantidad') * F('costo_unitario'))
+
+def _a_decimal(valor):
+    # Algunos backends (SQLite) devuelven la suma de productos como float
+    return Decimal(str(valor or 0)).quantize(Decimal('0.01'))
+
+def _aplicar_filtros(qs, cajero_filter='todos', sucursal_filter='todos'):
+    """Filtra por cajero/sucursal (valores no numéricos se ignoran). Sirve para Venta y ResumenVentaDiaria."""
     if cajero_filter and cajero_filter != 'todos':
         try:
-            ventas_qs = ventas_qs.filter(empleado_id=int(cajero_filter))
+            qs = qs.filter(empleado_id=int(cajero_filter))
         except ValueError:
             pass
     if sucursal_filter and sucursal_filter != 'todos':
         try:
-            ventas_qs = ventas_qs.filter(sucursal_id=int(sucursal_filter))
+            qs = qs.filter(sucursal_id=int(sucursal_filter))
         except ValueError:
             pass
+    return qs
 
-    # Aggregates principales
-    agg_ventas = ventas_qs.aggregate(ingreso_total=Sum('total'), num_transacciones=Count('id'))
-    ingreso_total = agg_ventas.get('ingreso_total') or Decimal('0.00')
-    num_transacciones = agg_ventas.get('num_transacciones') or 0
+def _dias_completos(fecha_inicio, fecha_fin):
+    """(primer_dia, ultimo_dia) locales si el rango cubre días completos (00:00 a 23:59:59); si no, None."""
+    inicio = timezone.localtime(fecha_inicio) if timezone.is_aware(fecha_inicio) else fecha_inicio
+    fin = timezone.localtime(fecha_fin) if timezone.is_aware(fecha_fin) else fecha_fin
+    if inicio.time() != datetime.time.min or fin.time() < datetime.time(23, 59, 59):
+        return None
+    if inicio.date() > fin.date():
+        return None
+    return inicio.date(), fin.date()
+
+def _ingreso_costo_crudo(ventas_qs, detalles_qs, clave_venta, clave_detalle):
+    """{clave: {'ingreso', 'costo'}} con un GROUP BY sobre ventas y otro sobre sus detalles."""
+    grupos = {}
+    for row in ventas_qs.annotate(clave=clave_venta).values('clave').annotate(ingreso=Sum('total')).order_by():
+        grupos[row['clave']] = {'ingreso': row['ingreso'] or Decimal('0.00'), 'costo': Decimal('0.00')}
+    for row in detalles_qs.annotate(clave=clave_detalle).values('clave').annotate(costo=_costo_detalles()).order_by():
+        grupos.setdefault(row['clave'], dict(_VACIO))['costo'] = _a_decimal(row['costo'])
+    return grupos
+
+def _ingreso_costo_resumen(resumen_qs, clave):
+    """Mismo formato que _ingreso_costo_crudo, leído desde ResumenVentaDiaria."""
+    return {
+        row['clave']: {'ingreso': row['ingreso'] or Decimal('0.00'), 'costo': row['costo'] or Decimal('0.00')}
+        for row in resumen_qs.annotate(clave=clave).values('clave').annotate(ingreso=Sum('ingreso'), costo=Sum('costo')).order_by()
+    }
+
+def distribucion_horaria(ventas_qs):
+    """Distribución por hora (24) y matriz día de semana x hora (7x24, lunes=0) en TIME_ZONE.
+
+    Un único GROUP BY de a lo más 168 filas, sin instanciar ventas.
+    """
+    hourly_distribution = [{'hora': h, 'ventas': 0, 'ingreso': 0.0} for h in range(24)]
+    heatmap_matrix = [[{'ventas':0,'ingreso':0.0} for _ in range(24)] for _ in range(7)]
+    celdas = (
+        ventas_qs.annotate(dow=ExtractIsoWeekDay('fecha'), hora=ExtractHour('fecha'))
+        .values('dow', 'hora')
+        .annotate(ventas=Count('id'), ingreso=Sum('total'))
+        .order_by()
+    )
+    for row in celdas:
+        ventas = row['ventas']
+        ingreso = float(row['ingreso'] or 0)
+        hourly_distribution[row['hora']]['ventas'] += ventas
+        hourly_distribution[row['hora']]['ingreso'] += ingreso
+        cell = heatmap_matrix[row['dow'] - 1][row['hora']]
+        cell['ventas'] += ventas
+        cell['ingreso'] += ingreso
+    return hourly_distribution, heatmap_matrix
+
+def querysets_periodo(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_filter='todos'):
+    """(ventas_qs, detalles_qs, resumen_qs) del periodo filtrado.
+
+    resumen_qs (ResumenVentaDiaria) sólo si el rango cubre días completos y REPORTS_USE_ROLLUP está activo; si no, None.
+    """
+    ventas_qs = _aplicar_filtros(Venta.objects.filter(fecha__gte=fecha_inicio, fecha__lte=fecha_fin), cajero_filter, sucursal_filter)
+    detalles_qs = VentaDetalle.objects.filter(venta__in=ventas_qs)
+    resumen_qs = None
+    if getattr(settings, 'REPORTS_USE_ROLLUP', False):
+        dias = _dias_completos(fecha_inicio, fecha_fin)
+        if dias:
+            resumen_qs = _aplicar_filtros(
+                ResumenVentaDiaria.objects.filter(dia__gte=dias[0], dia__lte=dias[1]), cajero_filter, sucursal_filter
+            )
+    return ventas_qs, detalles_qs, resumen_qs
+
+_SERIES = {
+    # serie: (clave en resumen, clave en ventas, clave en detalles)
+    'dia': (F('dia'), TruncDate('fecha'), TruncDate('venta__fecha')),
+    'sucursal': (F('sucursal_id'), F('sucursal_id'), F('venta__sucursal_id')),
+    'mes': (TruncMonth('dia'), TruncMonth('fecha'), TruncMonth('venta__fecha')),
+}
+
+def ingreso_costo_por(serie, ventas_qs, detalles_qs, resumen_qs=None):
+    """{clave: {'ingreso', 'costo'}} agrupado por 'dia', 'sucursal' o 'mes' (desde el resumen si se entrega)."""
+    clave_resumen, clave_venta, clave_detalle = _SERIES[serie]
+    if resumen_qs is not None:
+        return _ingreso_costo_resumen(resumen_qs, clave_resumen)
+    return _ingreso_costo_crudo(ventas_qs, detalles_qs, clave_venta, clave_detalle)
+
+def serie_diaria(ventas_qs, detalles_qs, resumen_qs=None):
+    """Filas (dia 'YYYY-MM-DD', ingreso, ganancia_neta) ordenadas por día."""
+    por_dia = ingreso_costo_por('dia', ventas_qs, detalles_qs, resumen_qs)
+    return [
+        (dia.strftime('%Y-%m-%d'), valores['ingreso'], _ganancia_neta(valores))
+        for dia, valores in sorted((d, v) for d, v in por_dia.items() if d)
+    ]
+
+def comparacion_sucursales(ventas_qs, detalles_qs, resumen_qs=None):
+    """Filas (sucursal, ingreso, ganancia_neta) para todas las sucursales, con 0 si no hay ventas."""
+    por_sucursal = ingreso_costo_por('sucursal', ventas_qs, detalles_qs, resumen_qs)
+    filas = []
+    for suc in Sucursal.objects.all():
+        valores = por_sucursal.get(suc.id, _VACIO)
+        filas.append((suc.nombre, valores['ingreso'], _ganancia_neta(valores)))
+    return filas
+
+def ranking_por_cajero(ventas_qs, resumen_qs=None):
+    """Filas (usuario, ventas, ingreso, ticket_promedio) ordenadas por ingreso (desc)."""
+    if resumen_qs is not None:
+        por_cajero = resumen_qs.values('empleado_id', 'empleado__username').annotate(ventas_count=Sum('tickets'), ingreso_total=Sum('ingreso'))
+    else:
+        por_cajero = ventas_qs.values('empleado_id', 'empleado__username').annotate(ventas_count=Count('id'), ingreso_total=Sum('total'))
+    filas = []
+    for data in por_cajero.order_by():
+        ingreso_cajero = data['ingreso_total'] or Decimal('0.00')
+        ticket_prom = (ingreso_cajero / data['ventas_count']).quantize(Decimal('0.01')) if data['ventas_count'] else Decimal('0.00')
+        filas.append((data['empleado__username'], data['ventas_count'], ingreso_cajero, ticket_prom))
+    filas.sort(key=lambda f: f[2], reverse=True)
+    return filas
+
+def rentabilidad_por_producto(detalles_qs, chunk_size=2000):
+    """Rentabilidad neta (sin IVA) por producto, ordenada por ganancia neta (desc), con valores Decimal.
+
+    Agrupa en SQL por (producto, precio de venta, costo unitario de la venta): como el redondeo sin IVA es por
+    unidad, el resultado es idéntico a recorrer cada VentaDetalle, pero sólo se leen los grupos.
+    """
+    grupos = (
+        detalles_qs
+        .values('producto_id', 'producto__nombre', 'producto__producto_id', 'precio_unitario', 'costo_unitario')
+        .annotate(unidades=Sum('cantidad'))
+        .order_by()
+    )
+    tmp = {}
+    for g in grupos.iterator(chunk_size=chunk_size):
+        venta_sin_iva_unit = _sin_iva(g['precio_unitario'] or Decimal('0.00'))
+        compra_sin_iva_unit = _sin_iva(g['costo_unitario'] or Decimal('0.00'))
+        unidades = g['unidades'] or 0
+        entry = tmp.get(g['producto_id'])
+        if not entry:
+            entry = tmp[g['producto_id']] = {
+                'producto': g['producto__nombre'] or g['producto__producto_id'], 'cantidad': 0,
+                'ingreso_neto_total': Decimal('0.00'), 'costo_neto_total': Decimal('0.00'), 'ganancia_neta_total': Decimal('0.00'),
+            }
+        entry['cantidad'] += unidades
+        entry['ingreso_neto_total'] += venta_sin_iva_unit * unidades
+        entry['costo_neto_total'] += compra_sin_iva_unit * unidades
+        entry['ganancia_neta_total'] += (venta_sin_iva_unit - compra_sin_iva_unit) * unidades
+    filas = []
+    for data in tmp.values():
+        porcentaje = Decimal('0.00')
+        if data['ingreso_neto_total'] > 0:
+            porcentaje = (data['ganancia_neta_total'] / data['ingreso_neto_total'] * Decimal('100')).quantize(Decimal('0.01'))
+        filas.append({**data, 'porcentaje_ganancia': porcentaje})
+    filas.sort(key=lambda x: x['ganancia_neta_total'], reverse=True)
+    return filas
+
+class _Perfil:
+    """Mide milisegundos por sección y cuenta las queries ejecutadas (se instala con connection.execute_wrapper)."""
+
+    def __init__(self):
+        self.inicio = self.ultimo = time.perf_counter()
+        self.queries = 0
+        self.secciones = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def marca(self, seccion):
+        ahora = time.perf_counter()
+        self.secciones[f'ms_{seccion}'] = round((ahora - self.ultimo) * 1000, 2)
+        self.ultimo = ahora
+
+    def resultado(self):
+        return {
+            **self.secciones,
+            'ms_total': round((time.perf_counter() - self.inicio) * 1000, 2),
+            'queries_total': self.queries,
+        }
 
-    agg_unidades = VentaDetalle.objects.filter(venta__in=ventas_qs).aggregate(total_unidades=Sum('cantidad'))
-    total_unidades = agg_unidades.get('total_unidades') or 0
+def _parse_dia(valor, fin=False):
+    """'YYYY-MM-DD' -> datetime aware (inicio del día, o último segundo si fin=True). None si no es válido."""
+    try:
+        dia = timezone.make_aware(datetime.datetime.strptime(valor, '%Y-%m-%d'))
+    except (TypeError, ValueError):
+        return None
+    return dia + datetime.timedelta(days=1, seconds=-1) if fin else dia
 
-    agg_cmv = VentaDetalle.objects.filter(venta__in=ventas_qs).aggregate(
-        cmv=Sum(F('cantidad') * F('producto__precio_compra'))
+def filtros_desde_request(request):
+    """Filtros de los reportes avanzados desde request.GET (ver filtros_desde_params)."""
+    return filtros_desde_params(request.GET)
+
+def filtros_desde_params(get):
+    """Lee y normaliza los filtros de los reportes avanzados desde un dict/QueryDict de parámetros.
+
+    Rango por defecto: los 30 días previos y el día de hoy, completos (así el resultado se puede
+    cachear durante el día). 'top' inválido vuelve a 10.
+    """
+    hoy = timezone.localdate()
+    fecha_inicio_str = get.get('fecha_inicio')
+    fecha_fin_str = get.get('fecha_fin')
+    comparativo_inicio_str = get.get('comparativo_inicio')
+    comparativo_fin_str = get.get('comparativo_fin')
+    try:
+        top = int(get.get('top', 10) or 10)
+    except ValueError:
+        top = 10
+    return {
+        'fecha_inicio_str': fecha_inicio_str,
+        'fecha_fin_str': fecha_fin_str,
+        'fecha_inicio': _parse_dia(fecha_inicio_str) or _parse_dia((hoy - datetime.timedelta(days=30)).isoformat()),
+        'fecha_fin': _parse_dia(fecha_fin_str, fin=True) or _parse_dia(hoy.isoformat(), fin=True),
+        'cajero': get.get('cajero', 'todos'),
+        'sucursal': get.get('sucursal', 'todos'),
+        'top': top,
+        'comparativo_inicio_str': comparativo_inicio_str,
+        'comparativo_fin_str': comparativo_fin_str,
+        'comparativo_inicio': _parse_dia(comparativo_inicio_str),
+        'comparativo_fin': _parse_dia(comparativo_fin_str, fin=True),
+    }
+
+def parametros_de_filtros(filtros):
+    """Parámetros serializables (JSON) que reproducen los filtros con filtros_desde_params.
+
+    Las fechas se fijan a días concretos: un trabajo encolado hoy y ejecutado mañana usa el mismo rango.
+    """
+    return {
+        'fecha_inicio': timezone.localdate(filtros['fecha_inicio']).isoformat(),
+        'fecha_fin': timezone.localdate(filtros['fecha_fin']).isoformat(),
+        'cajero': filtros['cajero'],
+        'sucursal': filtros['sucursal'],
+        'top': filtros['top'],
+        'comparativo_inicio': filtros['comparativo_inicio_str'] if filtros['comparativo_inicio'] else None,
+        'comparativo_fin': filtros['comparativo_fin_str'] if filtros['comparativo_fin'] else None,
+    }
+
+def version_datos(filtros):
+    """Firma de la versión de los datos (cache_versiones) que cubren los filtros."""
+    return cache_versiones.firma(_tramos_analytics(filtros))
+
+def _tramos_analytics(filtros):
+    """(sucursal|'*', día) de los que depende el resultado: rango principal y periodo comparativo."""
+    sucursal = filtros['sucursal']
+    espacio = int(sucursal) if sucursal and str(sucursal).isdigit() else cache_versiones.TODAS
+    tramos = [(espacio, d) for d in cache_versiones.dias_locales(filtros['fecha_inicio'], filtros['fecha_fin'])]
+    if filtros['comparativo_inicio'] and filtros['comparativo_fin']:
+        dias_prev = cache_versiones.dias_locales(filtros['comparativo_inicio'], filtros['comparativo_fin'])
+        tramos += [(espacio, d) for d in dias_prev]
+    # Periodo anterior automático (sin filtros): mismo largo, justo antes del inicio
+    largo = (filtros['fecha_fin'] - filtros['fecha_inicio']).days + 1
+    dias_prev = cache_versiones.dias_locales(filtros['fecha_inicio'] - datetime.timedelta(days=largo + 1), filtros['fecha_inicio'])
+    tramos += [(cache_versiones.TODAS, d) for d in dias_prev]
+    return tramos
+
+def obtener_analytics(filtros, limit_rentabilidad=50, timeout=300):
+    """compute_analytics cacheado por conjunto de filtros (ver filtros_desde_request).
+
+    La clave incluye las versiones (sucursal, día) de cache_versiones: una venta nueva invalida sólo
+    los resultados que cubren su día. En un acierto 'profiling' conserva los tiempos del cálculo
+    original y marca cache=True.
+    """
+    cache_key = _safe_cache_key(
+        'analytics',
+        filtros['fecha_inicio'].isoformat(), filtros['fecha_fin'].isoformat(),
+        filtros['cajero'], filtros['sucursal'], filtros['top'], limit_rentabilidad,
+        filtros['comparativo_inicio'], filtros['comparativo_fin'],
+        version_datos(filtros),
     )
-    cmv_val = agg_cmv.get('cmv') or 0
-    cmv = Decimal(str(cmv_val))
+    data = cache.get(cache_key)
+    cache_versiones.registrar(data is not None)
+    if data is not None:
+        return {**data, 'profiling': {**data['profiling'], 'cache': True}}
+    data = compute_analytics(
+        filtros['fecha_inicio'], filtros['fecha_fin'], filtros['cajero'], filtros['sucursal'],
+        limit_rentabilidad=limit_rentabilidad, top=filtros['top'],
+        comparativo_inicio=filtros['comparativo_inicio'], comparativo_fin=filtros['comparativo_fin'],
+    )
+    cache.set(cache_key, data, timeout)
+    return data
+
+def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_filter='todos', limit_rentabilidad=50,
+                      top=10, comparativo_inicio=None, comparativo_fin=None):
+    """Computa todos los datasets y KPIs usados en advanced_reports.
+    Retorna diccionario con claves idénticas a las usadas en el contexto.
+
+    Si se indica un rango comparativo válido se usa en lugar del periodo anterior automático.
+    Incluye 'profiling' con tiempos por sección y cantidad de queries ejecutadas.
+    """
+    perfil = _Perfil()
+    with connection.execute_wrapper(perfil):
+        data = _calcular(perfil, fecha_inicio, fecha_fin, cajero_filter, sucursal_filter, limit_rentabilidad,
+                         top, comparativo_inicio, comparativo_fin)
+    data['profiling'] = perfil.resultado()
+    return data
+
+def _calcular(perfil, fecha_inicio, fecha_fin, cajero_filter, sucursal_filter, limit_rentabilidad,
+              top, comparativo_inicio, comparativo_fin):
+    ventas_qs, detalles_qs, resumen_qs = querysets_periodo(fecha_inicio, fecha_fin, cajero_filter, sucursal_filter)
+
+    # Aggregates principales
+    if resumen_qs is not None:
+        totales = resumen_qs.aggregate(ingreso=Sum('ingreso'), tickets=Sum('tickets'), unidades=Sum('unidades'), costo=Sum('costo'))
+        ingreso_total = totales['ingreso'] or Decimal('0.00')
+        num_transacciones = totales['tickets'] or 0
+        total_unidades = totales['unidades'] or 0
+        cmv = Decimal(str(totales['costo'] or 0))
+    else:
+        agg_ventas = ventas_qs.aggregate(ingreso_total=Sum('total'), num_transacciones=Count('id'))
+        ingreso_total = agg_ventas.get('ingreso_total') or Decimal('0.00')
+        num_transacciones = agg_ventas.get('num_transacciones') or 0
+
+        agg_detalles = detalles_qs.aggregate(total_unidades=Sum('cantidad'), cmv=_costo_detalles())
+        total_unidades = agg_detalles.get('total_unidades') or 0
+        cmv_val = agg_detalles.get('cmv') or 0
+        cmv = Decimal(str(cmv_val))
+
+    perfil.marca('kpis')
 
     ganancia_bruta = ingreso_total - cmv
     ticket_promedio = (ingreso_total / num_transacciones) if num_transacciones > 0 else Decimal('0.00')
     unidades_promedio = (total_unidades / num_transacciones) if num_transacciones > 0 else 0
 
-    best_selling = VentaDetalle.objects.filter(venta__in=ventas_qs) \
-        .values('producto__nombre') \
-        .annotate(total_cantidad=Sum('cantidad')) \
-        .order_by('-total_cantidad') \
-        .first()
+    top_selling_products = list(
+        detalles_qs
+        .values('producto__nombre')
+        .annotate(total_cantidad=Sum('cantidad'))
+        .order_by('-total_cantidad')[:max(top, 1)]
+    )
+    best_selling = top_selling_products[0] if top_selling_products else None
     best_selling_product = best_selling['producto__nombre'] if best_selling else "N/A"
     best_selling_quantity = best_selling['total_cantidad'] if best_selling else 0
 
-    sales_by_payment_type = ventas_qs.values('forma_pago').annotate(total_monto=Sum('total'))
+    if resumen_qs is not None:
+        sales_by_payment_type = resumen_qs.values('forma_pago').annotate(total_monto=Sum('ingreso')).order_by('forma_pago')
+    else:
+        sales_by_payment_type = ventas_qs.values('forma_pago').annotate(total_monto=Sum('total'))
     sales_by_payment = []
     sales_by_payment_chart = []
     for item in sales_by_payment_type:
@@ -78,122 +397,40 @@ def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_f
     ganancia_neta = ingreso_sin_iva - cost_net
     margen = ((ganancia_neta / ingreso_sin_iva) * Decimal('100')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if ingreso_sin_iva > 0 else Decimal('0.00')
 
-    # Serie diaria (cacheada)
-    cache_key_daily = _safe_cache_key("daily_series", fecha_inicio, fecha_fin, cajero_filter, sucursal_filter)
-    daily_series = cache.get(cache_key_daily)
-    if daily_series is None:
-        daily_series = ventas_qs.extra({'day': "DATE(fecha)"}).values('day').annotate(ingreso=Sum('total')).order_by('day')
-        cache.set(cache_key_daily, list(daily_series), 300)
-    daily_chart = []
-    for row in daily_series:
-        day_raw = row.get('day')
-        day_date = None
-        if isinstance(day_raw, datetime.datetime):
-            day_date = day_raw.date()
-        elif isinstance(day_raw, datetime.date):
-            day_date = day_raw
-        elif isinstance(day_raw, str):
-            for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
-                try:
-                    day_date = datetime.datetime.strptime(day_raw[:19], fmt).date()
-                    break
-                except ValueError:
-                    continue
-        if not day_date:
-            continue
-        ingreso_dia = row.get('ingreso') or Decimal('0.00')
-        detalles_dia = VentaDetalle.objects.filter(venta__fecha__date=day_date, venta__in=ventas_qs)
-        costo_dia = Decimal('0.00')
-        for det in detalles_dia:
-            costo_dia += (det.producto.precio_compra or Decimal('0.00')) * det.cantidad
-        ingreso_sin_iva_dia = (ingreso_dia / Decimal('1.19')).quantize(Decimal('0.01')) if ingreso_dia else Decimal('0.00')
-        costo_sin_iva_dia = (costo_dia / Decimal('1.19')).quantize(Decimal('0.01')) if costo_dia else Decimal('0.00')
-        ganancia_neta_dia = ingreso_sin_iva_dia - costo_sin_iva_dia
-        # Formatear y agregar
-        day_str = day_date.strftime('%Y-%m-%d')
-        daily_chart.append({'day': day_str, 'ingreso': float(ingreso_dia), 'ganancia_neta': float(ganancia_neta_dia)})
-
-    # Comparación por sucursal (cacheada)
-    cache_key_branch = _safe_cache_key("branch_comp", fecha_inicio, fecha_fin, cajero_filter, sucursal_filter)
-    branch_comparison = cache.get(cache_key_branch)
-    if branch_comparison is None:
-        branch_comparison = []
-        for suc in Sucursal.objects.all():
-            ventas_suc = ventas_qs.filter(sucursal_id=suc.id)
-            ingreso_suc = ventas_suc.aggregate(t=Sum('total'))['t'] or Decimal('0.00')
-            detalles_suc = VentaDetalle.objects.filter(venta__in=ventas_suc)
-            costo_suc = Decimal('0.00')
-            for det in detalles_suc:
-                costo_suc += (det.producto.precio_compra or Decimal('0.00')) * det.cantidad
-            ingreso_sin_iva_suc = (ingreso_suc / Decimal('1.19')).quantize(Decimal('0.01')) if ingreso_suc else Decimal('0.00')
-            costo_sin_iva_suc = (costo_suc / Decimal('1.19')).quantize(Decimal('0.01')) if costo_suc else Decimal('0.00')
-            ganancia_neta_suc = ingreso_sin_iva_suc - costo_sin_iva_suc
-            branch_comparison.append({'sucursal': suc.nombre, 'ingreso': float(ingreso_suc), 'ganancia_neta': float(ganancia_neta_suc)})
-        cache.set(cache_key_branch, branch_comparison, 300)
+    # Ingreso y costo por día local, sucursal y mes: un GROUP BY por serie (sin recorrer detalles)
+    por_mes = ingreso_costo_por('mes', ventas_qs, detalles_qs, resumen_qs)
+    por_mes = {(mes.year, mes.month): valores for mes, valores in por_mes.items() if mes}
+
+    # Serie diaria
+    daily_chart = [
+        {'day': dia, 'ingreso': float(ingreso), 'ganancia_neta': float(ganancia)}
+        for dia, ingreso, ganancia in serie_diaria(ventas_qs, detalles_qs, resumen_qs)
+    ]
+
+    # Comparación por sucursal
+    branch_comparison = [
+        {'sucursal': nombre, 'ingreso': float(ingreso), 'ganancia_neta': float(ganancia)}
+        for nombre, ingreso, ganancia in comparacion_sucursales(ventas_qs, detalles_qs, resumen_qs)
+    ]
+
+    perfil.marca('series')
 
     # Distribución horaria y heatmap
-    hourly_distribution = [{'hora': h, 'ventas': 0, 'ingreso': 0.0} for h in range(24)]
-    heatmap_matrix = [[{'ventas':0,'ingreso':0.0} for _ in range(24)] for _ in range(7)]
-    for v in ventas_qs:
-        h = v.fecha.hour
-        hourly_distribution[h]['ventas'] += 1
-        hourly_distribution[h]['ingreso'] += float(v.total or 0)
-        dow = v.fecha.weekday()
-        cell = heatmap_matrix[dow][h]
-        cell['ventas'] += 1
-        cell['ingreso'] += float(v.total or 0)
-
-    # Rentabilidad productos (cacheada parcialmente)
-    cache_key_rent = _safe_cache_key("rentabilidad", fecha_inicio, fecha_fin, cajero_filter, sucursal_filter)
-    rentabilidad_productos = cache.get(cache_key_rent)
-    if rentabilidad_productos is None:
-        detalles_rango = VentaDetalle.objects.filter(venta__in=ventas_qs).select_related('producto')
-        tmp = {}
-        for det in detalles_rango:
-            pid = det.producto_id
-            venta_unit = det.precio_unitario or Decimal('0.00')
-            compra_unit = det.producto.precio_compra or Decimal('0.00')
-            venta_sin_iva_unit = (venta_unit / Decimal('1.19')).quantize(Decimal('0.01')) if venta_unit else Decimal('0.00')
-            compra_sin_iva_unit = (compra_unit / Decimal('1.19')).quantize(Decimal('0.01')) if compra_unit else Decimal('0.00')
-            ganancia_neta_unit = venta_sin_iva_unit - compra_sin_iva_unit
-            entry = tmp.get(pid)
-            if not entry:
-                entry = {'producto': det.producto.nombre or det.producto.producto_id, 'cantidad':0,'ingreso_neto_total':Decimal('0.00'),'costo_neto_total':Decimal('0.00'),'ganancia_neta_total':Decimal('0.00')}
-            entry['cantidad'] += det.cantidad
-            entry['ingreso_neto_total'] += venta_sin_iva_unit * det.cantidad
-            entry['costo_neto_total'] += compra_sin_iva_unit * det.cantidad
-            entry['ganancia_neta_total'] += ganancia_neta_unit * det.cantidad
-            tmp[pid] = entry
-        rentabilidad_productos = []
-        for _, data in tmp.items():
-            porcentaje = Decimal('0.00')
-            if data['ingreso_neto_total'] > 0:
-                porcentaje = (data['ganancia_neta_total'] / data['ingreso_neto_total'] * Decimal('100')).quantize(Decimal('0.01'))
-            rentabilidad_productos.append({
-                'producto': data['producto'],
-                'cantidad': data['cantidad'],
-                'ingreso_neto_total': float(data['ingreso_neto_total']),
-                'costo_neto_total': float(data['costo_neto_total']),
-                'ganancia_neta_total': float(data['ganancia_neta_total']),
-                'porcentaje_ganancia': float(porcentaje)
-            })
-        rentabilidad_productos.sort(key=lambda x: x['ganancia_neta_total'], reverse=True)
-        cache.set(cache_key_rent, rentabilidad_productos, 300)
-
-    ranking_cajeros_map = {}
-    for v in ventas_qs.select_related('empleado'):
-        uid = v.empleado_id
-        entry = ranking_cajeros_map.get(uid)
-        if not entry:
-            entry = {'usuario': v.empleado.username, 'ventas_count':0, 'ingreso_total':Decimal('0.00')}
-        entry['ventas_count'] += 1
-        entry['ingreso_total'] += v.total or Decimal('0.00')
-        ranking_cajeros_map[uid] = entry
-    ranking_cajeros = []
-    for _, data in ranking_cajeros_map.items():
-        ticket_prom = (data['ingreso_total'] / data['ventas_count']).quantize(Decimal('0.01')) if data['ventas_count'] else Decimal('0.00')
-        ranking_cajeros.append({'usuario': data['usuario'], 'ventas_count': data['ventas_count'], 'ingreso_total': float(data['ingreso_total']), 'ticket_promedio': float(ticket_prom)})
-    ranking_cajeros.sort(key=lambda x: x['ingreso_total'], reverse=True)
+    hourly_distribution, heatmap_matrix = distribucion_horaria(ventas_qs)
+    perfil.marca('heatmap')
+
+    # Rentabilidad productos
+    rentabilidad_productos = [
+        {**fila, **{k: float(fila[k]) for k in ('ingreso_neto_total', 'costo_neto_total', 'ganancia_neta_total', 'porcentaje_ganancia')}}
+        for fila in rentabilidad_por_producto(detalles_qs)
+    ]
+    perfil.marca('rentabilidad')
+
+    ranking_cajeros = [
+        {'usuario': usuario, 'ventas_count': ventas, 'ingreso_total': float(ingreso), 'ticket_promedio': float(ticket)}
+        for usuario, ventas, ingreso, ticket in ranking_por_cajero(ventas_qs, resumen_qs)
+    ]
+    perfil.marca('ranking')
 
     # Wave últimos 6 meses (ganancia neta mensual)
     months_wave = []
@@ -202,33 +439,29 @@ def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_f
     for i in range(5, -1, -1):
         start_month = (today - datetime.timedelta(days=30*i))
         first_day = start_month.replace(day=1)
-        next_month = (first_day + datetime.timedelta(days=32)).replace(day=1)
-        last_day = next_month - datetime.timedelta(days=1)
-        ventas_mes = ventas_qs.filter(fecha__date__gte=first_day, fecha__date__lte=last_day)
-        ingreso_mes = ventas_mes.aggregate(t=Sum('total'))['t'] or Decimal('0.00')
-        detalles_mes = VentaDetalle.objects.filter(venta__in=ventas_mes)
-        costo_mes = Decimal('0.00')
-        for det in detalles_mes:
-            costo_mes += (det.producto.precio_compra or Decimal('0.00')) * det.cantidad
-        ingreso_sin_iva_mes = (ingreso_mes / Decimal('1.19')).quantize(Decimal('0.01')) if ingreso_mes else Decimal('0.00')
-        costo_sin_iva_mes = (costo_mes / Decimal('1.19')).quantize(Decimal('0.01')) if costo_mes else Decimal('0.00')
-        ganancia_neta_mes = ingreso_sin_iva_mes - costo_sin_iva_mes
+        ganancia_neta_mes = _ganancia_neta(por_mes.get((first_day.year, first_day.month), _VACIO))
         months_wave.append(first_day.strftime('%b %Y'))
         gains_wave.append(float(ganancia_neta_mes))
 
-    # Periodo anterior comparativo
-    rango_dias = (fecha_fin - fecha_inicio).days + 1
-    prev_fin = fecha_inicio - datetime.timedelta(days=1)
-    prev_inicio = prev_fin - datetime.timedelta(days=rango_dias - 1)
-    ventas_prev = Venta.objects.filter(fecha__gte=prev_inicio, fecha__lte=prev_fin)
-    ingreso_prev = ventas_prev.aggregate(t=Sum('total'))['t'] or Decimal('0.00')
+    # Periodo comparativo: rango personalizado (con los mismos filtros) o periodo anterior automático
+    comparativo_custom = bool(comparativo_inicio and comparativo_fin and comparativo_inicio <= comparativo_fin)
+    if comparativo_custom:
+        prev_inicio, prev_fin = comparativo_inicio, comparativo_fin
+        ventas_prev = _aplicar_filtros(Venta.objects.filter(fecha__gte=prev_inicio, fecha__lte=prev_fin), cajero_filter, sucursal_filter)
+    else:
+        rango_dias = (fecha_fin - fecha_inicio).days + 1
+        prev_fin = fecha_inicio - datetime.timedelta(days=1)
+        prev_inicio = prev_fin - datetime.timedelta(days=rango_dias - 1)
+        ventas_prev = Venta.objects.filter(fecha__gte=prev_inicio, fecha__lte=prev_fin)
+    agg_prev = ventas_prev.aggregate(t=Sum('total'), n=Count('id'))
+    ingreso_prev = agg_prev['t'] or Decimal('0.00')
     detalles_prev = VentaDetalle.objects.filter(venta__in=ventas_prev)
-    cmv_prev_val = detalles_prev.aggregate(cmv_prev=Sum(F('cantidad') * F('producto__precio_compra')))['cmv_prev'] or 0
+    cmv_prev_val = detalles_prev.aggregate(cmv_prev=_costo_detalles())['cmv_prev'] or 0
     cmv_prev = Decimal(str(cmv_prev_val))
     ingreso_sin_iva_prev = (ingreso_prev / Decimal('1.19')).quantize(Decimal('0.01')) if ingreso_prev else Decimal('0.00')
     costo_prev_net = (cmv_prev / Decimal('1.19')).quantize(Decimal('0.01')) if cmv_prev else Decimal('0.00')
     ganancia_neta_prev = ingreso_sin_iva_prev - costo_prev_net
-    num_transacciones_prev = ventas_prev.count()
+    num_transacciones_prev = agg_prev['n'] or 0
 
     def delta_pct(current: Decimal, previous: Decimal):
         delta = (current - previous)
@@ -243,6 +476,9 @@ def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_f
     transacciones_delta, transacciones_pct = delta_pct(Decimal(num_transacciones), Decimal(num_transacciones_prev))
     margen_prev = ((ganancia_neta_prev / ingreso_sin_iva_prev) * Decimal('100')).quantize(Decimal('0.01')) if ingreso_sin_iva_prev > 0 else Decimal('0.00')
     margen_delta, margen_pct = delta_pct(margen, margen_prev)
+    participacion_ingreso = (ingreso_prev / ingreso_total * Decimal('100')).quantize(Decimal('0.01')) if ingreso_total else Decimal('0.00')
+    participacion_ganancia = (ganancia_neta_prev / ganancia_neta * Decimal('100')).quantize(Decimal('0.01')) if ganancia_neta else Decimal('0.00')
+    perfil.marca('comparativo')
 
     return {
         'ingreso_total': ingreso_total,
@@ -257,6 +493,7 @@ def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_f
         'unidades_promedio': unidades_promedio,
         'best_selling_product': best_selling_product,
         'best_selling_quantity': best_selling_quantity,
+        'top_selling_products': top_selling_products[:top] if top > 0 else [],
         'sales_by_payment': sales_by_payment,
         'sales_by_payment_chart': sales_by_payment_chart,
         'daily_chart': daily_chart,
@@ -282,4 +519,7 @@ def compute_analytics(fecha_inicio, fecha_fin, cajero_filter='todos', sucursal_f
         'transacciones_pct': transacciones_pct,
         'margen_delta': margen_delta,
         'margen_pct': margen_pct,
+        'participacion_ingreso': participacion_ingreso,
+        'participacion_ganancia': participacion_ganancia,
+        'comparativo_custom': comparativo_custom,
     }
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
+
+    def ready(self):
+        import reports.signals  # Mantiene el resumen diario de ventas
+        import reports.tareas  # Registra las exportaciones en segundo plano (app jobs)
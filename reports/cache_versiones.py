@@ -0,0 +1,91 @@
+"""
+Espacios de nombres versionados para la caché de reportes.
+
+Cada (sucursal, día local) tiene un contador de versión en la caché compartida
+(CACHES['default']); además existe el espacio '*' por día, usado por las consultas
+sin filtro de sucursal. Las claves de analytics incluyen las versiones de todos los
+días que cubren, así que una venta nueva sólo invalida los resultados que incluyen su
+día (y su sucursal), sin recorrer ni borrar claves. Los resultados viejos expiran por
+TTL.
+
+También lleva contadores de aciertos/fallos compartidos entre workers.
+"""
+import datetime
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+TODAS = '*'
+
+_STATS = ('hits', 'misses')
+
+
+def _clave_version(sucursal, dia):
+    return f'reports:v:{sucursal}:{dia.isoformat()}'
+
+
+def _nueva_version():
+    # Valor inicial no reutilizable: si la clave se pierde (eviction, reinicio) no revive resultados viejos
+    return time.time_ns()
+
+
+def dias_locales(inicio, fin):
+    """Días locales (TIME_ZONE) entre dos datetimes aware, ambos inclusive."""
+    dia, ultimo = timezone.localdate(inicio), timezone.localdate(fin)
+    dias = []
+    while dia <= ultimo:
+        dias.append(dia)
+        dia += datetime.timedelta(days=1)
+    return dias
+
+
+def firma(tramos):
+    """Hash de las versiones actuales de los tramos [(sucursal|'*', dia)], para usar dentro de una clave."""
+    claves = sorted({_clave_version(s, d) for s, d in tramos})
+    if not claves:
+        return '-'
+    versiones = cache.get_many(claves)
+    faltantes = {k: _nueva_version() for k in claves if k not in versiones}
+    if faltantes:
+        cache.set_many(faltantes, timeout=None)
+        versiones.update(faltantes)
+    raw = '|'.join(f'{k}={versiones[k]}' for k in claves)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _subir(clave):
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, _nueva_version(), timeout=None)
+
+
+def invalidar(dia, sucursal_id):
+    """Sube la versión del día para la sucursal y para el espacio sin filtro."""
+    if sucursal_id is not None:
+        _subir(_clave_version(sucursal_id, dia))
+    _subir(_clave_version(TODAS, dia))
+
+
+def registrar(acierto):
+    clave = f"reports:stats:{'hits' if acierto else 'misses'}"
+    cache.add(clave, 0, timeout=None)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        pass
+
+
+def estadisticas():
+    valores = cache.get_many([f'reports:stats:{s}' for s in _STATS])
+    hits = valores.get('reports:stats:hits', 0)
+    misses = valores.get('reports:stats:misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else 0.0,
+        'backend': cache.__class__.__name__,
+    }
@@ -0,0 +1,74 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from cashier.models import AperturaCierreCaja, Venta
+from cashier.services import agregados_caja
+from products.libro import ultimo_corte
+from products.models import Product
+from reports.analytics import querysets_periodo
+from reports.valorizacion import valorizacion
+from sucursales.models import Sucursal
+
+
+def _consultas(dias):
+    """[(nombre, queryset)] de las consultas frecuentes de reportes y caja, con valores reales de la base."""
+    fin = timezone.now()
+    inicio = fin - datetime.timedelta(days=dias)
+    sucursal = Sucursal.objects.order_by('id').first()
+    sucursal_id = sucursal.id if sucursal else 0
+    usuario_id = get_user_model().objects.order_by('id').values_list('id', flat=True).first() or 0
+    caja_id = AperturaCierreCaja.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    codigo = Product.objects.exclude(codigo_barras=None).values_list('codigo_barras', flat=True).first() or ''
+
+    ventas_qs, detalles_qs, _ = querysets_periodo(inicio, fin)
+    ventas_suc_qs, _, _ = querysets_periodo(inicio, fin, sucursal_filter=str(sucursal_id))
+    consultas = [
+        ('reports: KPIs del periodo', ventas_qs.values('forma_pago').annotate(total=Sum('total'))),
+        ('reports: periodo por sucursal', ventas_suc_qs.values('empleado_id').annotate(total=Sum('total'))),
+        ('reports: rentabilidad por producto', detalles_qs.values('producto_id').annotate(unidades=Sum('cantidad'))),
+        ('reports: historial de ventas (primera página)', Venta.objects.order_by('-fecha', '-id')[:9]),
+        ('reports: historial de ventas por empleado', Venta.objects.filter(empleado_id=usuario_id).order_by('-fecha', '-id')[:9]),
+        ('reports: historial de cajas', AperturaCierreCaja.objects.order_by('-apertura')[:10]),
+        ('cashier: caja abierta del vendedor', AperturaCierreCaja.objects.filter(vendedor_id=usuario_id, estado='abierta')[:1]),
+        ('cashier: resumen de caja', Venta.objects.filter(caja_id=caja_id).values('caja_id').annotate(**agregados_caja()).order_by()),
+        ('products: código de barras', Product.objects.filter(codigo_barras=codigo)[:1]),
+        ('products: listado por nombre', Product.objects.order_by('nombre')[:20]),
+    ]
+    corte = ultimo_corte()
+    if corte:
+        consultas.append(('reports: valorización de inventario por sucursal', valorizacion(corte)))
+    if sucursal:
+        consultas.append((
+            'products: listado de sucursal',
+            Product.objects.de_sucursal(sucursal).con_stock_en(sucursal).order_by('nombre')[:20],
+        ))
+    return consultas
+
+
+class Command(BaseCommand):
+    help = "Print EXPLAIN plans for the main report and cashier queries so missing indexes and full scans are visible."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dias", type=int, default=30, help="Report period length in days (default: 30)")
+        parser.add_argument("--analyze", action="store_true", help="Run the queries (EXPLAIN ANALYZE, PostgreSQL only)")
+        parser.add_argument("--filtro", default="", help="Only explain queries whose name contains this text")
+
+    def handle(self, dias=30, analyze=False, filtro='', **options):
+        if dias <= 0:
+            raise CommandError("--dias must be a positive number of days.")
+        opciones = {}
+        if analyze:
+            if connection.vendor != 'postgresql':
+                raise CommandError("--analyze is only supported on PostgreSQL.")
+            opciones = {'analyze': True, 'buffers': True}
+        for nombre, queryset in _consultas(dias):
+            if filtro.lower() not in nombre.lower():
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            self.stdout.write(queryset.explain(**opciones))
+            self.stdout.write("")
@@ -0,0 +1,84 @@
+# Generated by Django 5.0.7 on 2026-10-18 04:25
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def poblar_resumen(apps, schema_editor):
+    """Genera el resumen diario a partir de las ventas existentes (sólo modelos históricos)."""
+    Venta = apps.get_model('cashier', 'Venta')
+    VentaDetalle = apps.get_model('cashier', 'VentaDetalle')
+    ResumenVentaDiaria = apps.get_model('reports', 'ResumenVentaDiaria')
+    clave = ('dia', 'sucursal_id', 'empleado_id', 'forma_pago')
+    filas = {}
+    por_venta = (
+        Venta.objects.annotate(dia=TruncDate('fecha'))
+        .values(*clave)
+        .annotate(ingreso=Sum('total'), tickets=Count('id'))
+        .order_by()
+    )
+    for r in por_venta:
+        filas[tuple(r[c] for c in clave)] = {
+            'ingreso': r['ingreso'] or Decimal('0.00'), 'costo': Decimal('0.00'), 'unidades': 0, 'tickets': r['tickets'],
+        }
+    por_detalle = (
+        VentaDetalle.objects.values(
+            dia=TruncDate('venta__fecha'),
+            sucursal_id=F('venta__sucursal_id'),
+            empleado_id=F('venta__empleado_id'),
+            forma_pago=F('venta__forma_pago'),
+        )
+        .annotate(unidades=Sum('cantidad'), costo=Sum(F('cantidad') * F('producto__precio_compra')))
+        .order_by()
+    )
+    for r in por_detalle:
+        fila = filas.setdefault(tuple(r[c] for c in clave), {
+            'ingreso': Decimal('0.00'), 'costo': Decimal('0.00'), 'unidades': 0, 'tickets': 0,
+        })
+        fila['unidades'] = r['unidades'] or 0
+        fila['costo'] = Decimal(str(r['costo'] or 0)).quantize(Decimal('0.01'))
+    ResumenVentaDiaria.objects.bulk_create(
+        [ResumenVentaDiaria(**dict(zip(clave, k)), **valores) for k, valores in filas.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashier', '0005_unique_open_caja_per_sucursal'),
+        ('reports', '0003_initial'),
+        ('sucursales', '0002_sucursal_low_stock_threshold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenVentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('forma_pago', models.CharField(max_length=20)),
+                ('ingreso', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('costo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('tickets', models.PositiveIntegerField(default=0)),
+                ('empleado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_venta', to=settings.AUTH_USER_MODEL)),
+                ('sucursal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_venta', to='sucursales.sucursal')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Venta Diaria',
+                'verbose_name_plural': 'Resúmenes de Venta Diaria',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='resumenventadiaria',
+            constraint=models.UniqueConstraint(fields=('dia', 'sucursal', 'empleado', 'forma_pago'), name='reports_resumen_diario_clave'),
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
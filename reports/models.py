@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 class Sucursal(models.Model):
@@ -8,3 +9,29 @@ class Sucursal(models.Model):
     def __str__(self):
         return self.nombre
 
+
+
+class ResumenVentaDiaria(models.Model):
+    """Agregado diario de ventas por (día, sucursal, empleado, forma de pago) para los reportes.
+
+    Se mantiene desde cashier (señales de Venta/VentaDetalle y el checkout); ver reports/rollup.py.
+    El costo se valoriza con el precio de compra vigente al momento de actualizar el día.
+    """
+    dia = models.DateField()
+    sucursal = models.ForeignKey('sucursales.Sucursal', on_delete=models.CASCADE, related_name='resumenes_venta', blank=True, null=True)
+    empleado = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='resumenes_venta')
+    forma_pago = models.CharField(max_length=20)
+    ingreso = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    costo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unidades = models.PositiveIntegerField(default=0)
+    tickets = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Resumen de Venta Diaria"
+        verbose_name_plural = "Resúmenes de Venta Diaria"
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'sucursal', 'empleado', 'forma_pago'], name='reports_resumen_diario_clave'),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} {self.sucursal_id}/{self.empleado_id}/{self.forma_pago}: {self.ingreso}"
@@ -0,0 +1,154 @@
+"""
+Resumen diario de ventas (ResumenVentaDiaria).
+
+Cada fila agrega las ventas de un día local (TIME_ZONE) por sucursal, empleado y forma
+de pago. El checkout suma su venta con un UPDATE incremental; cualquier otra escritura
+sobre Venta/VentaDetalle (admin, ediciones, borrados) recalcula sólo los "tramos"
+(día, sucursal) afectados desde las tablas crudas, una vez por transacción al confirmarla.
+El costo sale de VentaDetalle.costo_unitario (precio de compra al vender), así que cambiar
+precios de compra no altera el resumen. `rebuild_sales_rollup` reconstruye un rango completo.
+"""
+import datetime
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from cashier.models import Venta, VentaDetalle
+from .models import ResumenVentaDiaria
+
+CLAVE = ('dia', 'sucursal_id', 'empleado_id', 'forma_pago')
+
+_estado = threading.local()
+
+
+@contextmanager
+def resumen_suspendido():
+    """Desactiva el mantenimiento por señales en el hilo actual (checkout y borrados masivos)."""
+    previo = getattr(_estado, 'suspendido', False)
+    _estado.suspendido = True
+    try:
+        yield
+    finally:
+        _estado.suspendido = previo
+
+
+def esta_suspendido():
+    return getattr(_estado, 'suspendido', False)
+
+
+def limites_dia(dia):
+    """(inicio, fin) aware del día local: [inicio, fin)."""
+    inicio = timezone.make_aware(datetime.datetime.combine(dia, datetime.time.min))
+    return inicio, timezone.make_aware(datetime.datetime.combine(dia + datetime.timedelta(days=1), datetime.time.min))
+
+
+def filas_agrupadas(ventas_qs, detalles_qs):
+    """Agrupa ventas y detalles crudos por CLAVE. Retorna {clave: {'ingreso','costo','unidades','tickets'}}.
+
+    `detalles_qs` debe corresponder a las mismas ventas que `ventas_qs`.
+    """
+    filas = {}
+    por_venta = (
+        ventas_qs.annotate(dia=TruncDate('fecha'))
+        .values(*CLAVE)
+        .annotate(ingreso=Sum('total'), tickets=Count('id'))
+        .order_by()
+    )
+    for r in por_venta:
+        filas[tuple(r[c] for c in CLAVE)] = {
+            'ingreso': r['ingreso'] or Decimal('0.00'),
+            'costo': Decimal('0.00'),
+            'unidades': 0,
+            'tickets': r['tickets'],
+        }
+    por_detalle = (
+        detalles_qs.values(
+            dia=TruncDate('venta__fecha'),
+            sucursal_id=F('venta__sucursal_id'),
+            empleado_id=F('venta__empleado_id'),
+            forma_pago=F('venta__forma_pago'),
+        )
+        .annotate(unidades=Sum('cantidad'), costo=Sum(F('cantidad') * F('costo_unitario')))
+        .order_by()
+    )
+    for r in por_detalle:
+        fila = filas.setdefault(tuple(r[c] for c in CLAVE), {
+            'ingreso': Decimal('0.00'), 'costo': Decimal('0.00'), 'unidades': 0, 'tickets': 0,
+        })
+        fila['unidades'] = r['unidades'] or 0
+        fila['costo'] = Decimal(str(r['costo'] or 0)).quantize(Decimal('0.01'))
+    return filas
+
+
+def _crear_filas(filas, modelo=ResumenVentaDiaria, batch_size=1000):
+    modelo.objects.bulk_create(
+        [modelo(**dict(zip(CLAVE, clave)), **valores) for clave, valores in filas.items()],
+        batch_size=batch_size,
+    )
+
+
+def recalcular_tramo(dia, sucursal_id):
+    """Recalcula desde las tablas crudas las filas de un día y sucursal."""
+    inicio, fin = limites_dia(dia)
+    ventas = Venta.objects.filter(fecha__gte=inicio, fecha__lt=fin, sucursal_id=sucursal_id)
+    filas = filas_agrupadas(ventas, VentaDetalle.objects.filter(venta__in=ventas))
+    with transaction.atomic():
+        ResumenVentaDiaria.objects.filter(dia=dia, sucursal_id=sucursal_id).delete()
+        _crear_filas(filas)
+
+
+def reconstruir(desde=None, hasta=None, batch_size=1000):
+    """Reconstruye el resumen para el rango de días locales [desde, hasta] (todo el historial si son None).
+
+    Retorna la cantidad de filas generadas.
+    """
+    ventas = Venta.objects.all()
+    resumen = ResumenVentaDiaria.objects.all()
+    if desde:
+        ventas = ventas.filter(fecha__gte=limites_dia(desde)[0])
+        resumen = resumen.filter(dia__gte=desde)
+    if hasta:
+        ventas = ventas.filter(fecha__lt=limites_dia(hasta)[1])
+        resumen = resumen.filter(dia__lte=hasta)
+    filas = filas_agrupadas(ventas, VentaDetalle.objects.filter(venta__in=ventas))
+    with transaction.atomic():
+        resumen.delete()
+        _crear_filas(filas, batch_size=batch_size)
+    return len(filas)
+
+
+@transaction.atomic
+def eliminar_ventas():
+    """Borra todas las ventas y el resumen diario completo, sin recalcular tramo por tramo."""
+    with resumen_suspendido():
+        Venta.objects.all().delete()
+    ResumenVentaDiaria.objects.all().delete()
+
+
+def sumar_venta(venta, unidades, costo):
+    """Suma incrementalmente una venta nueva a su fila (usado por el checkout dentro de su transacción)."""
+    clave = {
+        'dia': timezone.localdate(venta.fecha),
+        'sucursal_id': venta.sucursal_id,
+        'empleado_id': venta.empleado_id,
+        'forma_pago': venta.forma_pago,
+    }
+    incrementos = {
+        'ingreso': F('ingreso') + venta.total,
+        'costo': F('costo') + costo,
+        'unidades': F('unidades') + unidades,
+        'tickets': F('tickets') + 1,
+    }
+    if ResumenVentaDiaria.objects.filter(**clave).update(**incrementos):
+        return
+    try:
+        with transaction.atomic():
+            ResumenVentaDiaria.objects.create(**clave, ingreso=venta.total, costo=costo, unidades=unidades, tickets=1)
+    except IntegrityError:
+        # Otra transacción creó la fila entre medio
+        ResumenVentaDiaria.objects.filter(**clave).update(**incrementos)
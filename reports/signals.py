@@ -0,0 +1,108 @@
+# reports/signals.py
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from cashier.models import Venta, VentaDetalle
+from . import cache_versiones
+from .rollup import esta_suspendido, recalcular_tramo
+
+LOTE_VENTAS = 500
+
+_pendientes = threading.local()
+
+
+def _tramo(fecha, sucursal_id):
+    return (timezone.localdate(fecha), sucursal_id) if fecha else None
+
+
+def _invalidar_cache(tramos):
+    # Tras el commit, para que otro worker no vuelva a cachear datos previos a la venta
+    tramos = list(tramos)
+    transaction.on_commit(lambda: [cache_versiones.invalidar(*t) for t in tramos])
+
+
+class _Recalculo:
+    """Tramos afectados en la transacción en curso; se recalculan una sola vez al confirmarla.
+
+    Un borrado en cascada (producto, usuario, sucursal) dispara una señal por fila; así cada
+    (día, sucursal) se recalcula una vez en lugar de una vez por venta o detalle.
+    """
+
+    def __init__(self):
+        self.tramos, self.ventas = set(), set()
+        self.ejecutado = False
+
+    def __call__(self):
+        self.ejecutado = True
+        tramos, ventas = self.tramos, list(self.ventas)
+        # Los detalles sólo aportan su venta: el tramo se resuelve aquí en lotes. Las ventas ya
+        # borradas no aparecen, pero su propia señal de borrado registró el tramo.
+        for i in range(0, len(ventas), LOTE_VENTAS):
+            filas = Venta.objects.filter(pk__in=ventas[i:i + LOTE_VENTAS]).values_list('fecha', 'sucursal_id')
+            tramos.update(_tramo(fecha, sucursal_id) for fecha, sucursal_id in filas)
+        tramos.discard(None)
+        with transaction.atomic():
+            for tramo in tramos:
+                recalcular_tramo(*tramo)
+        for tramo in tramos:
+            cache_versiones.invalidar(*tramo)
+
+
+def _programar(tramos=(), ventas=()):
+    recalculo = getattr(_pendientes, 'recalculo', None)
+    registrados = transaction.get_connection().run_on_commit
+    # Se reutiliza mientras siga pendiente en esta transacción; si ya se ejecutó o se descartó
+    # con un rollback (de la transacción o de su savepoint) se registra uno nuevo
+    if recalculo is not None and not recalculo.ejecutado and any(func is recalculo for _, func, *_ in registrados):
+        recalculo.tramos.update(tramos)
+        recalculo.ventas.update(ventas)
+        return
+    recalculo = _pendientes.recalculo = _Recalculo()
+    recalculo.tramos.update(tramos)
+    recalculo.ventas.update(ventas)
+    # Fuera de una transacción se ejecuta de inmediato
+    transaction.on_commit(recalculo)
+
+
+@receiver(post_init, sender=Venta)
+def recordar_tramo_venta(sender, instance, **kwargs):
+    # Tramo original, para recalcular también el anterior si la venta cambia de día o sucursal
+    instance._tramo_resumen = _tramo(instance.fecha, instance.sucursal_id)
+
+
+@receiver(post_save, sender=Venta)
+def actualizar_resumen_venta(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    actual = _tramo(instance.fecha, instance.sucursal_id)
+    anterior = getattr(instance, '_tramo_resumen', None)
+    tramos = {actual, anterior} - {None}
+    if esta_suspendido():
+        # El checkout suma su venta al resumen por su cuenta; sólo falta invalidar la caché
+        _invalidar_cache(tramos)
+    else:
+        _programar(tramos)
+    instance._tramo_resumen = actual
+
+
+@receiver(post_delete, sender=Venta)
+def descontar_resumen_venta(sender, instance, **kwargs):
+    tramo = _tramo(instance.fecha, instance.sucursal_id)
+    if not tramo:
+        return
+    if esta_suspendido():
+        _invalidar_cache([tramo])
+    else:
+        _programar([tramo])
+
+
+@receiver(post_save, sender=VentaDetalle)
+@receiver(post_delete, sender=VentaDetalle)
+def actualizar_resumen_detalle(sender, instance, raw=False, **kwargs):
+    if raw or esta_suspendido():
+        return
+    _programar(ventas=[instance.venta_id])
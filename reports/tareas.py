@@ -0,0 +1,77 @@
+"""
+Tareas en segundo plano de reportes (app jobs): exportaciones PDF/DOCX del reporte avanzado.
+
+Las ejecuta `manage.py run_jobs`; así la conversión con aspose o la construcción del
+documento no bloquean un worker de gunicorn. Los parámetros son los de
+analytics.parametros_de_filtros.
+"""
+import io
+
+from django.template.loader import render_to_string
+
+from jobs.registry import tarea
+from .analytics import filtros_desde_params, obtener_analytics
+
+
+@tarea('reporte_avanzado_pdf')
+def reporte_avanzado_pdf(parametros):
+    """Reporte avanzado completo a PDF usando la misma data y un template html compacto."""
+    from .views import ASPose_AVAILABLE, HtmlLoadOptions, PdfDocument, format_clp
+    if not ASPose_AVAILABLE:
+        raise RuntimeError("Exportación a PDF no disponible en este servidor (falta dependencia aspose-pdf).")
+    filtros = filtros_desde_params(parametros)
+    analytics = obtener_analytics(filtros)
+    context = {
+        'fecha_inicio': filtros['fecha_inicio'].strftime('%Y-%m-%d'),
+        'fecha_fin': filtros['fecha_fin'].strftime('%Y-%m-%d'),
+        'ingreso_total': "$" + format_clp(analytics['ingreso_total']),
+        'ingreso_total_sin_iva': "$" + format_clp(analytics['ingreso_total_sin_iva']),
+        'iva_total': "$" + format_clp(analytics['iva_total_calc']),
+        'ganancia_neta': "$" + format_clp(analytics['ganancia_neta']),
+        'ganancia_bruta': "$" + format_clp(analytics['ganancia_bruta']),
+        'costo_total': "$" + format_clp(analytics['costo_total']),
+        'num_transacciones': analytics['num_transacciones'],
+        'ticket_promedio': "$" + format_clp(analytics['ticket_promedio']),
+        'unidades_promedio': analytics['unidades_promedio'],
+        'ranking_cajeros': analytics['ranking_cajeros'],
+        'rentabilidad_productos': analytics['rentabilidad_productos'],
+        'top_selling_products': analytics['top_selling_products'],
+    }
+    html = render_to_string('reports/export/advanced_pdf.html', context)
+    pdf = PdfDocument(io.BytesIO(html.encode('utf-8')), HtmlLoadOptions())
+    out = io.BytesIO()
+    pdf.save(out)
+    return 'reporte_avanzado.pdf', 'application/pdf', out.getvalue()
+
+
+@tarea('reporte_avanzado_docx')
+def reporte_avanzado_docx(parametros):
+    """Resumen del reporte avanzado a DOCX."""
+    from .views import DocxDocument, format_clp
+    filtros = filtros_desde_params(parametros)
+    analytics = obtener_analytics(filtros)
+    doc = DocxDocument()
+    doc.add_heading('Reporte Avanzado', 0)
+    doc.add_paragraph(f"Rango: {filtros['fecha_inicio'].strftime('%Y-%m-%d')} a {filtros['fecha_fin'].strftime('%Y-%m-%d')}")
+    doc.add_heading('KPIs', level=1)
+    doc.add_paragraph(f"Ingreso total: ${format_clp(analytics['ingreso_total'])}")
+    doc.add_paragraph(f"Venta sin IVA: ${format_clp(analytics['ingreso_total_sin_iva'])}")
+    doc.add_paragraph(f"IVA recaudado: ${format_clp(analytics['iva_total_calc'])}")
+    doc.add_paragraph(f"Ganancia neta: ${format_clp(analytics['ganancia_neta'])}")
+    doc.add_paragraph(f"Ganancia bruta: ${format_clp(analytics['ganancia_bruta'])}")
+    doc.add_paragraph(f"Costo total (CMV): ${format_clp(analytics['costo_total'])}")
+    doc.add_paragraph(f"Transacciones: {analytics['num_transacciones']}")
+    doc.add_paragraph(f"Ticket promedio: ${format_clp(analytics['ticket_promedio'])}")
+    doc.add_paragraph(f"Unidades promedio/venta: {analytics['unidades_promedio']}")
+    doc.add_heading('Top Productos', level=1)
+    for item in analytics['top_selling_products']:
+        doc.add_paragraph(f"{item['producto__nombre']}: {item['total_cantidad']}")
+    doc.add_heading('Ranking de Cajeros', level=1)
+    for r in analytics['ranking_cajeros']:
+        doc.add_paragraph(f"{r['usuario']}: ventas={r['ventas_count']}, ingreso=${format_clp(r['ingreso_total'])}")
+    doc.add_heading('Rentabilidad de Productos (Top 50)', level=1)
+    for r in analytics['rentabilidad_productos']:
+        doc.add_paragraph(f"{r['producto']}: ganancia_neta=${format_clp(r['ganancia_neta_total'])} ({r['porcentaje_ganancia']}%)")
+    out = io.BytesIO()
+    doc.save(out)
+    return 'reporte_avanzado.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', out.getvalue()
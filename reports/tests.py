@@ -38,6 +38,9 @@ from django.contrib.auth import get_user_model
 from sucursales.models import Sucursal
 from cashier.models import Venta, VentaDetalle
 from products.models import Product
+from django.db.models import Sum
+import io
+import json
 from .analytics import compute_analytics
 
 User = get_user_model()
@@ -50,13 +53,14 @@ class AnalyticsComputationTests(TestCase):
 		self.prod_a = Product.objects.create(producto_id='A1', nombre='Prod A', precio_compra=Decimal('1000'), precio_venta=Decimal('2000'))
 		self.prod_b = Product.objects.create(producto_id='B1', nombre='Prod B', precio_compra=Decimal('500'), precio_venta=Decimal('1500'))
 		now = timezone.now()
-		# Venta 1 (hace 2 días)
-		v1 = Venta.objects.create(empleado=self.user, sucursal=self.suc, fecha=now - datetime.timedelta(days=2), total=Decimal('2000'), forma_pago='efectivo')
-		VentaDetalle.objects.create(venta=v1, producto=self.prod_a, cantidad=1, precio_unitario=Decimal('2000'))
-		# Venta 2 (ayer)
-		v2 = Venta.objects.create(empleado=self.user, sucursal=self.suc, fecha=now - datetime.timedelta(days=1), total=Decimal('3000'), forma_pago='debito')
-		VentaDetalle.objects.create(venta=v2, producto=self.prod_a, cantidad=1, precio_unitario=Decimal('2000'))
-		VentaDetalle.objects.create(venta=v2, producto=self.prod_b, cantidad=2, precio_unitario=Decimal('500'))
+		with self.captureOnCommitCallbacks(execute=True):
+			# Venta 1 (hace 2 días)
+			v1 = Venta.objects.create(empleado=self.user, sucursal=self.suc, fecha=now - datetime.timedelta(days=2), total=Decimal('2000'), forma_pago='efectivo')
+			VentaDetalle.objects.create(venta=v1, producto=self.prod_a, cantidad=1, precio_unitario=Decimal('2000'))
+			# Venta 2 (ayer)
+			v2 = Venta.objects.create(empleado=self.user, sucursal=self.suc, fecha=now - datetime.timedelta(days=1), total=Decimal('3000'), forma_pago='debito')
+			VentaDetalle.objects.create(venta=v2, producto=self.prod_a, cantidad=1, precio_unitario=Decimal('2000'))
+			VentaDetalle.objects.create(venta=v2, producto=self.prod_b, cantidad=2, precio_unitario=Decimal('500'))
 		self.fecha_inicio = (now - datetime.timedelta(days=5)).replace(hour=0, minute=0, second=0, microsecond=0)
 		self.fecha_fin = now
 
@@ -205,3 +209,458 @@ class AnalyticsComputationTests(TestCase):
 		payload2 = resp2.json()
 		self.assertIn('top_selling_products', payload2)
 		self.assertLessEqual(len(payload2['top_selling_products']), 2)
+
+
+class ResumenVentaDiariaTests(TestCase):
+	def setUp(self):
+		from tests.factories import create_user, create_product, make_sale, open_caja
+		self.user = create_user('resumen_admin', is_staff=True)
+		self.suc = Sucursal.objects.create(nombre='Resumen')
+		self.prod = create_product('R1', 'Prod R', precio_compra=Decimal('300'), precio_venta=Decimal('1000'), sucursal=self.suc, stock=50)
+		self.otro = create_product('R2', 'Prod S', precio_compra=Decimal('123.45'), precio_venta=Decimal('777'), sucursal=self.suc, stock=50)
+		with self.captureOnCommitCallbacks(execute=True):
+			make_sale(self.user, self.suc, [(self.prod, 2), (self.otro, 1)], forma_pago='efectivo')
+			make_sale(self.user, self.suc, [(self.otro, 3)], forma_pago='debito')
+		self.caja = open_caja(self.user, self.suc)
+		self.client.force_login(self.user)
+		resp = self.client.post('/cashier/', data=json.dumps({
+			'carrito': [{'producto_id': self.prod.id, 'cantidad': 1}, {'producto_id': self.otro.id, 'cantidad': 2}],
+			'forma_pago': 'efectivo', 'cliente_paga': '100000', 'caja_id': self.caja.id,
+		}), content_type='application/json')
+		self.assertEqual(resp.status_code, 200, resp.content)
+		hoy = timezone.localdate()
+		self.inicio = timezone.make_aware(datetime.datetime.combine(hoy - datetime.timedelta(days=2), datetime.time.min))
+		self.fin = timezone.make_aware(datetime.datetime.combine(hoy, datetime.time.min)) + datetime.timedelta(days=1, seconds=-1)
+
+	def _comparables(self, data):
+		claves = ('ingreso_total', 'num_transacciones', 'costo_total', 'ganancia_neta', 'margen', 'unidades_promedio',
+			'branch_comparison', 'ranking_cajeros', 'wave_gains')
+		resultado = {k: data[k] for k in claves}
+		resultado['sales_by_payment'] = sorted((p['forma_pago'], p['total_monto_raw']) for p in data['sales_by_payment'])
+		return resultado
+
+	def test_resumen_coincide_con_tablas_crudas(self):
+		from .models import ResumenVentaDiaria
+		self.assertEqual(ResumenVentaDiaria.objects.aggregate(t=Sum('tickets'))['t'], 3)
+		with self.settings(REPORTS_USE_ROLLUP=False):
+			crudo = compute_analytics(self.inicio, self.fin)
+		with self.settings(REPORTS_USE_ROLLUP=True):
+			resumen = compute_analytics(self.inicio, self.fin)
+		self.assertEqual(self._comparables(resumen), self._comparables(crudo))
+		self.assertEqual(resumen['ingreso_total'], Decimal('2000') + Decimal('777') * 4 + Decimal('1000') + Decimal('777') * 2)
+
+	def test_costo_no_cambia_con_el_precio_de_compra(self):
+		antes = compute_analytics(self.inicio, self.fin)
+		self.prod.precio_compra = Decimal('9999')
+		self.prod.save()
+		with self.settings(REPORTS_USE_ROLLUP=False):
+			crudo = compute_analytics(self.inicio, self.fin)
+		with self.settings(REPORTS_USE_ROLLUP=True):
+			resumen = compute_analytics(self.inicio, self.fin)
+		# Resumen, tablas crudas y rentabilidad usan el costo registrado al vender
+		self.assertEqual(crudo['costo_total'], antes['costo_total'])
+		self.assertEqual(self._comparables(resumen), self._comparables(crudo))
+		self.assertEqual(crudo['rentabilidad_productos'], antes['rentabilidad_productos'])
+
+	def test_reconstruir_y_borrar(self):
+		from django.core.management import call_command
+		from .models import ResumenVentaDiaria
+		antes = list(ResumenVentaDiaria.objects.order_by('forma_pago').values('forma_pago', 'ingreso', 'costo', 'unidades', 'tickets'))
+		call_command('rebuild_sales_rollup', stdout=io.StringIO())
+		despues = list(ResumenVentaDiaria.objects.order_by('forma_pago').values('forma_pago', 'ingreso', 'costo', 'unidades', 'tickets'))
+		self.assertEqual(antes, despues)
+		with self.captureOnCommitCallbacks(execute=True):
+			Venta.objects.filter(forma_pago='debito').delete()
+		self.assertFalse(ResumenVentaDiaria.objects.filter(forma_pago='debito').exists())
+
+	def test_limpiar_historial_ventas_no_recalcula_por_venta(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from django.urls import reverse
+		from .models import ResumenVentaDiaria
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.post(reverse('reports:limpiar_historial_ventas'))
+		self.assertEqual(resp.json(), {'success': True})
+		self.assertFalse(Venta.objects.exists())
+		self.assertFalse(ResumenVentaDiaria.objects.exists())
+		# Un único DELETE del resumen completo, sin recalcular tramos
+		consultas = [q['sql'] for q in ctx.captured_queries if 'reports_resumenventadiaria' in q['sql']]
+		self.assertEqual(len(consultas), 1)
+
+	def test_borrar_producto_recalcula_cada_tramo_una_vez(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from tests.factories import create_product, make_sale
+		from .models import ResumenVentaDiaria
+		from .rollup import reconstruir
+
+		def borrar(codigo, lineas):
+			prod = create_product(codigo, f'Prod {codigo}', precio_compra=Decimal('10'), precio_venta=Decimal('100'))
+			with self.captureOnCommitCallbacks(execute=True):
+				for _ in range(lineas):
+					make_sale(self.user, self.suc, [(prod, 1), (self.otro, 1)])
+			with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+				prod.delete()
+			return len(ctx.captured_queries)
+
+		pocas = borrar('RD1', 2)
+		muchas = borrar('RD2', 8)
+		# El borrado en cascada de las líneas no recalcula el resumen una vez por línea
+		self.assertEqual(pocas, muchas)
+		campos = ('dia', 'empleado_id', 'forma_pago', 'ingreso', 'costo', 'unidades', 'tickets')
+		antes = list(ResumenVentaDiaria.objects.order_by('forma_pago').values(*campos))
+		reconstruir()
+		self.assertEqual(antes, list(ResumenVentaDiaria.objects.order_by('forma_pago').values(*campos)))
+
+
+class AnalyticsQueryCountTests(TestCase):
+	def setUp(self):
+		from tests.factories import create_user, create_product
+		self.user = create_user('queries_admin', is_staff=True)
+		self.suc = Sucursal.objects.create(nombre='Queries')
+		self.prod = create_product('Q1', 'Prod Q', precio_compra=Decimal('450.50'), precio_venta=Decimal('1000'))
+		self.fin = timezone.now()
+
+	def _venta_en(self, dias_atras):
+		from tests.factories import make_sale
+		venta = make_sale(self.user, self.suc, [(self.prod, 2)])
+		fecha = timezone.localtime(self.fin).replace(hour=12, minute=0) - datetime.timedelta(days=dias_atras)
+		Venta.objects.filter(pk=venta.pk).update(fecha=fecha)
+
+	def _queries(self):
+		from django.db import connection
+		from django.core.cache import cache
+		from django.test.utils import CaptureQueriesContext
+		cache.clear()
+		with self.settings(REPORTS_USE_ROLLUP=False), CaptureQueriesContext(connection) as ctx:
+			data = compute_analytics(self.fin - datetime.timedelta(days=90), self.fin)
+		return len(ctx.captured_queries), data
+
+	def test_queries_no_dependen_de_los_dias(self):
+		self._venta_en(1)
+		pocas, _ = self._queries()
+		for dias in range(2, 60, 3):
+			self._venta_en(dias)
+		muchas, data = self._queries()
+		self.assertEqual(pocas, muchas)
+		self.assertEqual(len(data['daily_chart']), 21)
+		ganancia_dia = (Decimal('2000') / Decimal('1.19')).quantize(Decimal('0.01')) - (Decimal('901.00') / Decimal('1.19')).quantize(Decimal('0.01'))
+		self.assertTrue(all(d['ganancia_neta'] == float(ganancia_dia) for d in data['daily_chart']))
+
+	def test_distribucion_horaria_en_hora_local(self):
+		from .analytics import distribucion_horaria
+		from tests.factories import make_sale
+		# Miércoles 15:30 hora local (TIME_ZONE), sin importar el offset UTC
+		local = timezone.make_aware(datetime.datetime(2026, 3, 4, 15, 30))
+		for _ in range(2):
+			venta = make_sale(self.user, self.suc, [(self.prod, 1)])
+			Venta.objects.filter(pk=venta.pk).update(fecha=local)
+		hourly, heatmap = distribucion_horaria(Venta.objects.all())
+		self.assertEqual(hourly[15], {'hora': 15, 'ventas': 2, 'ingreso': 2000.0})
+		self.assertEqual(heatmap[2][15], {'ventas': 2, 'ingreso': 2000.0})
+		self.assertEqual(sum(c['ventas'] for fila in heatmap for c in fila), 2)
+
+	def test_vistas_calculan_analytics_una_vez_por_filtros(self):
+		from unittest import mock
+		from django.core.cache import cache
+		from django.urls import reverse
+		from . import analytics as analytics_mod
+		self._venta_en(1)
+		cache.clear()
+		self.client.force_login(self.user)
+		params = {'fecha_inicio': (self.fin - datetime.timedelta(days=7)).strftime('%Y-%m-%d'), 'fecha_fin': self.fin.strftime('%Y-%m-%d')}
+		with mock.patch.object(analytics_mod, 'compute_analytics', wraps=analytics_mod.compute_analytics) as calc:
+			resp = self.client.get(reverse('reports:advanced_reports_data'), params)
+			self.assertEqual(resp.status_code, 200)
+			self.assertIn('queries_total', resp.json()['profiling'])
+			self.client.get(reverse('reports:advanced_reports_data'), params)
+			self.client.get(reverse('reports:advanced_reports'), params)
+		self.assertEqual(calc.call_count, 1)
+
+	def test_comparativo_personalizado_respeta_filtros(self):
+		from .analytics import compute_analytics
+		from tests.factories import make_sale
+		otra = Sucursal.objects.create(nombre='Otra')
+		self._venta_en(10)
+		venta = make_sale(self.user, otra, [(self.prod, 5)])
+		Venta.objects.filter(pk=venta.pk).update(fecha=self.fin - datetime.timedelta(days=10))
+		data = compute_analytics(
+			self.fin - datetime.timedelta(days=2), self.fin, sucursal_filter=str(self.suc.id),
+			comparativo_inicio=self.fin - datetime.timedelta(days=12), comparativo_fin=self.fin - datetime.timedelta(days=8),
+		)
+		self.assertTrue(data['comparativo_custom'])
+		self.assertEqual(data['ingreso_prev'], Decimal('2000'))
+		self.assertEqual(data['num_transacciones_prev'], 1)
+
+
+class CacheAnalyticsVersionadaTests(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		cache.clear()
+		self.user = create_user('cache_admin', is_staff=True)
+		self.suc_a = Sucursal.objects.create(nombre='Cache A')
+		self.suc_b = Sucursal.objects.create(nombre='Cache B')
+		self.prod = create_product('CA1', 'Prod Cache', precio_compra=Decimal('100'), precio_venta=Decimal('1000'))
+
+	def _filtros(self, **params):
+		from django.test import RequestFactory
+		from .analytics import filtros_desde_request
+		return filtros_desde_request(RequestFactory().get('/', params))
+
+	def _vender(self, sucursal):
+		with self.captureOnCommitCallbacks(execute=True):
+			make_sale(self.user, sucursal, [(self.prod, 1)])
+
+	def test_venta_invalida_solo_su_sucursal(self):
+		from .analytics import obtener_analytics
+		solo_a = self._filtros(sucursal=str(self.suc_a.id))
+		todas = self._filtros()
+		self.assertEqual(obtener_analytics(solo_a)['num_transacciones'], 0)
+		obtener_analytics(todas)
+		self.assertTrue(obtener_analytics(solo_a)['profiling'].get('cache'))
+
+		self._vender(self.suc_b)
+		self.assertTrue(obtener_analytics(solo_a)['profiling'].get('cache'))
+		data = obtener_analytics(todas)
+		self.assertFalse(data['profiling'].get('cache'))
+		self.assertEqual(data['num_transacciones'], 1)
+
+		self._vender(self.suc_a)
+		data = obtener_analytics(solo_a)
+		self.assertFalse(data['profiling'].get('cache'))
+		self.assertEqual(data['num_transacciones'], 1)
+
+	def test_estadisticas_de_aciertos(self):
+		from django.urls import reverse
+		from .analytics import obtener_analytics
+		filtros = self._filtros()
+		obtener_analytics(filtros)
+		obtener_analytics(filtros)
+		obtener_analytics(filtros)
+		self.client.force_login(self.user)
+		stats = self.client.get(reverse('reports:analytics_cache_stats')).json()
+		self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+
+class ExportacionesCsvTests(TestCase):
+	def setUp(self):
+		self.user = create_user('export_admin', is_staff=True)
+		self.suc_a = Sucursal.objects.create(nombre='Export A')
+		self.suc_b = Sucursal.objects.create(nombre='Export B')
+		self.prod = create_product('EX1', 'Prod Export', precio_compra=Decimal('119'), precio_venta=Decimal('1190'))
+		with self.captureOnCommitCallbacks(execute=True):
+			make_sale(self.user, self.suc_a, [(self.prod, 2)])
+			make_sale(self.user, self.suc_a, [(self.prod, 1)])
+			make_sale(self.user, self.suc_b, [(self.prod, 5)])
+		self.client.force_login(self.user)
+
+	def _filas(self, resp):
+		self.assertTrue(resp.streaming)
+		contenido = b''.join(resp.streaming_content)
+		if resp.get('Content-Encoding') == 'gzip':
+			import gzip
+			contenido = gzip.decompress(contenido)
+		texto = contenido.decode('utf-8')
+		self.assertTrue(texto.startswith('\ufeff'))
+		return [linea.split(';') for linea in texto.lstrip('\ufeff').splitlines()]
+
+	def test_rentabilidad_agregada_y_filtrada(self):
+		from django.urls import reverse
+		resp = self.client.get(reverse('reports:export_rentabilidad_csv'), {'sucursal': str(self.suc_a.id)})
+		filas = self._filas(resp)
+		self.assertEqual(filas[0][0], 'Producto')
+		# 3 unidades a 1000 neto de venta y 100 neto de costo
+		self.assertEqual(filas[1:], [['Prod Export', '3', '3000.00', '300.00', '2700.00', '90.00']])
+
+	def test_gzip_opcional(self):
+		from django.urls import reverse
+		url = reverse('reports:export_ranking_cajeros_csv')
+		plano = self._filas(self.client.get(url))
+		resp = self.client.get(url, {'gzip': '1'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+		self.assertEqual(resp['Content-Encoding'], 'gzip')
+		self.assertEqual(self._filas(resp), plano)
+		self.assertEqual(plano[1][:3], ['export_admin', '3', '9520'])
+		# Sin Accept-Encoding gzip se envía sin comprimir
+		self.assertFalse(self.client.get(url, {'gzip': '1'}).has_header('Content-Encoding'))
+
+
+class HistorialCajaTests(TestCase):
+	def setUp(self):
+		self.user = create_user('historial_admin', is_staff=True)
+		self.prod = create_product('HC1', 'Prod Historial', precio_compra=Decimal('100'), precio_venta=Decimal('1000'))
+		self.client.force_login(self.user)
+		# Primera request: registra la actividad para que las medidas no incluyan esa escritura
+		self.client.get('/healthz')
+
+	def _caja_con_ventas(self, cantidad, cerrar=False):
+		from tests.factories import close_caja
+		suc = create_sucursal(f'Historial {AperturaCierreCaja.objects.count()}')
+		caja = open_caja(self.user, suc)
+		make_sale(self.user, suc, [(self.prod, cantidad)], caja=caja)
+		if cerrar:
+			close_caja(caja)
+		return caja
+
+	def _get(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from django.urls import reverse
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(reverse('reports:historial_caja'), {'per_page': 20})
+		self.assertEqual(resp.status_code, 200)
+		return resp, len(ctx.captured_queries)
+
+	def test_totales_por_caja_aunque_el_cajero_se_superponga(self):
+		# El mismo cajero con dos cajas abiertas a la vez: cada una muestra sólo sus ventas
+		self._caja_con_ventas(2)
+		self._caja_con_ventas(3)
+		self._caja_con_ventas(7, cerrar=True)
+		resp, _ = self._get()
+		totales = sorted(c.formatted_ventas_totales for c in resp.context['cajas'])
+		self.assertEqual(totales, ['$2.000', '$3.000', '$7.000'])
+
+	def test_consultas_constantes_por_pagina(self):
+		self._caja_con_ventas(1)
+		self._caja_con_ventas(1, cerrar=True)
+		_, pocas = self._get()
+		for i in range(6):
+			self._caja_con_ventas(i + 1, cerrar=bool(i % 2))
+		_, muchas = self._get()
+		self.assertEqual(pocas, muchas)
+
+
+class HistorialVentasKeysetTests(TestCase):
+	def setUp(self):
+		self.user = create_user('keyset_admin', is_staff=True)
+		self.suc = create_sucursal('Keyset')
+		self.prod = create_product('KS1', 'Prod Keyset', precio_compra=Decimal('100'), precio_venta=Decimal('1000'))
+		ahora = timezone.now()
+		for i in range(20):
+			venta = make_sale(self.user, self.suc, [(self.prod, 1)])
+			# Grupos de ventas con la misma fecha para probar el desempate por id
+			Venta.objects.filter(pk=venta.pk).update(fecha=ahora - datetime.timedelta(minutes=i // 3))
+		self.client.force_login(self.user)
+		# Primera request: registra la actividad para que las medidas no incluyan esa escritura
+		self.client.get('/healthz')
+
+	def _pagina(self, query=''):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from django.urls import reverse
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(reverse('reports:sales_history') + query)
+		self.assertEqual(resp.status_code, 200)
+		return resp.context['sales'], len(ctx.captured_queries)
+
+	def test_recorre_todas_las_paginas_en_orden(self):
+		esperado = list(Venta.objects.order_by('-fecha', '-id').values_list('id', flat=True))
+		pagina, consultas_primera = self._pagina()
+		self.assertEqual(pagina.total, 20)
+		vistas, paginas = [], [pagina]
+		while True:
+			vistas += [v.id for v in pagina]
+			if not pagina.has_next:
+				break
+			pagina, consultas = self._pagina(pagina.url_siguiente)
+			paginas.append(pagina)
+		self.assertEqual(vistas, esperado)
+		self.assertEqual([len(p) for p in paginas], [8, 8, 4])
+		# Las páginas profundas no hacen más consultas que la primera
+		self.assertEqual(consultas, consultas_primera)
+		# Volver atrás desde la última página devuelve la página anterior completa
+		anterior, _ = self._pagina(paginas[-1].url_anterior)
+		self.assertEqual([v.id for v in anterior], [v.id for v in paginas[1]])
+		self.assertTrue(anterior.has_previous)
+
+	def test_cursor_conserva_filtros_y_cursor_invalido_muestra_primera_pagina(self):
+		pagina, _ = self._pagina(f'?empleado={self.user.id}')
+		self.assertIn(f'empleado={self.user.id}', pagina.url_siguiente)
+		pagina, _ = self._pagina('?cursor=no-valido')
+		self.assertFalse(pagina.has_previous)
+		self.assertEqual(len(pagina), 8)
+
+
+class ExplainQueriesCommandTests(TestCase):
+	def test_imprime_planes_de_las_consultas_frecuentes(self):
+		from django.core.management import call_command
+		create_sucursal('Explain')
+		salida = io.StringIO()
+		call_command('explain_queries', filtro='cashier', stdout=salida)
+		texto = salida.getvalue()
+		self.assertIn('cashier: caja abierta del vendedor', texto)
+		self.assertIn('cashier_caja_vend_estado', texto)
+		self.assertNotIn('reports: historial de cajas', texto)
+
+
+class ValorizacionInventarioTests(TestCase):
+	def setUp(self):
+		import datetime
+		from django.core.management import call_command
+		from django.utils import timezone
+		from products.libro import tomar_corte
+		from products.models import MovimientoStock, StockSucursal
+		from products.stock import ajustar, transferir
+		self.user = create_user('valor_admin', is_staff=True)
+		self.suc_a = Sucursal.objects.create(nombre='Valor A')
+		self.suc_b = Sucursal.objects.create(nombre='Valor B')
+		self.p1 = create_product('VAL1', 'Prod Valor 1', precio_compra=Decimal('100'), precio_venta=Decimal('500'))
+		self.p2 = create_product('VAL2', 'Prod Valor 2', precio_compra=Decimal('250'), precio_venta=Decimal('900'))
+		StockSucursal.objects.create(producto=self.p1, sucursal=self.suc_a, cantidad=10)
+		StockSucursal.objects.create(producto=self.p2, sucursal=self.suc_a, cantidad=4)
+		StockSucursal.objects.create(producto=self.p1, sucursal=self.suc_b, cantidad=2)
+		hoy = timezone.localdate()
+		self.dia1, self.dia2 = hoy - datetime.timedelta(days=3), hoy - datetime.timedelta(days=1)
+		# Corte de apertura al cierre del día 1 y movimientos durante el día 2
+		corte = tomar_corte()
+		corte.fecha = timezone.make_aware(datetime.datetime.combine(self.dia1, datetime.time(23, 59, 59)))
+		corte.save(update_fields=['fecha'])
+		ajustar(self.suc_a, {self.p1.id: 5})
+		transferir(self.suc_a, self.suc_b, {self.p2.id: 1})
+		MovimientoStock.objects.update(fecha=timezone.make_aware(datetime.datetime.combine(self.dia2, datetime.time(12))))
+		call_command('snapshot_stock', '--dia', self.dia2.isoformat(), stdout=io.StringIO())
+		# El corte conserva el costo vigente al tomarlo
+		self.p1.precio_compra = Decimal('999')
+		self.p1.save()
+		self.client.force_login(self.user)
+		self.client.get('/healthz')
+
+	def _filas(self, resp):
+		self.assertTrue(resp.streaming)
+		texto = b''.join(resp.streaming_content).decode('utf-8')
+		return [linea.split(';') for linea in texto.lstrip('\ufeff').splitlines()]
+
+	def test_valor_por_sucursal_entre_dos_fechas(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from django.urls import reverse
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(reverse('reports:inventory_valuation'), {'desde': self.dia1.isoformat(), 'hasta': self.dia2.isoformat()})
+		self.assertEqual(resp.status_code, 200)
+		filas = {f['sucursal__nombre']: f for f in resp.context['filas']}
+		self.assertEqual((filas['Valor A']['unidades_desde'], filas['Valor A']['valor_desde']), (14, Decimal('2000')))
+		self.assertEqual((filas['Valor A']['unidades_hasta'], filas['Valor A']['valor_hasta']), (18, Decimal('2250')))
+		self.assertEqual(filas['Valor B']['variacion_valor'], Decimal('250'))
+		self.assertEqual(resp.context['totales']['valor_hasta'], Decimal('2700'))
+		self.assertContains(resp, '$2.700')
+		consultas = [q['sql'] for q in ctx.captured_queries if 'products_saldocorte' in q['sql']]
+		self.assertEqual(len(consultas), 1)
+
+	def test_csv_por_producto_en_streaming(self):
+		from django.urls import reverse
+		resp = self.client.get(reverse('reports:export_inventory_valuation_csv'), {'desde': self.dia1.isoformat(), 'hasta': self.dia2.isoformat()})
+		filas = self._filas(resp)
+		self.assertEqual(filas[0][:2], ['Codigo', 'Producto'])
+		self.assertEqual(filas[1:], [
+			['VAL1', 'Prod Valor 1', '12', '1200.00', '17', '1700.00', '5', '500.00'],
+			['VAL2', 'Prod Valor 2', '4', '1000.00', '4', '1000.00', '0', '0.00'],
+		])
+		por_sucursal = self._filas(self.client.get(reverse('reports:export_inventory_valuation_csv'), {
+			'hasta': self.dia2.isoformat(), 'nivel': 'sucursal', 'sucursal': str(self.suc_b.id),
+		}))
+		self.assertEqual(por_sucursal[1:], [['Valor B', '0', '0.00', '3', '450.00', '3', '450.00']])
+
+	def test_sin_corte_a_la_fecha(self):
+		from django.urls import reverse
+		resp = self.client.get(reverse('reports:export_inventory_valuation_csv'), {'hasta': '2000-01-01'})
+		self.assertEqual(resp.status_code, 404)
+		self.assertContains(self.client.get(reverse('reports:inventory_valuation'), {'hasta': '2000-01-01'}), 'No hay cortes de stock')
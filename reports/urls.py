@@ -17,7 +17,10 @@ urlpatterns = [
     path('advanced/export/comparacion_sucursal.csv', views.export_branch_comparison_csv, name='export_branch_comparison_csv'),
     path('advanced/export/full.pdf', views.export_advanced_pdf, name='export_advanced_pdf'),
     path('advanced/export/full.docx', views.export_advanced_docx, name='export_advanced_docx'),
+    path('inventory/valuation/', views.inventory_valuation, name='inventory_valuation'),
+    path('inventory/valuation.csv', views.export_inventory_valuation_csv, name='export_inventory_valuation_csv'),
     path('advanced/data/', views.advanced_reports_data, name='advanced_reports_data'),
+    path('advanced/cache/stats/', views.analytics_cache_stats, name='analytics_cache_stats'),
     path('limpiar_historial/', views.limpiar_historial_caja, name='limpiar_historial_caja'),
     path('limpiar_historial_ventas/', views.limpiar_historial_ventas, name='limpiar_historial_ventas'),
 ]
@@ -21,6 +21,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
     let tipoVenta = "boleta";
     let formaPago = "efectivo";
+    // El carrito vive en el navegador; el servidor sólo lo revalida (/cashier/cotizar/) y lo registra al confirmar
     let carrito = new Map();
     let totalCarrito = 0;
 
@@ -134,65 +135,95 @@ document.addEventListener("DOMContentLoaded", () => {
     resultsList.addEventListener("click", (e) => {
         const button = e.target.closest("button");
         if (button) {
-            const { id, stock, allow } = button.dataset;
+            const { id, nombre, precio, stock, allow } = button.dataset;
             if (String(allow) === "false" && parseInt(stock) <= 0) {
                 showToast("Producto agotado en esta sucursal.", "warning");
                 return;
             }
-            agregarAlCarrito(parseInt(id));
+            agregarAlCarrito({
+                id: parseInt(id),
+                nombre: nombre,
+                precio_venta: precio,
+                stock: parseInt(stock),
+                permitir_venta_sin_stock: String(allow) !== "false"
+            });
         }
     });
 
-    async function agregarAlCarrito(productoId) {
-        try {
-            const res = await fetch("/cashier/agregar-al-carrito/", {
-                method: "POST",
-                credentials: "same-origin",
-                headers: {
-                    "Content-Type": "application/json",
-                    "X-CSRFToken": getCSRFToken(),
-                    "X-Requested-With": "XMLHttpRequest"
-                },
-                body: JSON.stringify({ producto_id: productoId, caja_id: cajaId })
-            });
-            const ct = res.headers.get('content-type') || '';
-            const text = await res.text();
-            console.log("Respuesta del servidor:", text);
-            if (!ct.includes('application/json')) {
-                // Muestra un snippet útil; típicamente 403 CSRF devuelve HTML
-                const snippet = text ? text.substring(0, 200) + '...' : `HTTP ${res.status}`;
-                console.error('[cashier] non-json response from /cashier/agregar-al-carrito/', { status: res.status, snippet, full: text });
-                showToast(`Error ${res.status}: ${snippet}`, 'danger');
-                return;
-            }
-            let data;
-            try { data = JSON.parse(text); } catch (err) {
-                showToast('Respuesta inválida del servidor', 'danger');
-                return;
-            }
-            if (!res.ok || data.error) {
-                showToast(data.error || `HTTP ${res.status}`, 'danger');
-                return;
-            }
-            showToast(data.mensaje || "Producto agregado al carrito", "success");
-            if (data.carrito) {
-                carrito.clear();
-                data.carrito.forEach(item => {
-                    carrito.set(item.producto_id, {
-                        producto_id: item.producto_id,
-                        nombre: item.nombre,
-                        precio: parseFloat(item.precio),
-                        cantidad: item.cantidad,
-                        stock: (typeof item.stock !== 'undefined') ? item.stock : undefined,
-                        permitir_venta_sin_stock: (typeof item.permitir_venta_sin_stock !== 'undefined') ? item.permitir_venta_sin_stock : true
-                    });
-                });
-                actualizarCarrito();
-            }
-        } catch (err) {
-            console.error("Error en la petición fetch:", err);
-            showToast('No se pudo contactar al servidor', 'danger');
+    function agregarAlCarrito(producto) {
+        const item = carrito.get(producto.id);
+        const cantidad = item ? item.cantidad + 1 : 1;
+        const permitir = producto.permitir_venta_sin_stock !== false;
+        if (!permitir && cantidad > producto.stock) {
+            showToast("Stock insuficiente para este producto.", "warning");
+            return;
+        }
+        carrito.set(producto.id, {
+            producto_id: producto.id,
+            nombre: producto.nombre,
+            precio: parseFloat(producto.precio_venta),
+            cantidad: cantidad,
+            stock: producto.stock,
+            permitir_venta_sin_stock: permitir
+        });
+        showToast("Producto agregado al carrito", "success");
+        actualizarCarrito();
+    }
+
+    function ajustarCantidad(productoId, delta) {
+        const item = carrito.get(productoId);
+        if (!item) return;
+        const cantidad = item.cantidad + delta;
+        if (cantidad <= 0) {
+            carrito.delete(productoId);
+        } else if (delta > 0 && !item.permitir_venta_sin_stock && cantidad > item.stock) {
+            showToast("Stock insuficiente para este producto.", "warning");
+            return;
+        } else {
+            item.cantidad = cantidad;
         }
+        actualizarCarrito();
+    }
+
+    // Revalida precios y stock de todo el carrito en una sola petición (sin escrituras).
+    // Retorna true si todas las líneas se pueden vender.
+    async function cotizarCarrito() {
+        const res = await fetch("/cashier/cotizar/", {
+            method: "POST",
+            credentials: "same-origin",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": getCSRFToken()
+            },
+            body: JSON.stringify({
+                carrito: Array.from(carrito.values()).map(({ producto_id, cantidad }) => ({ producto_id, cantidad })),
+                caja_id: cajaId
+            })
+        });
+        const data = await res.json();
+        if (!res.ok || data.error) {
+            showToast(data.error || `HTTP ${res.status}`, "danger");
+            return false;
+        }
+        const totalAnterior = totalCarrito;
+        data.items.forEach(item => {
+            const local = carrito.get(item.producto_id);
+            if (!local || typeof item.precio === "undefined") return;
+            local.nombre = item.nombre;
+            local.precio = parseFloat(item.precio);
+            local.stock = item.stock;
+            local.permitir_venta_sin_stock = item.permitir_venta_sin_stock;
+        });
+        actualizarCarrito();
+        const conError = data.items.find(item => item.error);
+        if (conError) {
+            showToast(conError.error, "danger");
+            return false;
+        }
+        if (totalCarrito !== totalAnterior) {
+            showToast("Se actualizaron los precios del carrito.", "warning");
+        }
+        return true;
     }
 
     function actualizarCarrito() {
@@ -229,46 +260,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const productoId = parseInt(targetButton.dataset.id);
         const action = targetButton.dataset.action;
         const delta = action === 'increment' ? 1 : -1;
-        // Sincronizar con el servidor para evitar que ítems "vuelvan" al agregar otros
-        fetch("/cashier/ajustar-cantidad/", {
-            method: "POST",
-            credentials: "same-origin",
-            headers: {
-                "Content-Type": "application/json",
-                "X-CSRFToken": getCSRFToken()
-            },
-            body: JSON.stringify({ producto_id: productoId, cantidad: delta, caja_id: cajaId })
-        })
-        .then(async (res) => {
-            const ct = res.headers.get('content-type') || '';
-            const text = await res.text();
-            let data;
-            if (ct.includes('application/json')) {
-                try { data = JSON.parse(text); } catch { data = { error: 'Respuesta inválida del servidor' }; }
-            } else {
-                data = { error: `HTTP ${res.status} - ${text.substring(0, 200)}...` };
-            }
-            if (!res.ok || data.error) {
-                throw new Error(data.error || `HTTP ${res.status}`);
-            }
-            // Rehidratar carrito desde servidor
-            carrito.clear();
-            (data.carrito || []).forEach(item => {
-                carrito.set(item.producto_id, {
-                    producto_id: item.producto_id,
-                    nombre: item.nombre,
-                    precio: parseFloat(item.precio),
-                    cantidad: item.cantidad,
-                    stock: (typeof item.stock !== 'undefined') ? item.stock : undefined,
-                    permitir_venta_sin_stock: (typeof item.permitir_venta_sin_stock !== 'undefined') ? item.permitir_venta_sin_stock : true
-                });
-            });
-            actualizarCarrito();
-        })
-        .catch(err => {
-            console.error('Error al ajustar cantidad:', err);
-            showToast(err && err.message ? err.message : 'Error al ajustar cantidad', 'danger');
-        });
+        ajustarCantidad(productoId, delta);
     });
 
     document.querySelectorAll("[data-sale-type]").forEach(btn => {
@@ -322,11 +314,18 @@ document.addEventListener("DOMContentLoaded", () => {
         });
     });
 
-    confirmarCompraButton.addEventListener("click", () => {
+    confirmarCompraButton.addEventListener("click", async () => {
         if (carrito.size === 0) {
             showToast("El carrito está vacío", "warning");
             return;
         }
+        try {
+            if (!(await cotizarCarrito())) return;
+        } catch (err) {
+            console.error("Error al revalidar el carrito:", err);
+            showToast("No se pudo contactar al servidor", "danger");
+            return;
+        }
         if (formaPago === "efectivo") {
             const pagado = parseFloat(cantidadPagadaInput.value) || 0;
             if (pagado < totalCarrito) {
@@ -372,11 +371,6 @@ document.addEventListener("DOMContentLoaded", () => {
             showToast("Compra confirmada con éxito", "success");
             carrito.clear();
             actualizarCarrito();
-            await fetch("/cashier/limpiar-carrito/", {
-                method: "POST",
-                credentials: "same-origin",
-                headers: { "X-CSRFToken": getCSRFToken() }
-            });
             confirmModal.hide();
             // Resetear completamente la UI para la siguiente venta
             try {
@@ -527,16 +521,28 @@ document.addEventListener("DOMContentLoaded", () => {
         const barcode = barcodeInput.value.trim();
         if (!barcode) return;
         try {
-            const res = await fetch(`/cashier/buscar-producto/?q=${encodeURIComponent(barcode)}${cajaId ? `&caja_id=${encodeURIComponent(cajaId)}` : ''}`);
+            // Búsqueda exacta (caché del servidor, sin escrituras); el carrito se actualiza localmente
+            const res = await fetch("/cashier/escanear/", {
+                method: "POST",
+                credentials: "same-origin",
+                headers: {
+                    "Content-Type": "application/json",
+                    "X-CSRFToken": getCSRFToken(),
+                    "X-Requested-With": "XMLHttpRequest"
+                },
+                body: JSON.stringify({ codigo: barcode, caja_id: cajaId, carrito_local: true })
+            });
             const data = await res.json();
-            if (data.productos.length > 0) {
-                const product = data.productos[0];
-                agregarAlCarrito(product.id);
-                barcodeInput.value = "";
-            } else {
+            barcodeInput.value = "";
+            if (res.status === 404) {
                 showToast("Producto no encontrado. Intenta de nuevo.", "warning");
-                barcodeInput.value = "";
+                return;
+            }
+            if (!res.ok || data.error) {
+                showToast(data.error || `HTTP ${res.status}`, 'danger');
+                return;
             }
+            agregarAlCarrito(data.producto);
         } catch (err) {
             console.error(err);
             showToast("Error al buscar producto por código de barras.", "danger");
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
@@ -10,3 +11,8 @@ class Sucursal(models.Model):
     
     def __str__(self):
         return self.nombre
+
+    @property
+    def umbral_stock_bajo(self):
+        """Umbral de stock bajo de la sucursal; 0 usa LOW_STOCK_THRESHOLD."""
+        return self.low_stock_threshold or getattr(settings, 'LOW_STOCK_THRESHOLD', 2)
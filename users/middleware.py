@@ -16,6 +16,7 @@ class AutoLogoutMiddleware:
         if last_activity and now - last_activity > max_idle:
             logout(request)
             messages.info(request, "Has sido desconectado por inactividad.")
-        else:
+        elif not last_activity or now - last_activity >= getattr(settings, 'SESSION_ACTIVITY_RESOLUTION', 60):
+            # La actividad se registra con resolución gruesa: así la sesión no se guarda en cada request
             request.session['last_activity'] = now
         return self.get_response(request)
\ No newline at end of file
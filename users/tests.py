@@ -1,3 +1,45 @@
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from tests.factories import create_user
+
+
+def _escrituras_sesion(ctx):
+    return [q['sql'] for q in ctx.captured_queries
+            if 'django_session' in q['sql'] and q['sql'].split()[0].upper() in ('INSERT', 'UPDATE')]
+
+
+@override_settings(SESSION_ACTIVITY_RESOLUTION=60, AUTO_LOGOUT_DELAY=7200)
+class AutoLogoutActividadTests(TestCase):
+    def setUp(self):
+        self.user = create_user('sesion_user', is_staff=False)
+        self.client.force_login(self.user)
+
+    def _retrasar_actividad(self, segundos):
+        session = self.client.session
+        session['last_activity'] -= segundos
+        session.save()
+
+    def test_actividad_se_escribe_a_lo_mas_una_vez_por_ventana(self):
+        self.client.get('/healthz')
+        self.assertIn('last_activity', self.client.session)
+        with CaptureQueriesContext(connection) as ctx:
+            for _ in range(3):
+                self.client.get('/healthz')
+        self.assertEqual(_escrituras_sesion(ctx), [])
+
+    def test_actividad_se_renueva_pasada_la_ventana(self):
+        self.client.get('/healthz')
+        self._retrasar_actividad(61)
+        anterior = self.client.session['last_activity']
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/healthz')
+        self.assertEqual(len(_escrituras_sesion(ctx)), 1)
+        self.assertGreater(self.client.session['last_activity'], anterior)
+
+    def test_inactividad_cierra_la_sesion(self):
+        self.client.get('/healthz')
+        self._retrasar_actividad(7201)
+        self.client.get('/healthz')
+        self.assertNotIn('_auth_user_id', self.client.session)